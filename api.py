@@ -1,13 +1,193 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import Any, Dict
+import hmac
+import math
+import os
+import threading
+
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from capacity import CalendarError, CapacityEngine
+from fleet import FleetAggregator
+from jobs import JobQueue, QueueFull, default_workers
+from kpi_cache import ResultCache, etag_for, etag_matches, instance_key
+from kpi_history import DEFAULT_MAX_POINTS, KpiHistory
+from live import KpiBroadcaster, sse_events
+from metrics import MetricsMiddleware, mark, profiler, register_counters, register_gauges, render_metrics, stage
+from ndjson_pipeline import aiter_line_batches, ascore_lines, encode
+from realtime import IngestHub
+from responses import render, shape, wants_msgpack
+from monte_carlo import monte_carlo
+from optimizer import DEFAULT_BUFFER_COST, DEFAULT_MACHINE_COST, optimize
+from simulation import simulate
+from static_assets import build as build_ui
+from sweep import sweep
+from template_validation import TwinChecker, schema_model, validation_errors
+from twin_graph import LineGraph, line_kpis, rework_settings
+from twin_registry import PatchError, TwinRegistry, VersionConflict
 
 app = FastAPI(title="Digital Twin as a Service", version="0.1")
+app.add_middleware(MetricsMiddleware)
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# registro e storico si aprono al primo uso: importare api (script, CLI, worker) non crea file
+_registry: Optional[TwinRegistry] = None
+_fleet: Optional[FleetAggregator] = None
+_stores_lock = threading.Lock()
+
+
+def get_registry() -> TwinRegistry:
+    global _registry, _fleet
+    with _stores_lock:
+        if _registry is None:
+            _registry = TwinRegistry(os.environ.get("DTAAS_REGISTRY_PATH", os.path.join(base_dir, "twins.sqlite3")),
+                                     checker=TwinChecker(TEMPLATES["line_v1"]["schema"]))
+            _fleet = FleetAggregator(_registry)
+        return _registry
+
+
+def get_fleet() -> FleetAggregator:
+    get_registry()
+    return _fleet
+
+
+capacity = CapacityEngine()
+
+realtime_hub = IngestHub(window_s=float(os.environ.get("DTAAS_REALTIME_WINDOW_S", "3600")))
+
+_history: Optional[KpiHistory] = None
+
+
+def get_history() -> KpiHistory:
+    global _history
+    with _stores_lock:
+        if _history is None:
+            _history = KpiHistory(os.environ.get("DTAAS_HISTORY_PATH", os.path.join(base_dir, "kpi_history")))
+        return _history
+
+
+live_kpis = KpiBroadcaster()
+LIVE_MAX_RATE_HZ = float(os.environ.get("DTAAS_LIVE_MAX_RATE_HZ", "2"))
+
+kpi_cache = ResultCache(
+    maxsize=int(os.environ.get("DTAAS_CACHE_SIZE", "1024")),
+    ttl_s=float(os.environ.get("DTAAS_CACHE_TTL_S", "300"))
+)
+
+
+def _service_gauges() -> Dict[str, Tuple[float, str]]:
+    cache = kpi_cache.stats()
+    live = live_kpis.stats()
+    return {
+        "dtaas_kpi_cache_entries": (cache["size"], "Entries in the KPI cache."),
+        "dtaas_kpi_cache_inflight": (cache["inflight"], "KPI computations in flight."),
+        "dtaas_live_topics": (live["topics"], "Twins with a live KPI topic."),
+        "dtaas_live_subscribers": (live["subscribers"], "Open live KPI streams."),
+    }
+
+
+def _service_counters() -> Dict[str, Tuple[float, str]]:
+    cache = kpi_cache.stats()
+    return {
+        "dtaas_kpi_cache_hits_total": (cache["hits"], "KPI cache hits since start."),
+        "dtaas_kpi_cache_misses_total": (cache["misses"], "KPI cache misses since start."),
+        "dtaas_kpi_cache_coalesced_total": (cache["coalesced"], "Requests that joined an in-flight computation."),
+        "dtaas_kpi_cache_evictions_total": (cache["evictions"], "KPI cache evictions since start."),
+        "dtaas_realtime_events_accepted_total": (realtime_hub.accepted, "Realtime events accepted since start."),
+        "dtaas_realtime_events_rejected_total": (realtime_hub.rejected, "Realtime events rejected since start."),
+        "dtaas_history_points_appended_total": (_history.points_appended if _history is not None else 0,
+                                                "KPI history points appended since start."),
+    }
+
+
+register_gauges(_service_gauges)
+register_counters(_service_counters)
 
 
 # ---- Helpers (uguali a quello che hai già fatto) ----
 
+def _station_node(station: Dict[str, Any]) -> Dict[str, Any]:
+    params = {
+        "cycle_time_s": station["cycle_time_s"],
+        "availability_pct": station["availability_pct"],
+        "setup_time_s": station.get("setup_time_s", 0),
+        "scrap_rate_pct": station.get("scrap_rate_pct", 0.0)
+    }
+    for name, value in params.items():
+        if not math.isfinite(float(value)):
+            raise ValueError(f"station {station['id']!r}: {name} must be a finite number")
+    if "machines" in station:
+        machines = station["machines"]
+        if isinstance(machines, bool) or not isinstance(machines, int) or machines < 1:
+            raise ValueError(f"station {station['id']!r}: machines must be an integer >= 1")
+        params["machines"] = machines
+    return {
+        "id": station["id"],
+        "kind": "station",
+        "station_type": station["type"],
+        "params": params
+    }
+
+
+def _compile_line_edges(stations: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # senza edges espliciti la linea è seriale nell'ordine delle stazioni
+    ids = [s["id"] for s in stations]
+    if not edges:
+        chain = ["SRC"] + ids + ["SNK"]
+        return [{"from": a, "to": b} for a, b in zip(chain, chain[1:])]
+
+    known = set(ids) | {"SRC", "SNK"}
+    has_in = set()
+    has_out = set()
+    out = []
+    for e in edges:
+        if e["from"] not in known or e["to"] not in known:
+            raise ValueError(f"edge {e['from']!r} -> {e['to']!r} references an unknown station")
+        if e["to"] == "SRC" or e["from"] == "SNK":
+            raise ValueError(f"edge {e['from']!r} -> {e['to']!r}: nothing enters SRC or leaves SNK")
+        edge = {"from": e["from"], "to": e["to"]}
+        if "split" in e:
+            edge["split"] = e["split"]
+        if "buffer" in e:
+            edge["buffer"] = e["buffer"]
+        out.append(edge)
+        has_out.add(e["from"])
+        has_in.add(e["to"])
+    # stazioni senza ingresso/uscita vengono collegate a SRC/SNK
+    head = [{"from": "SRC", "to": i} for i in ids if i not in has_in]
+    tail = [{"from": i, "to": "SNK"} for i in ids if i not in has_out]
+    return head + out + tail
+
+
+def _line_info(line: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: line[k] for k in ("shift_hours", "target_throughput_pph", "tags") if k in line}
+
+
 def compile_twin(instance: Dict[str, Any]) -> Dict[str, Any]:
+    if "stations" in instance:
+        stations = instance["stations"]
+        ids = [s["id"] for s in stations]
+        if len(set(ids)) != len(ids) or {"SRC", "SNK"} & set(ids):
+            raise ValueError("station ids must be unique and not SRC/SNK")
+        nodes = [{"id": "SRC", "kind": "source"}]
+        nodes += [_station_node(s) for s in stations]
+        nodes.append({"id": "SNK", "kind": "sink"})
+        return {
+            "twin_id": instance["line"]["line_name"],
+            "type": "multi_station_line",
+            "nodes": nodes,
+            "edges": _compile_line_edges(stations, instance.get("edges", [])),
+            "line": _line_info(instance["line"]),
+            "quality": instance.get("quality", {}),
+            "data": instance.get("data", {})
+        }
+
     station = instance["station"]
 
     twin = {
@@ -15,23 +195,14 @@ def compile_twin(instance: Dict[str, Any]) -> Dict[str, Any]:
         "type": "single_station_cell",
         "nodes": [
             {"id": "SRC", "kind": "source"},
-            {
-                "id": station["id"],
-                "kind": "station",
-                "station_type": station["type"],
-                "params": {
-                    "cycle_time_s": station["cycle_time_s"],
-                    "availability_pct": station["availability_pct"],
-                    "setup_time_s": station.get("setup_time_s", 0),
-                    "scrap_rate_pct": station.get("scrap_rate_pct", 0.0)
-                }
-            },
+            _station_node(station),
             {"id": "SNK", "kind": "sink"}
         ],
         "edges": [
             {"from": "SRC", "to": station["id"]},
             {"from": station["id"], "to": "SNK"}
         ],
+        "line": _line_info(instance["line"]),
         "quality": instance.get("quality", {}),
         "data": instance.get("data", {})
     }
@@ -39,28 +210,221 @@ def compile_twin(instance: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def compute_kpis(twin: Dict[str, Any]) -> Dict[str, Any]:
-    station_node = next(n for n in twin["nodes"] if n["kind"] == "station")
-    p = station_node["params"]
+    return line_kpis(LineGraph.from_twin(twin))
+
+
+def twin_error(e: Exception, loc: Tuple[Any, ...] = ("body", "instance")) -> RequestValidationError:
+    """Same structured 422 as a schema error, for an instance the engine rejects (topology, params)."""
+    return RequestValidationError([{"type": "value_error", "loc": loc, "msg": f"{type(e).__name__}: {e}",
+                                    "input": None}])
+
+
+def scored_twin(instance: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Compile and score an instance; raises `twin_error` if it cannot be scored."""
+    try:
+        twin = compile_twin(instance)
+        return twin, compute_kpis(twin)
+    except (KeyError, TypeError, ValueError) as e:
+        raise twin_error(e) from None
+
+
+def compute_kpis_batch(instances: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Score many instances in one vectorized pass.
+
+    Station params are packed into NumPy columns and the throughput formula of
+    `compute_kpis` is evaluated once for the whole batch. An instance that
+    cannot be scored gets an `{"error": ...}` entry in its slot instead of
+    failing the batch.
+    """
+    n = len(instances)
+    results: List[Dict[str, Any]] = [{} for _ in range(n)]
+    rows: List[int] = []
+    twin_ids: List[str] = []
+    station_ids: List[str] = []
+    cycle = np.empty(n, dtype=np.float64)
+    availability = np.empty(n, dtype=np.float64)
+    scrap = np.empty(n, dtype=np.float64)
+    machines = np.empty(n, dtype=np.float64)
+
+    for i, instance in enumerate(instances):
+        try:
+            # linee e celle con rilavorazione passano dal motore completo
+            if "stations" in instance or rework_settings(instance.get("quality")) is not None:
+                twin = compile_twin(instance)
+                results[i] = {"twin_id": twin["twin_id"], "kpis": compute_kpis(twin)}
+                continue
+            station = instance["station"]
+            # stessi controlli (e default) del nodo compilato da compile_twin
+            params = _station_node(station)["params"]
+            c = float(params["cycle_time_s"])
+            a = float(params["availability_pct"])
+            s = float(params["scrap_rate_pct"])
+            m = params.get("machines", 1)
+            if c <= 0:
+                raise ValueError("cycle_time_s must be > 0")
+            twin_id = instance["line"]["line_name"]
+            station_id = station["id"]
+        except (KeyError, TypeError, ValueError) as e:
+            results[i] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        k = len(rows)
+        cycle[k] = c
+        availability[k] = a
+        scrap[k] = s
+        machines[k] = m
+        rows.append(i)
+        twin_ids.append(twin_id)
+        station_ids.append(station_id)
+
+    k = len(rows)
+    cycle = cycle[:k]
+    availability = availability[:k] / 100.0
+    scrap = scrap[:k] / 100.0
+    # stesso ordine delle operazioni di station_capacity_pph: risultati identici al motore
+    throughput_pph = np.round(machines[:k] * (3600.0 / cycle) * availability * (1.0 - scrap), 2)
+
+    for j, i in enumerate(rows):
+        results[i] = {
+            "twin_id": twin_ids[j],
+            "kpis": {
+                "throughput_pph": float(throughput_pph[j]),
+                "cycle_time_s": float(cycle[j]),
+                "availability": float(availability[j]),
+                "scrap_rate": float(scrap[j]),
+                "bottleneck": station_ids[j]
+            }
+        }
+    return results
 
-    cycle = float(p["cycle_time_s"])
-    availability = float(p["availability_pct"]) / 100.0
-    scrap = float(p.get("scrap_rate_pct", 0.0)) / 100.0
 
-    throughput_pph = (3600.0 / cycle) * availability * (1.0 - scrap)
+# ---- API (service) ----
 
-    return {
-        "throughput_pph": round(throughput_pph, 2),
-        "cycle_time_s": cycle,
-        "availability": availability,
-        "scrap_rate": scrap,
-        "bottleneck": station_node["id"]
-    }
+class InstancePayload(BaseModel):
+    instance: Dict[str, Any]
+    template_id: Optional[str] = None
 
 
-# ---- API (service) ----
+class BatchPayload(BaseModel):
+    instances: List[Dict[str, Any]]
+    template_id: Optional[str] = None
 
-class InstancePayload(BaseModel):
+
+class RealtimeEvent(BaseModel):
+    twin_id: str
+    station: str
+    type: str
+    ts: Optional[float] = Field(None, allow_inf_nan=False)
+    duration_s: float = Field(0.0, allow_inf_nan=False)
+
+
+class RealtimeEventsPayload(BaseModel):
+    events: List[RealtimeEvent]
+
+
+class HistoryPointsPayload(BaseModel):
+    ts: List[float]
+    throughput_pph: List[float]
+    availability: List[float]
+    scrap_rate: List[float]
+
+
+class SweepPayload(BaseModel):
+    instance: Dict[str, Any]
+    template_id: Optional[str] = None
+    params: Dict[str, Dict[str, Any]]
+    target_throughput_pph: Optional[float] = None
+    max_results: int = 100
+
+
+class CapacityPayload(BaseModel):
+    calendar: Dict[str, Any]
+    start: Union[str, float]
+    end: Union[str, float]
+    period: Optional[str] = None
+    twin_ids: Optional[List[str]] = None
+    where: Optional[Dict[str, str]] = None
+    changeovers: Dict[str, List[Union[str, float]]] = {}
+    setup_at_shift_start: bool = True
+
+
+class MonteCarloPayload(BaseModel):
     instance: Dict[str, Any]
+    template_id: Optional[str] = None
+    distributions: Dict[str, Dict[str, Any]]
+    seed: int = 0
+    max_samples: int = 1_000_000
+    min_samples: int = 10_000
+    tolerance: float = 0.0025
+    target_throughput_pph: Optional[float] = None
+
+
+class TwinPatchPayload(BaseModel):
+    ops: List[Dict[str, Any]]
+    version: Optional[int] = None
+
+
+class OptimizePayload(BaseModel):
+    instance: Dict[str, Any]
+    template_id: Optional[str] = None
+    target_throughput_pph: Optional[float] = None
+    machine_cost: Union[float, Dict[str, float]] = DEFAULT_MACHINE_COST
+    buffer_cost: Union[float, Dict[str, float]] = DEFAULT_BUFFER_COST
+    max_machines: int = 4
+    max_buffer: int = 50
+    max_nodes: int = 2000
+
+
+class SimulationPayload(BaseModel):
+    instance: Dict[str, Any]
+    template_id: Optional[str] = None
+    replications: int = 30
+    seed: int = 0
+
+
+def resolve_template_id(instance: Dict[str, Any], template_id: Optional[str]) -> str:
+    # senza template_id esplicito si deduce dalla forma dell'instance
+    if template_id is not None:
+        return template_id
+    return "line_v1" if "stations" in instance else "single_station_v1"
+
+
+def instance_errors(instance: Dict[str, Any], template_id: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    template_id = resolve_template_id(instance, template_id)
+    model = TEMPLATE_MODELS.get(template_id)
+    if model is None:
+        return [{"type": "template_not_found", "loc": ("template_id",),
+                 "msg": f"Unknown template {template_id!r}", "input": template_id}]
+    return validation_errors(model, instance)
+
+
+def validate_instance(instance: Dict[str, Any], template_id: Optional[str],
+                      loc: Tuple[str, ...] = ("body", "instance")) -> None:
+    errors = instance_errors(instance, template_id)
+    if errors:
+        raise RequestValidationError([
+            dict(e, loc=(("body",) if e["type"] == "template_not_found" else loc) + tuple(e["loc"]))
+            for e in errors
+        ])
+
+
+def score_record(record: Any) -> Dict[str, Any]:
+    """Score one bulk record: `{"instance": ..., "template_id": ...}` or a bare instance."""
+    if not isinstance(record, dict):
+        return {"error": "expected a JSON object"}
+    if "instance" in record:
+        instance, template_id = record["instance"], record.get("template_id")
+    else:
+        instance, template_id = record, None
+    if not isinstance(instance, dict):
+        return {"error": "instance must be a JSON object"}
+    errors = instance_errors(instance, template_id)
+    if errors:
+        return {"error": "validation failed", "detail": errors}
+    try:
+        twin = compile_twin(instance)
+        return {"twin_id": twin["twin_id"], "kpis": compute_kpis(twin)}
+    except (KeyError, TypeError, ValueError) as e:
+        return {"error": f"{type(e).__name__}: {e}"}
 
 
 @app.get("/status")
@@ -69,120 +433,473 @@ def status():
 
 
 @app.post("/generate-twin")
-def generate_twin(payload: InstancePayload):
-    twin = compile_twin(payload.instance)
-    return {"twin": twin}
+def generate_twin(payload: InstancePayload, request: Request):
+    mark("parse")
+    with stage("validate"):
+        validate_instance(payload.instance, payload.template_id)
+    with stage("compile"):
+        # un twin che il motore non sa valutare non è un twin valido
+        twin, _ = scored_twin(payload.instance)
+    with stage("serialize"):
+        return render({"twin": twin}, request.headers.get("accept"))
+
+
+def _compute_kpi_result(instance: Dict[str, Any], template_id: str) -> Dict[str, Any]:
+    with stage("validate"):
+        validate_instance(instance, template_id)
+    # gli errori del motore escono come 422 anche dalla cache (e a chi attende lo stesso calcolo)
+    try:
+        with stage("compile"):
+            twin = compile_twin(instance)
+        with stage("compute"):
+            kpis = compute_kpis(twin)
+    except (KeyError, TypeError, ValueError) as e:
+        raise twin_error(e) from None
+    return {"twin_id": twin["twin_id"], "kpis": kpis, "twin": twin}
 
 
 @app.post("/compute-kpi")
-def compute_kpi(payload: InstancePayload):
+def compute_kpi(payload: InstancePayload, request: Request,
+                include_twin: bool = True, fields: Optional[str] = None):
+    mark("parse")
+    # la validazione avviene solo sui miss: un hit è già stato validato
+    template_id = resolve_template_id(payload.instance, payload.template_id)
+    with stage("hash"):
+        key = instance_key([template_id, payload.instance])
+    accept = request.headers.get("accept")
+    # ogni forma/codifica della risposta ha il suo ETag
+    variant = None
+    if fields is not None or not include_twin or wants_msgpack(accept):
+        variant = instance_key([fields, include_twin, wants_msgpack(accept)])[:8]
+    etag = etag_for(key, variant)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+    result = kpi_cache.get_or_compute(key, lambda: _compute_kpi_result(payload.instance, template_id))
+    with stage("serialize"):
+        return render(shape(result, fields, include_twin), accept, headers={"ETag": etag})
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return kpi_cache.stats()
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/debug/profiler")
+def profiler_status(limit: Optional[int] = None):
+    """Profiler state plus the collapsed stacks sampled so far."""
+    return dict(profiler.status(), collapsed=profiler.collapsed(limit))
+
+
+# senza token configurato il profiler non si accende da remoto
+PROFILER_TOKEN = os.environ.get("DTAAS_PROFILER_TOKEN", "")
+
+
+@app.post("/debug/profiler")
+def profiler_switch(enabled: bool, interval_ms: float = 5.0, reset: bool = True,
+                    x_profiler_token: Optional[str] = Header(None)):
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=403, detail="profiler control is disabled (set DTAAS_PROFILER_TOKEN)")
+    if x_profiler_token is None or not hmac.compare_digest(x_profiler_token.encode(), PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid profiler token")
+    if interval_ms <= 0:
+        raise HTTPException(status_code=400, detail="interval_ms must be positive")
+    if enabled:
+        profiler.start(interval_ms / 1000.0, reset=reset)
+    else:
+        profiler.stop()
+    return profiler.status()
+
+
+@app.post("/compute-kpi/batch")
+def compute_kpi_batch(payload: BatchPayload, request: Request):
+    results: List[Dict[str, Any]] = [{} for _ in payload.instances]
+    valid: List[int] = []
+    for i, instance in enumerate(payload.instances):
+        errors = instance_errors(instance, payload.template_id)
+        if errors:
+            results[i] = {"error": "validation failed", "detail": errors}
+        else:
+            valid.append(i)
+    for i, r in zip(valid, compute_kpis_batch([payload.instances[i] for i in valid])):
+        results[i] = r
+    n_errors = sum(1 for r in results if "error" in r)
+    return render({"count": len(results), "errors": n_errors, "results": results}, request.headers.get("accept"))
+
+class NDJSONStreamResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        # il body della request viene letto dal generatore stesso: niente
+        # listener di disconnessione concorrente che consumi i messaggi
+        await self.stream_response(send)
+
+
+@app.post("/compute-kpi/stream", response_class=NDJSONStreamResponse)
+async def compute_kpi_stream(request: Request):
+    async def results():
+        async for result in ascore_lines(aiter_line_batches(request.stream()), score_record,
+                                              offload=run_in_threadpool):
+            yield encode(result)
+    return NDJSONStreamResponse(results())
+
+
+@app.post("/twins")
+def register_twin(payload: InstancePayload):
+    validate_instance(payload.instance, payload.template_id)
+    twin, _ = scored_twin(payload.instance)
+    record = get_registry().put(twin)
+    get_history().record(record["twin_id"], record["kpis"])
+    if live_kpis.has_subscribers(record["twin_id"]):
+        live_kpis.publish(record["twin_id"], record["kpis"])
+    return record
+
+
+@app.get("/twins")
+def list_twins():
+    return get_registry().list()
+
+
+@app.get("/twins/{twin_id}")
+def get_twin(twin_id: str):
+    record = get_registry().get(twin_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="twin not found")
+    return record
+
+
+@app.patch("/twins/{twin_id}")
+def patch_twin(twin_id: str, payload: TwinPatchPayload):
+    try:
+        record = get_registry().patch(twin_id, payload.ops, expected_version=payload.version)
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if record is None:
+        raise HTTPException(status_code=404, detail="twin not found")
+    get_history().record(twin_id, record["kpis"])
+    if live_kpis.has_subscribers(twin_id):
+        live_kpis.publish(twin_id, get_registry().get(twin_id)["kpis"])
+    return record
+
+
+@app.delete("/twins/{twin_id}")
+def delete_twin(twin_id: str):
+    if not get_registry().delete(twin_id):
+        raise HTTPException(status_code=404, detail="twin not found")
+    return {"twin_id": twin_id, "deleted": True}
+
+
+def _parse_tags(value: Optional[str]) -> Dict[str, str]:
+    out = {}
+    for item in filter(None, (v.strip() for v in (value or "").split(","))):
+        key, sep, tag = item.partition("=")
+        if not sep or not key:
+            raise HTTPException(status_code=400, detail=f"expected tag=value, got {item!r}")
+        out[key] = tag
+    return out
+
+
+@app.get("/fleet")
+def fleet_kpis(group_by: str = "site", where: Optional[str] = None, top: int = 5):
+    """Registered twins grouped by tags, e.g. `?group_by=site,area&where=family=body`."""
+    keys = [k.strip() for k in group_by.split(",") if k.strip()]
+    if top < 0:
+        raise HTTPException(status_code=400, detail="top must be >= 0")
+    return get_fleet().aggregate(keys, _parse_tags(where), top)
+
+
+@app.get("/fleet/stats")
+def fleet_stats():
+    return get_fleet().stats()
+
+
+@app.post("/capacity")
+def compute_capacity(payload: CapacityPayload):
+    """Net available hours and output of registered twins over a shift calendar."""
+    wanted = set(payload.twin_ids) if payload.twin_ids is not None else None
+    where = payload.where or {}
+    members = [(t, v) for t, v, tags in get_registry().index()
+               if (wanted is None or t in wanted) and all(tags.get(k) == x for k, x in where.items())]
+    if wanted is not None and len(members) < len(wanted):
+        missing = sorted(wanted - {t for t, _ in members})
+        raise HTTPException(status_code=404, detail=f"twins not found: {missing[:20]}")
+    summaries = get_fleet().summaries(members)
+    twins = [(t, v, summaries[t]) for t, v in sorted(members) if t in summaries]
+    try:
+        return capacity.compute(payload.calendar, twins, payload.start, payload.end, payload.period,
+                                payload.changeovers, payload.setup_at_shift_start)
+    except CalendarError as e:
+        raise RequestValidationError([{"type": "value_error", "loc": ("body", "calendar"), "msg": str(e),
+                                       "input": None}])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/capacity/stats")
+def capacity_stats():
+    return capacity.stats()
+
+
+@app.post("/realtime/events")
+def ingest_realtime_events(payload: RealtimeEventsPayload):
+    accepted = realtime_hub.ingest_many(e.model_dump() for e in payload.events)
+    for twin_id in {e.twin_id for e in payload.events}:
+        kpis = realtime_hub.twin_kpis(twin_id)
+        # finestra ancora troppo corta: niente storico né aggiornamenti live
+        if kpis is None or kpis["warming_up"]:
+            continue
+        get_history().record(twin_id, kpis)
+        if live_kpis.has_subscribers(twin_id):
+            live_kpis.publish(twin_id, kpis)
+    return {"accepted": accepted, "rejected": len(payload.events) - accepted}
+
+
+@app.get("/realtime/{twin_id}/kpis")
+def realtime_kpis(twin_id: str):
+    kpis = realtime_hub.twin_kpis(twin_id)
+    if kpis is None:
+        raise HTTPException(status_code=404, detail="no realtime data for twin")
+    return {"twin_id": twin_id, "kpis": kpis}
+
+
+@app.get("/history")
+def list_history():
+    return {"twins": get_history().twins()}
+
+
+@app.post("/history/{twin_id}")
+def append_history(twin_id: str, payload: HistoryPointsPayload):
+    try:
+        n = get_history().append(twin_id, payload.ts, throughput_pph=payload.throughput_pph,
+                           availability=payload.availability, scrap_rate=payload.scrap_rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"twin_id": twin_id, "appended": n}
+
+
+@app.get("/history/{twin_id}")
+def query_history(twin_id: str, request: Request, start: Optional[float] = None, end: Optional[float] = None,
+                  resolution: str = "auto", max_points: int = DEFAULT_MAX_POINTS):
+    try:
+        result = get_history().query(twin_id, start, end, resolution, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="no history for twin")
+    return render(result, request.headers.get("accept"))
+
+
+@app.get("/twins/{twin_id}/kpis/stream")
+async def stream_twin_kpis(twin_id: str, max_rate_hz: Optional[float] = None):
+    # il client può rallentare, non superare il limite di coalescenza del server
+    rate = min(max_rate_hz, LIVE_MAX_RATE_HZ) if max_rate_hz and max_rate_hz > 0 else LIVE_MAX_RATE_HZ
+    record = await run_in_threadpool(get_registry().get, twin_id)
+    updates = live_kpis.subscribe(twin_id, min_interval_s=1.0 / rate,
+                                  initial=record["kpis"] if record is not None else None)
+    return StreamingResponse(
+        sse_events(updates),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def run_simulation(payload: SimulationPayload, parallel: bool = True,
+                   progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
     twin = compile_twin(payload.instance)
-    kpis = compute_kpis(twin)
-    return {"twin_id": twin["twin_id"], "kpis": kpis, "twin": twin}
+    if twin["data"].get("mode", "simulation") != "simulation":
+        raise ValueError("twin is not in simulation mode")
+    result = simulate(twin, replications=payload.replications, seed=payload.seed,
+                      parallel=parallel, progress=progress)
+    return {"twin_id": twin["twin_id"], "simulation": result}
+
+
+def run_sweep(payload: SweepPayload, progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    twin = compile_twin(payload.instance)
+    result = sweep(twin, payload.params, payload.target_throughput_pph, payload.max_results)
+    return {"twin_id": twin["twin_id"], "sweep": result}
+
+
+def run_monte_carlo(payload: MonteCarloPayload, parallel: bool = True,
+                    progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    twin = compile_twin(payload.instance)
+    result = monte_carlo(
+        twin, payload.distributions, seed=payload.seed,
+        max_samples=payload.max_samples, min_samples=payload.min_samples,
+        tolerance=payload.tolerance, target_throughput_pph=payload.target_throughput_pph,
+        parallel=parallel, progress=progress
+    )
+    return {"twin_id": twin["twin_id"], "monte_carlo": result}
+
+
+def run_optimize(payload: OptimizePayload, parallel: bool = True,
+                 progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    twin = compile_twin(payload.instance)
+    result = optimize(
+        twin, payload.target_throughput_pph, machine_cost=payload.machine_cost,
+        buffer_cost=payload.buffer_cost, max_machines=payload.max_machines,
+        max_buffer=payload.max_buffer, max_nodes=payload.max_nodes, parallel=parallel, progress=progress
+    )
+    return {"twin_id": twin["twin_id"], "optimization": result}
+
+
+@app.post("/simulate")
+def simulate_twin(payload: SimulationPayload):
+    validate_instance(payload.instance, payload.template_id)
+    try:
+        return run_simulation(payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/sweep")
+def sweep_params(payload: SweepPayload):
+    validate_instance(payload.instance, payload.template_id)
+    try:
+        return run_sweep(payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/monte-carlo")
+def monte_carlo_kpis(payload: MonteCarloPayload):
+    validate_instance(payload.instance, payload.template_id)
+    try:
+        return run_monte_carlo(payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/optimize")
+def optimize_line(payload: OptimizePayload):
+    validate_instance(payload.instance, payload.template_id)
+    try:
+        return run_optimize(payload)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ---- Jobs ----
+# i job girano nel pool dedicato: i motori restano seriali (niente pool annidati)
+
+def _simulation_job(body: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    return run_simulation(SimulationPayload.model_validate(body), parallel=False, progress=progress)
+
+
+def _sweep_job(body: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    return run_sweep(SweepPayload.model_validate(body), progress=progress)
+
+
+def _monte_carlo_job(body: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    return run_monte_carlo(MonteCarloPayload.model_validate(body), parallel=False, progress=progress)
+
+
+def _optimize_job(body: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    return run_optimize(OptimizePayload.model_validate(body), parallel=False, progress=progress)
+
+
+def _batch_job(body: Dict[str, Any], progress: Callable[[float], None]) -> Dict[str, Any]:
+    payload = BatchPayload.model_validate(body)
+    results: List[Dict[str, Any]] = []
+    step = 1000
+    for lo in range(0, len(payload.instances), step):
+        results += compute_kpis_batch(payload.instances[lo:lo + step])
+        progress(len(results) / len(payload.instances))
+    n_errors = sum(1 for r in results if "error" in r)
+    return {"count": len(results), "errors": n_errors, "results": results}
+
+
+JOB_KINDS = {
+    "simulate": (SimulationPayload, _simulation_job),
+    "sweep": (SweepPayload, _sweep_job),
+    "monte-carlo": (MonteCarloPayload, _monte_carlo_job),
+    "optimize": (OptimizePayload, _optimize_job),
+    "compute-kpi-batch": (BatchPayload, _batch_job),
+}
+
+job_queue = JobQueue(
+    max_workers=default_workers(),
+    result_ttl_s=float(os.environ.get("DTAAS_JOB_RESULT_TTL_S", "3600")),
+    max_queued=int(os.environ.get("DTAAS_JOB_MAX_QUEUED", "1000"))
+)
+
+register_gauges(lambda: {
+    f"dtaas_jobs_{status}": (count, f"Jobs currently {status}.")
+    for status, count in job_queue.stats().items() if status != "max_workers"
+})
+
+
+class JobPayload(BaseModel):
+    kind: str
+    payload: Dict[str, Any]
+    priority: int = 0
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(job: JobPayload):
+    if job.kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"unknown job kind {job.kind!r}; expected one of {sorted(JOB_KINDS)}")
+    model, fn = JOB_KINDS[job.kind]
+    try:
+        body = model.model_validate(job.payload)
+    except ValidationError as e:
+        raise RequestValidationError([dict(err, loc=("body", "payload") + tuple(err["loc"]))
+                                      for err in e.errors(include_url=False)])
+    if job.kind == "compute-kpi-batch":
+        for i, instance in enumerate(body.instances):
+            validate_instance(instance, body.template_id, loc=("body", "payload", "instances", i))
+    else:
+        validate_instance(body.instance, body.template_id, loc=("body", "payload", "instance"))
+    try:
+        return job_queue.submit(job.kind, fn, body.model_dump(), job.priority)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": job_queue.list(), "stats": job_queue.stats()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired)")
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired)")
+    return job
 
 @app.get("/")
 def root():
     return {"status": "ok", "service": "DTaaS", "docs": "/docs"}
 
-from fastapi.responses import HTMLResponse
-
-@app.get("/ui", response_class=HTMLResponse)
-def ui():
-    # JSON di esempio pre-caricato nella textarea
-    sample = r'''{
-  "instance": {
-    "line": {
-      "line_name": "Assembly_Cell_A",
-      "shift_hours": 8,
-      "target_throughput_pph": 180
-    },
-    "station": {
-      "id": "S1",
-      "type": "assembly",
-      "cycle_time_s": 20,
-      "availability_pct": 92,
-      "setup_time_s": 5,
-      "scrap_rate_pct": 1.5
-    },
-    "quality": {
-      "inspection_enabled": true,
-      "rework_enabled": false,
-      "rework_cycle_time_s": 60
-    },
-    "data": {
-      "mode": "simulation"
-    }
-  }
-}'''
-
-    return f"""
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8"/>
-  <meta name="viewport" content="width=device-width, initial-scale=1"/>
-  <title>DTaaS – Simple UI</title>
-  <style>
-    body {{ font-family: system-ui, Arial; max-width: 980px; margin: 40px auto; padding: 0 16px; }}
-    textarea {{ width: 100%; height: 260px; font-family: ui-monospace, Menlo, Consolas, monospace; }}
-    button {{ padding: 10px 14px; cursor: pointer; }}
-    pre {{ background: #f6f6f6; padding: 12px; overflow: auto; }}
-    .row {{ display:flex; gap: 12px; align-items:center; flex-wrap: wrap; }}
-  </style>
-</head>
-<body>
-  <h2>DTaaS – Simple UI</h2>
-  <p>Incolla (o modifica) la <b>instance</b> e premi <b>Compute KPI</b>.</p>
-
-  <textarea id="payload">{sample}</textarea>
-
-  <div class="row" style="margin-top:12px;">
-    <button onclick="compute()">Compute KPI</button>
-    <span id="status"></span>
-  </div>
-
-  <h3>Output</h3>
-  <pre id="out">—</pre>
-
-  <script>
-    async function compute() {{
-      const status = document.getElementById("status");
-      const out = document.getElementById("out");
-      status.textContent = "Running...";
-      out.textContent = "—";
-
-      let payload;
-      try {{
-        payload = JSON.parse(document.getElementById("payload").value);
-      }} catch (e) {{
-        status.textContent = "JSON non valido";
-        out.textContent = String(e);
-        return;
-      }}
-
-      try {{
-        const res = await fetch("/compute-kpi", {{
-          method: "POST",
-          headers: {{ "Content-Type": "application/json" }},
-          body: JSON.stringify(payload)
-        }});
-
-        const data = await res.json();
-        status.textContent = res.ok ? "OK" : ("Error " + res.status);
-        out.textContent = JSON.stringify(data, null, 2);
-      }} catch (e) {{
-        status.textContent = "Request failed";
-        out.textContent = String(e);
-      }}
-    }}
-  </script>
-
-  <p style="margin-top:20px;">
-    Docs API: <a href="/docs">/docs</a>
-  </p>
-</body>
-</html>
-"""
+# DTAAS_UI_CDN_FALLBACK=1: senza ui/vendor/ l'editor si carica dal CDN (versione fissata)
+ui_assets = build_ui(cdn_fallback=os.environ.get("DTAAS_UI_CDN_FALLBACK", "0") == "1",
+                     default_template="single_station_v1")
+
+@app.get("/ui")
+def ui(request: Request):
+    return ui_assets.page("index.html", request.headers)
+
+@app.get("/ui-template")
+def ui_template(request: Request):
+    return ui_assets.page("template.html", request.headers)
+
+@app.get("/static/{name:path}", include_in_schema=False)
+def static_asset(name: str, request: Request):
+    response = ui_assets.asset(name, request.headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return response
 
 TEMPLATES = {
     "single_station_v1": {
@@ -199,7 +916,8 @@ TEMPLATES = {
                     "properties": {
                         "line_name": { "type": "string", "minLength": 2, "title": "Line name" },
                         "shift_hours": { "type": "number", "minimum": 0.5, "maximum": 24, "title": "Shift duration (hours)" },
-                        "target_throughput_pph": { "type": "number", "minimum": 1, "title": "Target throughput (pcs/hour)" }
+                        "target_throughput_pph": { "type": "number", "minimum": 1, "title": "Target throughput (pcs/hour)" },
+                        "tags": { "type": "object", "title": "Fleet tags (site, area, line family...)" }
                     }
                 },
                 "station": {
@@ -221,7 +939,81 @@ TEMPLATES = {
                     "properties": {
                         "inspection_enabled": { "type": "boolean", "default": True, "title": "Inspection enabled" },
                         "rework_enabled": { "type": "boolean", "default": False, "title": "Rework active" },
-                        "rework_cycle_time_s": { "type": "number", "minimum": 1, "maximum": 900, "default": 60, "title": "Rework cycle time (s)" }
+                        "rework_cycle_time_s": { "type": "number", "minimum": 1, "maximum": 900, "default": 60, "title": "Rework cycle time (s)" },
+                        "rework_yield_pct": { "type": "number", "minimum": 0, "maximum": 100, "default": 100, "title": "Rework success (%)" }
+                    }
+                },
+                "data": {
+                    "type": "object",
+                    "required": ["mode"],
+                    "properties": {
+                        "mode": { "type": "string", "enum": ["simulation", "realtime"], "default": "simulation", "title": "Mode" },
+                        "opcua_endpoint": { "type": "string", "title": "OPC-UA endpoint (if realtime)" },
+                        "mqtt_topic_prefix": { "type": "string", "title": "MQTT topic prefix (if realtime)" }
+                    }
+                }
+            }
+        }
+    },
+    "line_v1": {
+        "template_id": "line_v1",
+        "name": "Multi-station line (parallel machines, merges)",
+        "schema": {
+            "$schema": "https://json-schema.org/draft/2020-12/schema",
+            "type": "object",
+            "required": ["line", "stations", "quality", "data"],
+            "properties": {
+                "line": {
+                    "type": "object",
+                    "required": ["line_name", "shift_hours", "target_throughput_pph"],
+                    "properties": {
+                        "line_name": { "type": "string", "minLength": 2, "title": "Line name" },
+                        "shift_hours": { "type": "number", "minimum": 0.5, "maximum": 24, "title": "Shift duration (hours)" },
+                        "target_throughput_pph": { "type": "number", "minimum": 1, "title": "Target throughput (pcs/hour)" },
+                        "tags": { "type": "object", "title": "Fleet tags (site, area, line family...)" }
+                    }
+                },
+                "stations": {
+                    "type": "array",
+                    "title": "Stations",
+                    "minItems": 1,
+                    "items": {
+                        "type": "object",
+                        "title": "Station",
+                        "required": ["id", "type", "cycle_time_s", "availability_pct"],
+                        "properties": {
+                            "id": { "type": "string", "title": "Station ID" },
+                            "type": { "type": "string", "enum": ["assembly", "welding"], "title": "Station type" },
+                            "cycle_time_s": { "type": "number", "minimum": 1, "maximum": 600, "title": "Cycle time (s)" },
+                            "availability_pct": { "type": "number", "minimum": 50, "maximum": 99.9, "title": "Availability (%)" },
+                            "setup_time_s": { "type": "number", "minimum": 0, "maximum": 900, "default": 0, "title": "Setup/Changeover (s)" },
+                            "scrap_rate_pct": { "type": "number", "minimum": 0, "maximum": 20, "default": 0.5, "title": "Waste (%)" },
+                            "machines": { "type": "integer", "minimum": 1, "maximum": 50, "default": 1, "title": "Parallel machines" }
+                        }
+                    }
+                },
+                "edges": {
+                    "type": "array",
+                    "title": "Routing (empty = serial line in station order)",
+                    "items": {
+                        "type": "object",
+                        "required": ["from", "to"],
+                        "properties": {
+                            "from": { "type": "string", "title": "From (station ID or SRC)" },
+                            "to": { "type": "string", "title": "To (station ID or SNK)" },
+                            "split": { "type": "number", "minimum": 0, "default": 1, "title": "Split weight" },
+                            "buffer": { "type": "integer", "minimum": 0, "title": "Buffer capacity (parts)" }
+                        }
+                    }
+                },
+                "quality": {
+                    "type": "object",
+                    "required": ["inspection_enabled", "rework_enabled"],
+                    "properties": {
+                        "inspection_enabled": { "type": "boolean", "default": True, "title": "Inspection enabled" },
+                        "rework_enabled": { "type": "boolean", "default": False, "title": "Rework active" },
+                        "rework_cycle_time_s": { "type": "number", "minimum": 1, "maximum": 900, "default": 60, "title": "Rework cycle time (s)" },
+                        "rework_yield_pct": { "type": "number", "minimum": 0, "maximum": 100, "default": 100, "title": "Rework success (%)" }
                     }
                 },
                 "data": {
@@ -238,6 +1030,9 @@ TEMPLATES = {
     }
 }
 
+# modelli pydantic generati una sola volta dagli schema dei template
+TEMPLATE_MODELS = {tid: schema_model(t["schema"]) for tid, t in TEMPLATES.items()}
+
 @app.get("/templates")
 def list_templates():
     return [{"template_id": t["template_id"], "name": t["name"]} for t in TEMPLATES.values()]
@@ -247,283 +1042,3 @@ def get_template_schema(template_id: str):
     if template_id not in TEMPLATES:
         return {"error": "template not found"}
     return TEMPLATES[template_id]["schema"]
-
-from fastapi.responses import HTMLResponse
-
-@app.get("/ui-template", response_class=HTMLResponse)
-def ui_template():
-    # default template
-    default_template = "single_station_v1"
-
-    return f"""
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8"/>
-  <meta name="viewport" content="width=device-width, initial-scale=1"/>
-  <title>DTaaS – Template UI</title>
-  <style>
-    body {{ font-family: system-ui, Arial; max-width: 980px; margin: 40px auto; padding: 0 16px; }}
-    .row {{ display:flex; gap:12px; align-items:center; flex-wrap:wrap; }}
-    button {{ padding: 10px 14px; cursor: pointer; }}
-    pre {{ background:#f6f6f6; padding:12px; overflow:auto; }}
-    #editor_holder {{ margin-top: 16px; }}
-  </style>
-  <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@json-editor/json-editor@latest/dist/css/jsoneditor.min.css">
-</head>
-<body>
-  <h2>DTaaS – Template-based UI</h2>
-  <p>Qui l’utente compila un form generato dal template (JSON Schema). Nessun JSON manuale.</p>
-
-  <div class="row">
-    <label for="template">Template:</label>
-    <select id="template"></select>
-    <button onclick="loadTemplate()">Load</button>
-    <button onclick="compute()">Compute KPI</button>
-    <span id="status"></span>
-  </div>
-
-  <div id="editor_holder"></div>
-
-  <h3>Output</h3>
-  <pre id="out">—</pre>
-
-  <p style="margin-top:20px;">
-    API Docs: <a href="/docs">/docs</a>
-  </p>
-
-  <script src="https://cdn.jsdelivr.net/npm/@json-editor/json-editor@latest/dist/jsoneditor.min.js"></script>
-  <script>
-    let editor = null;
-
-    async function fetchJSON(url) {{
-      const res = await fetch(url);
-      return await res.json();
-    }}
-
-    async function initTemplates() {{
-      const templates = await fetchJSON('/templates');
-      const sel = document.getElementById('template');
-      sel.innerHTML = '';
-      templates.forEach(t => {{
-        const opt = document.createElement('option');
-        opt.value = t.template_id;
-        opt.textContent = t.template_id + ' — ' + t.name;
-        sel.appendChild(opt);
-      }});
-      sel.value = "{default_template}";
-      await loadTemplate();
-    }}
-
-    async function loadTemplate() {{
-      const status = document.getElementById('status');
-      status.textContent = 'Loading template...';
-      const templateId = document.getElementById('template').value;
-      const schema = await fetchJSON(`/templates/${{templateId}}/schema`);
-
-      if (schema.error) {{
-        status.textContent = 'Template not found';
-        return;
-      }}
-
-      if (editor) {{
-        editor.destroy();
-        editor = null;
-      }}
-
-      JSONEditor.defaults.options.theme = 'html';
-      JSONEditor.defaults.options.iconlib = 'fontawesome5';
-
-      editor = new JSONEditor(document.getElementById('editor_holder'), {{
-        schema: schema,
-        disable_collapse: true,
-        disable_properties: true,
-        no_additional_properties: true,
-        required_by_default: true
-      }});
-
-      status.textContent = 'Template loaded';
-      document.getElementById('out').textContent = '—';
-    }}
-
-    async function compute() {{
-      const status = document.getElementById('status');
-      const out = document.getElementById('out');
-      out.textContent = '—';
-
-      if (!editor) {{
-        status.textContent = 'No editor';
-        return;
-      }}
-
-      const errors = editor.validate();
-      if (errors.length) {{
-        status.textContent = 'Fix validation errors';
-        out.textContent = JSON.stringify(errors, null, 2);
-        return;
-      }}
-
-      const instance = editor.getValue();
-      status.textContent = 'Running...';
-
-      try {{
-        const res = await fetch('/compute-kpi', {{
-          method: 'POST',
-          headers: {{ 'Content-Type': 'application/json' }},
-          body: JSON.stringify({{ instance }})
-        }});
-        const data = await res.json();
-        status.textContent = res.ok ? 'OK' : ('Error ' + res.status);
-        out.textContent = JSON.stringify(data, null, 2);
-      }} catch (e) {{
-        status.textContent = 'Request failed';
-        out.textContent = String(e);
-      }}
-    }}
-
-    initTemplates();
-  </script>
-</body>
-</html>
-"""
-
-from fastapi.responses import HTMLResponse
-
-@app.get("/ui-template", response_class=HTMLResponse)
-def ui_template():
-    # default template
-    default_template = "single_station_v1"
-
-    return f"""
-<!doctype html>
-<html>
-<head>
-  <meta charset="utf-8"/>
-  <meta name="viewport" content="width=device-width, initial-scale=1"/>
-  <title>DTaaS – Template UI</title>
-  <style>
-    body {{ font-family: system-ui, Arial; max-width: 980px; margin: 40px auto; padding: 0 16px; }}
-    .row {{ display:flex; gap:12px; align-items:center; flex-wrap:wrap; }}
-    button {{ padding: 10px 14px; cursor: pointer; }}
-    pre {{ background:#f6f6f6; padding:12px; overflow:auto; }}
-    #editor_holder {{ margin-top: 16px; }}
-  </style>
-  <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@json-editor/json-editor@latest/dist/css/jsoneditor.min.css">
-</head>
-<body>
-  <h2>DTaaS – Template-based UI</h2>
-  <p>Qui l’utente compila un form generato dal template (JSON Schema). Nessun JSON manuale.</p>
-
-  <div class="row">
-    <label for="template">Template:</label>
-    <select id="template"></select>
-    <button onclick="loadTemplate()">Load</button>
-    <button onclick="compute()">Compute KPI</button>
-    <span id="status"></span>
-  </div>
-
-  <div id="editor_holder"></div>
-
-  <h3>Output</h3>
-  <pre id="out">—</pre>
-
-  <p style="margin-top:20px;">
-    API Docs: <a href="/docs">/docs</a>
-  </p>
-
-  <script src="https://cdn.jsdelivr.net/npm/@json-editor/json-editor@latest/dist/jsoneditor.min.js"></script>
-  <script>
-    let editor = null;
-
-    async function fetchJSON(url) {{
-      const res = await fetch(url);
-      return await res.json();
-    }}
-
-    async function initTemplates() {{
-      const templates = await fetchJSON('/templates');
-      const sel = document.getElementById('template');
-      sel.innerHTML = '';
-      templates.forEach(t => {{
-        const opt = document.createElement('option');
-        opt.value = t.template_id;
-        opt.textContent = t.template_id + ' — ' + t.name;
-        sel.appendChild(opt);
-      }});
-      sel.value = "{default_template}";
-      await loadTemplate();
-    }}
-
-    async function loadTemplate() {{
-      const status = document.getElementById('status');
-      status.textContent = 'Loading template...';
-      const templateId = document.getElementById('template').value;
-      const schema = await fetchJSON(`/templates/${{templateId}}/schema`);
-
-      if (schema.error) {{
-        status.textContent = 'Template not found';
-        return;
-      }}
-
-      if (editor) {{
-        editor.destroy();
-        editor = null;
-      }}
-
-      JSONEditor.defaults.options.theme = 'html';
-      JSONEditor.defaults.options.iconlib = 'fontawesome5';
-
-      editor = new JSONEditor(document.getElementById('editor_holder'), {{
-        schema: schema,
-        disable_collapse: true,
-        disable_properties: true,
-        no_additional_properties: true,
-        required_by_default: true
-      }});
-
-      status.textContent = 'Template loaded';
-      document.getElementById('out').textContent = '—';
-    }}
-
-    async function compute() {{
-      const status = document.getElementById('status');
-      const out = document.getElementById('out');
-      out.textContent = '—';
-
-      if (!editor) {{
-        status.textContent = 'No editor';
-        return;
-      }}
-
-      const errors = editor.validate();
-      if (errors.length) {{
-        status.textContent = 'Fix validation errors';
-        out.textContent = JSON.stringify(errors, null, 2);
-        return;
-      }}
-
-      const instance = editor.getValue();
-      status.textContent = 'Running...';
-
-      try {{
-        const res = await fetch('/compute-kpi', {{
-          method: 'POST',
-          headers: {{ 'Content-Type': 'application/json' }},
-          body: JSON.stringify({{ instance }})
-        }});
-        const data = await res.json();
-        status.textContent = res.ok ? 'OK' : ('Error ' + res.status);
-        out.textContent = JSON.stringify(data, null, 2);
-      }} catch (e) {{
-        status.textContent = 'Request failed';
-        out.textContent = String(e);
-      }}
-    }}
-
-    initTemplates();
-  </script>
-</body>
-</html>
-"""
-
-
@@ -0,0 +1,271 @@
+"""Benchmark and load-test suite for the DTaaS service.
+
+    python bench.py micro                      # compile_twin / compute_kpis vs line size
+    python bench.py workload -o load.ndjson    # synthetic request mix
+    python bench.py load load.ndjson -c 32     # replay against the app in-process
+    python bench.py load load.ndjson --save-baseline
+    python bench.py load load.ndjson --compare # exit 1 on regression
+
+`load` drives the ASGI app through `httpx.ASGITransport`, so no server or
+network is involved. Each workload line is a request::
+
+    {"method": "POST", "path": "/compute-kpi", "json": {"instance": {...}}}
+
+Results are keyed by benchmark name; `--compare` flags any mean/p50/p95/p99
+that grew, or throughput that dropped, by more than `--threshold` against the
+stored baseline. Tail percentiles are only compared when there are enough
+samples for them to differ from the maximum.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_BASELINE = "bench_baseline.json"
+MICRO_SIZES = (1, 10, 100, 1000, 10000)
+
+
+# ---- synthetic inputs ----
+
+def make_instance(n_stations: int, rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    rng = rng or random.Random(0)
+    base = {
+        "line": {"line_name": f"Bench_{n_stations}", "shift_hours": 8, "target_throughput_pph": 200},
+        "quality": {"inspection_enabled": True, "rework_enabled": False},
+        "data": {"mode": "simulation"},
+    }
+    if n_stations == 1:
+        return dict(base, station={"id": "S1", "type": "assembly", "cycle_time_s": rng.randint(10, 30),
+                                   "availability_pct": 95, "setup_time_s": 5, "scrap_rate_pct": 0.8})
+    stations = [{"id": f"S{i}", "type": "assembly", "cycle_time_s": rng.randint(10, 30),
+                 "availability_pct": rng.choice((85, 90, 95)), "scrap_rate_pct": 0.5}
+                for i in range(n_stations)]
+    return dict(base, stations=stations)
+
+
+def make_workload(n: int, seed: int = 0, distinct: int = 200) -> List[Dict[str, Any]]:
+    """Mix of compute-kpi (70%), generate-twin (20%) and templates (10%)."""
+    rng = random.Random(seed)
+    pool = [make_instance(rng.choice((1, 1, 5, 20, 100)), rng) for _ in range(distinct)]
+    out = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.7:
+            out.append({"method": "POST", "path": "/compute-kpi", "json": {"instance": rng.choice(pool)}})
+        elif r < 0.9:
+            out.append({"method": "POST", "path": "/generate-twin", "json": {"instance": rng.choice(pool)}})
+        else:
+            out.append({"method": "GET", "path": "/templates"})
+    return out
+
+
+# ---- microbenchmarks ----
+
+def _best_of(fn: Callable[[], Any], repeat: int, min_time_s: float = 0.05) -> float:
+    """Best per-call time over `repeat` rounds of enough calls to last `min_time_s`."""
+    t0 = time.perf_counter()
+    fn()
+    once = max(time.perf_counter() - t0, 1e-7)
+    number = max(1, int(min_time_s / once))
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+
+def run_micro(sizes=MICRO_SIZES, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    from api import compile_twin, compute_kpis
+
+    results = {}
+    for n in sizes:
+        instance = make_instance(n)
+        twin = compile_twin(instance)
+        results[f"compile_twin[{n}]"] = {"mean_us": _best_of(lambda: compile_twin(instance), repeat) * 1e6}
+        results[f"compute_kpis[{n}]"] = {"mean_us": _best_of(lambda: compute_kpis(twin), repeat) * 1e6}
+    return results
+
+
+# ---- load generator ----
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def _summary(latencies: List[float], elapsed_s: float, errors: int) -> Dict[str, float]:
+    lat = sorted(latencies)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "throughput_rps": round(len(lat) / elapsed_s, 1) if elapsed_s else 0.0,
+        "mean_ms": round(statistics.fmean(lat) * 1e3, 3) if lat else 0.0,
+        "p50_ms": round(_percentile(lat, 50) * 1e3, 3),
+        "p95_ms": round(_percentile(lat, 95) * 1e3, 3),
+        "p99_ms": round(_percentile(lat, 99) * 1e3, 3),
+    }
+
+
+async def run_load(requests: List[Dict[str, Any]], concurrency: int = 16,
+                   warmup: int = 0) -> Dict[str, Dict[str, float]]:
+    import httpx
+
+    from api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for req in requests[:warmup]:
+            await client.request(req.get("method", "GET"), req["path"], json=req.get("json"))
+
+        per_path: Dict[str, List[float]] = {}
+        errors: Dict[str, int] = {}
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        for req in requests:
+            queue.put_nowait(req)
+
+        async def worker() -> None:
+            while not queue.empty():
+                req = queue.get_nowait()
+                path = req["path"]
+                t0 = time.perf_counter()
+                r = await client.request(req.get("method", "GET"), path, json=req.get("json"))
+                per_path.setdefault(path, []).append(time.perf_counter() - t0)
+                if r.status_code >= 400:
+                    errors[path] = errors.get(path, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    results = {f"load{path}": _summary(lat, elapsed, errors.get(path, 0)) for path, lat in per_path.items()}
+    results["load[all]"] = _summary([x for lat in per_path.values() for x in lat], elapsed, sum(errors.values()))
+    return results
+
+
+# ---- baseline ----
+
+_LOWER_IS_BETTER = ("mean_us", "mean_ms", "p50_ms", "p95_ms", "p99_ms")
+_HIGHER_IS_BETTER = ("throughput_rps",)
+# una percentile alta su pochi campioni è solo il massimo: serve una coda di almeno 2
+_MIN_REQUESTS = {"p95_ms": 40, "p99_ms": 200}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """Return one message per metric that regressed by more than `threshold` (a fraction)."""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not old or metrics.get("requests", 1 << 30) < _MIN_REQUESTS.get(metric, 0):
+                continue
+            change = (value - old) / old
+            if (metric in _LOWER_IS_BETTER and change > threshold) or \
+                    (metric in _HIGHER_IS_BETTER and -change > threshold):
+                regressions.append(f"{name} {metric}: {old:g} -> {value:g} ({change:+.1%})")
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]) -> None:
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def _report(results: Dict[str, Dict[str, float]]) -> None:
+    for name, metrics in results.items():
+        print(f"{name:<28} " + "  ".join(f"{k}={v:g}" for k, v in metrics.items()))
+
+
+def _finish(args: argparse.Namespace, results: Dict[str, Dict[str, float]]) -> int:
+    _report(results)
+    if args.compare:
+        baseline = load_baseline(args.baseline)
+        if not baseline:
+            print(f"no baseline at {args.baseline}", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        for msg in regressions:
+            print(f"REGRESSION {msg}", file=sys.stderr)
+        if regressions:
+            return 1
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="DTaaS benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def baseline_args(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--baseline", default=DEFAULT_BASELINE, help=f"baseline file (default: {DEFAULT_BASELINE})")
+        p.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+        p.add_argument("--compare", action="store_true", help="compare with the baseline, exit 1 on regression")
+        p.add_argument("--threshold", type=float, default=0.10, help="allowed regression (default: 0.10)")
+
+    p = sub.add_parser("micro", help="compile_twin / compute_kpis over synthetic lines")
+    p.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=list(MICRO_SIZES))
+    p.add_argument("--repeat", type=int, default=5)
+    baseline_args(p)
+
+    p = sub.add_parser("workload", help="write a synthetic NDJSON request mix")
+    p.add_argument("-o", "--output", default="-")
+    p.add_argument("-n", type=int, default=2000)
+    p.add_argument("--seed", type=int, default=0)
+
+    p = sub.add_parser("load", help="replay an NDJSON request file against the app in-process")
+    p.add_argument("input", nargs="?", help="NDJSON requests (default: synthetic workload)")
+    p.add_argument("-c", "--concurrency", type=int, default=16)
+    p.add_argument("-n", type=int, default=2000, help="synthetic workload size")
+    p.add_argument("--warmup", type=int, default=50)
+    p.add_argument("--cold", action="store_true", help="disable the KPI cache")
+    baseline_args(p)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "micro":
+        return _finish(args, run_micro(args.sizes, args.repeat))
+
+    if args.command == "workload":
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        for req in make_workload(args.n, args.seed):
+            out.write(json.dumps(req, separators=(",", ":")) + "\n")
+        if out is not sys.stdout:
+            out.close()
+        return 0
+
+    if args.input:
+        with open(args.input, "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+    else:
+        requests = make_workload(args.n)
+    if args.cold:
+        import api
+        api.kpi_cache.maxsize = 0
+    results = asyncio.run(run_load(requests, args.concurrency, args.warmup))
+    return _finish(args, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Incremental, parallel compile + score of a directory tree of instances.
+
+Every `*.json` instance under `src` is compiled with `api.compile_twin` and
+scored with `api.compute_kpis`; for `src/a/cell.json` the outputs are
+`out/a/cell.twin.json` (or `.dtwin`) and `out/a/cell.kpis.json`.
+
+Like a build system, `out/.dtaas-manifest.json` remembers each input's size,
+mtime and content hash, plus a hash of the engine sources. An input is
+rebuilt only when its hash changed (the hash is recomputed only when size or
+mtime moved) or its outputs are gone; a changed engine rebuilds everything.
+Outputs of deleted inputs are removed. An input that fails loses its outputs
+and its manifest entry, so nothing stale looks current and it is retried on
+the next run. Rebuilds run on the shared process pool in chunks.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from workers import process_pool, worker_count
+
+MANIFEST = ".dtaas-manifest.json"
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 256
+OUTPUT_SUFFIXES = (".twin.json", ".kpis.json")
+# i moduli da cui dipendono twin e KPI: se cambiano, gli output vecchi non valgono più
+ENGINE_MODULES = ("api.py", "twin_graph.py", "routing.py", "compact_twin.py", "twin_binary.py",
+                  "template_validation.py")
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def engine_version() -> str:
+    h = hashlib.blake2b(digest_size=16)
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in ENGINE_MODULES:
+        with open(os.path.join(base, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _outputs(out_root: str, rel: str, binary: bool) -> Tuple[str, str]:
+    stem = os.path.join(out_root, rel[:-len(".json")])
+    return stem + (".dtwin" if binary else ".twin.json"), stem + ".kpis.json"
+
+
+def _write_json(path: str, value: Any, indent: Optional[int] = 2) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        # dumps usa l'encoder C, dump no
+        f.write(json.dumps(value, indent=indent, separators=None if indent else (",", ":")))
+    os.replace(tmp, path)
+
+
+def _build_one(src_root: str, out_root: str, rel: str, binary: bool) -> Dict[str, Any]:
+    from api import compile_twin, compute_kpis, instance_errors
+    from twin_binary import save_twin
+
+    try:
+        with open(os.path.join(src_root, rel), "r", encoding="utf-8") as f:
+            instance = json.load(f)
+    except (OSError, ValueError) as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    if not isinstance(instance, dict):
+        return {"error": "instance must be a JSON object"}
+    errors = instance_errors(instance, None)
+    if errors:
+        first = errors[0]
+        return {"error": f"validation failed at {'.'.join(map(str, first['loc']))}: {first['msg']}",
+                "detail": json.loads(json.dumps(errors, default=str))}
+    try:
+        twin = compile_twin(instance)
+        kpis = compute_kpis(twin)
+    except (KeyError, TypeError, ValueError) as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+    twin_path, kpis_path = _outputs(out_root, rel, binary)
+    os.makedirs(os.path.dirname(twin_path), exist_ok=True)
+    save_twin(twin, twin_path)
+    _write_json(kpis_path, {"twin_id": twin["twin_id"], "kpis": kpis})
+    return {"twin_id": twin["twin_id"], "kpis": kpis}
+
+
+def _build_chunk(src_root: str, out_root: str, rels: List[str], binary: bool) -> List[Dict[str, Any]]:
+    return [_build_one(src_root, out_root, rel, binary) for rel in rels]
+
+
+def _remove(paths: Iterable[str]) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _walk(src_root: str, skip: str, skip_outputs: bool = False) -> Iterator[Tuple[str, os.stat_result]]:
+    stack = [(src_root, "")]
+    while stack:
+        top, prefix = stack.pop()
+        with os.scandir(top) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) != skip:
+                        stack.append((entry.path, prefix + entry.name + "/"))
+                elif entry.name.endswith(".json") and entry.name != MANIFEST:
+                    # output e input nella stessa cartella: gli output non sono istanze
+                    if not (skip_outputs and entry.name.endswith(OUTPUT_SUFFIXES)):
+                        yield prefix + entry.name, entry.stat()
+
+
+def load_manifest(out_root: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(out_root, MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def build(src_root: str, out_root: str, binary: bool = False, force: bool = False,
+          parallel: bool = True) -> Dict[str, Any]:
+    """Bring `out_root` up to date with `src_root`; returns a build summary."""
+    os.makedirs(out_root, exist_ok=True)
+    manifest = load_manifest(out_root)
+    engine = engine_version()
+    if manifest.get("binary") != binary or manifest.get("engine") != engine:
+        force = True
+    old: Dict[str, Dict[str, Any]] = manifest.get("files", {})
+    files: Dict[str, Dict[str, Any]] = {}
+    todo: List[str] = []
+
+    same_dir = os.path.abspath(src_root) == os.path.abspath(out_root)
+    for rel, st in _walk(src_root, os.path.abspath(out_root), skip_outputs=same_dir):
+        prev = old.get(rel)
+        rec = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if not force and prev is not None and all(os.path.exists(p) for p in _outputs(out_root, rel, binary)):
+            if prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+                files[rel] = prev
+                continue
+            rec["hash"] = file_hash(os.path.join(src_root, rel))
+            if rec["hash"] == prev["hash"]:
+                files[rel] = dict(prev, **rec)
+                continue
+        else:
+            rec["hash"] = file_hash(os.path.join(src_root, rel))
+        files[rel] = rec
+        todo.append(rel)
+
+    removed = [rel for rel in old if rel not in files]
+    old_binary = manifest.get("binary", False)
+    stale = [p for rel in removed for p in _outputs(out_root, rel, old_binary)]
+    if old_binary != binary:
+        stale += [_outputs(out_root, rel, old_binary)[0] for rel in old if rel in files]
+    _remove(stale)
+
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    if parallel and worker_count() > 1 and len(chunks) > 1:
+        pool = process_pool()
+        results = [r for f in [pool.submit(_build_chunk, src_root, out_root, c, binary) for c in chunks]
+                   for r in f.result()]
+    else:
+        results = _build_chunk(src_root, out_root, todo, binary)
+
+    n_inputs = len(files)
+    errors: Dict[str, str] = {}
+    for rel, result in zip(todo, results):
+        if "error" in result:
+            # gli output della versione buona precedente non devono sembrare attuali
+            _remove(_outputs(out_root, rel, binary))
+            del files[rel]
+            errors[rel] = result["error"]
+        else:
+            files[rel].update(result)
+
+    if todo or removed or files != old or manifest.get("engine") != engine:
+        _write_json(os.path.join(out_root, MANIFEST),
+                    {"version": MANIFEST_VERSION, "binary": binary, "engine": engine, "files": files}, indent=None)
+    return {
+        "inputs": n_inputs,
+        "built": len(todo) - len(errors),
+        "failed": len(errors),
+        "unchanged": n_inputs - len(todo),
+        "removed": len(removed),
+        "errors": errors,
+    }
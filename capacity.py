@@ -0,0 +1,395 @@
+"""Calendar-aware capacity: net available time and output per twin.
+
+A calendar is a weekly shift pattern with holidays and planned downtime::
+
+    {"calendar_id": "turin", "version": 3,
+     "shifts": [{"days": ["mon", "tue", "wed", "thu", "fri"], "start": "06:00", "hours": 8},
+                {"days": [0, 1, 2, 3, 4], "start": "14:00"}],
+     "holidays": ["2026-12-25"],
+     "downtime": [{"start": "2026-08-10", "end": "2026-08-24"}]}
+
+Times are wall-clock, ISO 8601 without offset (or epoch seconds), all in
+the plant's time. A shift without `hours` lasts the twin's
+`line.shift_hours`; a holiday drops the shifts starting on it.
+
+For a twin over `[start, end)`:
+
+    scheduled   = shifts
+    net         = shifts - downtime - setups
+    output      = net hours * throughput_pph
+
+A setup lasts the longest `setup_time_s` of the line (stations set up in
+parallel). One is paid at every shift start, as in `simulation.py`, and
+one at every changeover of the twin's sequence; time already lost to
+downtime or to another setup is not counted twice.
+
+Everything is interval arithmetic on NumPy arrays: shifts are expanded
+for the whole horizon at once, unions and differences are sorted sweeps,
+and the time two interval sets share is read from the cumulative length
+of one of them with a binary search. The setups of many twins are merged
+in one pass by shifting each twin onto its own stretch of the time axis.
+Expanded calendars are cached per `(calendar_id, version)`, and so are
+results, next to a fingerprint of the calendar: a changed calendar must
+come with a new version.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from kpi_cache import instance_key
+
+PERIODS = ("day", "week", "month")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_S = 86400.0
+MAX_CACHED_CALENDARS = 256
+MAX_CACHED_RESULTS = 256
+
+Intervals = Tuple[np.ndarray, np.ndarray]
+
+
+class CalendarError(ValueError):
+    """The calendar spec itself is invalid."""
+
+
+def to_seconds(value: Any) -> float:
+    """ISO 8601 date/datetime (no offset) or epoch seconds -> epoch seconds."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(np.datetime64(value, "s").astype(np.int64))
+        except ValueError:
+            pass
+    raise ValueError(f"invalid time {value!r}: expected ISO 8601 without offset or epoch seconds")
+
+
+def _clock_s(value: Any) -> float:
+    try:
+        hh, mm = str(value).split(":")
+        s = int(hh) * 3600 + int(mm) * 60
+    except ValueError:
+        s = -1
+    if not 0 <= s < DAY_S:
+        raise ValueError(f"invalid shift start {value!r}: expected HH:MM")
+    return float(s)
+
+
+def merge(starts: np.ndarray, ends: np.ndarray) -> Intervals:
+    """Union of intervals as sorted, disjoint `[start, end)` arrays."""
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] > reach[:-1])))
+    return starts[first], np.maximum.reduceat(ends, first)
+
+
+def subtract(a: Intervals, b: Intervals) -> Intervals:
+    """`a` minus `b`, both sorted and disjoint."""
+    if not len(b[0]) or not len(a[0]):
+        return a
+    cuts = np.unique(np.concatenate([a[0], a[1], b[0], b[1]]))
+    lo, hi = cuts[:-1], cuts[1:]
+    # un punto è dentro un insieme disgiunto ordinato se cade tra uno start e il suo end
+    in_a = np.searchsorted(a[0], lo, "right") > np.searchsorted(a[1], lo, "right")
+    in_b = np.searchsorted(b[0], lo, "right") > np.searchsorted(b[1], lo, "right")
+    keep = in_a & ~in_b
+    return merge(lo[keep], hi[keep])
+
+
+class Coverage:
+    """Sorted disjoint intervals with their cumulative length."""
+
+    __slots__ = ("starts", "ends", "cum")
+
+    def __init__(self, intervals: Intervals):
+        self.starts, self.ends = intervals
+        self.cum = np.concatenate(([0.0], np.cumsum(self.ends - self.starts)))
+
+    @property
+    def total(self) -> float:
+        return float(self.cum[-1])
+
+    def before(self, t: np.ndarray) -> np.ndarray:
+        """Covered seconds in `(-inf, t)`, for every `t`."""
+        k = np.searchsorted(self.starts, t, "right")
+        last = np.maximum(k - 1, 0)
+        inside = np.clip(t - self.starts[last], 0.0, (self.ends - self.starts)[last]) if len(self.starts) else 0.0
+        return np.where(k > 0, self.cum[last] + inside, 0.0)
+
+
+class Calendar:
+    """A parsed shift calendar; `intervals` expands it over a horizon."""
+
+    def __init__(self, spec: Mapping[str, Any]):
+        if not isinstance(spec, Mapping):
+            raise ValueError("calendar must be an object")
+        self.calendar_id = str(spec.get("calendar_id", "default"))
+        self.version = spec.get("version", 0)
+        self.fingerprint = instance_key(spec)
+        self.shifts: List[Tuple[np.ndarray, float, Optional[float]]] = []
+        for shift in spec.get("shifts", []):
+            days = np.zeros(7, dtype=bool)
+            for d in shift.get("days", range(7)):
+                if isinstance(d, str) and d.lower()[:3] in WEEKDAYS:
+                    days[WEEKDAYS.index(d.lower()[:3])] = True
+                elif isinstance(d, int) and 0 <= d < 7:
+                    days[d] = True
+                else:
+                    raise ValueError(f"invalid shift day {d!r}: expected 0-6 (Monday = 0) or mon..sun")
+            hours = shift.get("hours")
+            if hours is not None and not 0 < float(hours) <= 24:
+                raise ValueError("shift hours must be in (0, 24]")
+            self.shifts.append((days, _clock_s(shift.get("start", "00:00")),
+                                None if hours is None else float(hours)))
+        if not self.shifts:
+            raise ValueError("calendar needs at least one shift")
+        self.holidays = np.array([to_seconds(d) // DAY_S for d in spec.get("holidays", [])])
+        downtime = [(to_seconds(d["start"]), to_seconds(d["end"])) for d in spec.get("downtime", [])]
+        if any(e < s for s, e in downtime):
+            raise ValueError("downtime end must not be before its start")
+        self.downtime = merge(np.array([s for s, _ in downtime]), np.array([e for _, e in downtime]))
+
+    def intervals(self, start: float, end: float, default_hours: float) -> Intervals:
+        """Every shift `[start, end)` of the horizon, possibly overlapping and unclipped."""
+        # un giorno in più prima: i turni notturni di ieri finiscono oggi
+        days = np.arange(np.floor(start / DAY_S) - 1, np.ceil(end / DAY_S))
+        weekday = ((days + 3) % 7).astype(int)  # 1970-01-01 era un giovedì
+        working = ~np.isin(days, self.holidays)
+        starts, ends = [], []
+        for mask, offset, hours in self.shifts:
+            d = days[mask[weekday] & working]
+            s = d * DAY_S + offset
+            starts.append(s)
+            ends.append(s + 3600.0 * (default_hours if hours is None else hours))
+        if not starts:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(starts), np.concatenate(ends)
+
+
+class _Horizon:
+    """One calendar expanded over one horizon for one default shift length."""
+
+    __slots__ = ("shift_starts", "scheduled", "net")
+
+    def __init__(self, calendar: Calendar, start: float, end: float, hours: float):
+        s, e = calendar.intervals(start, end, hours)
+        inside = (e > start) & (s < end)
+        self.shift_starts = np.unique(s[inside & (s >= start)])
+        shifts = merge(np.clip(s[inside], start, end), np.clip(e[inside], start, end))
+        self.scheduled = Coverage(shifts)
+        self.net = Coverage(subtract(shifts, calendar.downtime))
+
+
+def _period_edges(start: float, end: float, period: Optional[str]) -> np.ndarray:
+    if period is None:
+        return np.array([start, end])
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {list(PERIODS)}")
+    if period == "month":
+        first = np.datetime64(int(start), "s").astype("datetime64[M]")
+        last = np.datetime64(int(np.ceil(end)) - 1, "s").astype("datetime64[M]")
+        months = np.arange(first + 1, last + 1).astype("datetime64[s]").astype(np.int64).astype(float)
+        inner = months[(months > start) & (months < end)]
+    else:
+        step = DAY_S if period == "day" else 7 * DAY_S
+        # i periodi partono dalla mezzanotte del primo giorno (la settimana dal lunedì)
+        origin = np.floor(start / DAY_S) * DAY_S
+        if period == "week":
+            origin -= ((origin / DAY_S + 3) % 7) * DAY_S
+        inner = np.arange(origin + step, end, step)
+        inner = inner[inner > start]
+    return np.concatenate(([start], inner, [end]))
+
+
+def _setup_losses(horizon: _Horizon, setup_s: np.ndarray, changeovers: Sequence[np.ndarray],
+                  at_shift_start: bool, edges: np.ndarray) -> np.ndarray:
+    """Net seconds lost to setups before every edge, shape (twins, edges)."""
+    n = len(setup_s)
+    margin = setup_s.max(initial=0.0) + DAY_S
+    span = edges[-1] - edges[0] + 2 * margin
+    starts, owner = [], []
+    for i in range(n):
+        if setup_s[i] <= 0:
+            continue
+        if at_shift_start:
+            starts.append(horizon.shift_starts)
+            owner.append(np.full(len(horizon.shift_starts), i))
+        c = changeovers[i]
+        c = c[(c + setup_s[i] > edges[0]) & (c < edges[-1])]
+        if len(c):
+            starts.append(c)
+            owner.append(np.full(len(c), i))
+    s = np.concatenate(starts) if starts else np.empty(0)
+    if not len(s):
+        # nessun turno né changeover nell'orizzonte (fine settimana, festivi)
+        return np.zeros((n, len(edges)))
+    twin = np.concatenate(owner)
+    # ogni twin su un suo tratto dell'asse dei tempi: una sola unione per tutti
+    s_off, e_off = merge(s + twin * span, s + setup_s[twin] + twin * span)
+    twin = np.floor((s_off - edges[0] + margin) / span).astype(np.intp)
+    s, e = s_off - twin * span, e_off - twin * span
+    f_s = horizon.net.before(s)
+    full = horizon.net.before(e) - f_s
+    prefix = np.concatenate(([0.0], np.cumsum(full)))
+    first = np.searchsorted(twin, np.arange(n), "left")
+
+    query = edges[None, :] + (np.arange(n) * span)[:, None]
+    k = np.searchsorted(s_off, query, "right")
+    lost = prefix[k] - prefix[first][:, None]
+    # l'ultimo setup iniziato può essere a cavallo del bordo: conta solo fin lì
+    last = np.maximum(k - 1, 0)
+    straddle = (k > first[:, None]) & (e[last] > edges[None, :])
+    partial = horizon.net.before(np.minimum(e[last], edges[None, :])) - f_s[last]
+    return lost - np.where(straddle, full[last] - partial, 0.0)
+
+
+class CapacityEngine:
+    """Capacity over shift calendars, cached per calendar version."""
+
+    def __init__(self):
+        self._calendars: "OrderedDict[Tuple[str, Any], Calendar]" = OrderedDict()
+        self._horizons: "OrderedDict[Tuple[Any, ...], _Horizon]" = OrderedDict()
+        self._results: "OrderedDict[Tuple[Any, ...], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def calendar(self, spec: Mapping[str, Any]) -> Calendar:
+        try:
+            fresh = Calendar(spec)
+        except (KeyError, TypeError, ValueError) as e:
+            raise CalendarError(str(e) if isinstance(e, ValueError) else f"{type(e).__name__}: {e}") from None
+        key = (fresh.calendar_id, fresh.version)
+        with self._lock:
+            cached = self._calendars.get(key)
+            if cached is not None:
+                if cached.fingerprint != fresh.fingerprint:
+                    raise ValueError(f"calendar {fresh.calendar_id!r} version {fresh.version!r} changed: "
+                                     "bump its version")
+                self._calendars.move_to_end(key)
+                return cached
+            self._calendars[key] = fresh
+            while len(self._calendars) > MAX_CACHED_CALENDARS:
+                self._calendars.popitem(last=False)
+        return fresh
+
+    def _horizon(self, calendar: Calendar, start: float, end: float, hours: float) -> _Horizon:
+        key = (calendar.calendar_id, calendar.version, start, end, hours)
+        with self._lock:
+            horizon = self._horizons.get(key)
+            if horizon is not None:
+                self._horizons.move_to_end(key)
+                return horizon
+        horizon = _Horizon(calendar, start, end, hours)
+        with self._lock:
+            self._horizons[key] = horizon
+            while len(self._horizons) > MAX_CACHED_CALENDARS:
+                self._horizons.popitem(last=False)
+        return horizon
+
+    def compute(self, calendar: Mapping[str, Any], twins: Sequence[Tuple[str, int, Mapping[str, Any]]],
+                start: Any, end: Any, period: Optional[str] = None,
+                changeovers: Optional[Mapping[str, Sequence[Any]]] = None,
+                setup_at_shift_start: bool = True) -> Dict[str, Any]:
+        """Capacity of `(twin_id, version, summary)` twins over `[start, end)`.
+
+        A summary carries `throughput_pph`, `shift_hours` and `setup_time_s`
+        (see `twin_registry.kpi_summary`); `changeovers` maps twin ids to
+        the times their changeovers start.
+        """
+        cal = self.calendar(calendar)
+        t0, t1 = to_seconds(start), to_seconds(end)
+        if t1 <= t0:
+            raise ValueError("end must be after start")
+        changeovers = changeovers or {}
+        edges = _period_edges(t0, t1, period)
+        key = (cal.calendar_id, cal.version, t0, t1, period, setup_at_shift_start,
+               instance_key([[t, v] for t, v, _ in twins]), instance_key(changeovers))
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        ids = [t for t, _, _ in twins]
+        throughput = np.array([float(s["throughput_pph"]) for _, _, s in twins])
+        hours = np.array([float(s.get("shift_hours") or 8.0) for _, _, s in twins])
+        setup_s = np.array([float(s.get("setup_time_s") or 0.0) for _, _, s in twins])
+        times = [np.sort(np.array([to_seconds(t) for t in changeovers.get(i, [])])) for i in ids]
+
+        scheduled = np.zeros((len(ids), len(edges)))
+        net = np.zeros((len(ids), len(edges)))
+        downtime_s = np.zeros(len(ids))
+        # un calendario espanso per ogni durata di turno distinta (di solito una o due)
+        for h in np.unique(hours):
+            group = np.flatnonzero(hours == h)
+            horizon = self._horizon(cal, t0, t1, float(h))
+            scheduled[group] = horizon.scheduled.before(edges)
+            downtime_s[group] = horizon.scheduled.total - horizon.net.total
+            net[group] = horizon.net.before(edges)
+            # senza changeover le perdite dipendono solo dal setup: una volta per valore distinto
+            plain = np.array([i for i in group if not len(times[i])], dtype=np.intp)
+            own = np.array([i for i in group if len(times[i])], dtype=np.intp)
+            if len(plain):
+                setups, inverse = np.unique(setup_s[plain], return_inverse=True)
+                lost = _setup_losses(horizon, setups, [np.empty(0)] * len(setups), setup_at_shift_start, edges)
+                net[plain] -= lost[inverse]
+            if len(own):
+                net[own] -= _setup_losses(horizon, setup_s[own], [times[i] for i in own], setup_at_shift_start, edges)
+
+        net_cum = np.maximum(net, 0.0)
+        total_scheduled_h = scheduled[:, -1] / 3600.0
+        total_net_h = net_cum[:, -1] / 3600.0
+        downtime_h = downtime_s / 3600.0
+        per_period = np.diff(net_cum, axis=1) / 3600.0
+        results = []
+        for i, twin_id in enumerate(ids):
+            row = {
+                "twin_id": twin_id,
+                "throughput_pph": float(throughput[i]),
+                "shift_hours": float(hours[i]),
+                "setup_time_s": float(setup_s[i]),
+                "scheduled_h": round(float(total_scheduled_h[i]), 4),
+                "planned_downtime_h": round(float(downtime_h[i]), 4),
+                "setup_h": round(float(total_scheduled_h[i] - downtime_h[i] - total_net_h[i]), 4),
+                "net_available_h": round(float(total_net_h[i]), 4),
+                "output_parts": round(float(total_net_h[i] * throughput[i]), 1),
+            }
+            if period is not None:
+                row["periods"] = {
+                    "net_available_h": np.round(per_period[i], 4).tolist(),
+                    "output_parts": np.round(per_period[i] * throughput[i], 1).tolist(),
+                }
+            results.append(row)
+        out: Dict[str, Any] = {
+            "calendar_id": cal.calendar_id,
+            "calendar_version": cal.version,
+            "start": t0,
+            "end": t1,
+            "twins": len(ids),
+            "net_available_h": round(float(total_net_h.sum()), 4),
+            "output_parts": round(float((total_net_h * throughput).sum()), 1),
+            "results": results,
+        }
+        if period is not None:
+            out["period"] = period
+            out["period_starts"] = edges[:-1].tolist()
+        with self._lock:
+            self._results[key] = out
+            while len(self._results) > MAX_CACHED_RESULTS:
+                self._results.popitem(last=False)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calendars": len(self._calendars), "horizons": len(self._horizons),
+                    "results": len(self._results), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,119 @@
+"""DTaaS command line tools.
+
+    python cli.py stream instances.ndjson -o results.ndjson
+    cat instances.ndjson | python cli.py stream > results.ndjson
+    python cli.py replay events.ndjson
+    python cli.py build instances/ -o build/
+    python cli.py vendor-ui
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from api import score_record
+from build import build
+from ndjson_pipeline import encode, iter_lines, score_lines
+from realtime import FileReplaySource, IngestHub
+from static_assets import JSON_EDITOR_VERSION, vendor
+
+
+def _read_chunks(f, size: int = 1 << 16):
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def cmd_stream(args: argparse.Namespace) -> int:
+    src = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    dst = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    n_errors = 0
+    try:
+        for result in score_lines(iter_lines(_read_chunks(src)), score_record):
+            n_errors += "error" in result
+            dst.write(encode(result))
+            if not args.no_flush:
+                dst.flush()
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+    return 1 if n_errors and args.strict else 0
+
+
+def cmd_replay(args: argparse.Namespace) -> int:
+    hub = IngestHub(window_s=args.window_s)
+    t0 = time.perf_counter()
+    n = asyncio.run(hub.run(FileReplaySource(args.input, speed=args.speed)))
+    dt = time.perf_counter() - t0
+    out = {twin_id: hub.twin_kpis(twin_id) for twin_id in hub.twins}
+    print(json.dumps(out, indent=2))
+    print(f"{n} events in {dt:.3f}s ({n / max(dt, 1e-9):,.0f} events/s), "
+          f"{hub.rejected} rejected", file=sys.stderr)
+    return 0
+
+
+def cmd_build(args: argparse.Namespace) -> int:
+    t0 = time.perf_counter()
+    summary = build(args.src, args.output, binary=args.binary, force=args.force, parallel=not args.serial)
+    dt = time.perf_counter() - t0
+    errors = summary.pop("errors")
+    for rel in sorted(errors)[:args.max_errors]:
+        print(f"{rel}: {errors[rel]}", file=sys.stderr)
+    if len(errors) > args.max_errors:
+        print(f"... and {len(errors) - args.max_errors} more", file=sys.stderr)
+    print(json.dumps(summary))
+    print(f"{summary['inputs']} inputs in {dt:.3f}s", file=sys.stderr)
+    return 1 if summary["failed"] and args.strict else 0
+
+
+def cmd_vendor_ui(args: argparse.Namespace) -> int:
+    sizes = vendor(timeout_s=args.timeout_s)
+    for name, size in sizes.items():
+        print(f"ui/{name}: {size:,} bytes", file=sys.stderr)
+    print(f"json-editor {JSON_EDITOR_VERSION} vendored; commit ui/vendor/", file=sys.stderr)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="dtaas", description="DTaaS command line tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("stream", help="score an NDJSON stream of instances")
+    p.add_argument("input", nargs="?", default="-", help="NDJSON input file (default: stdin)")
+    p.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout)")
+    p.add_argument("--no-flush", action="store_true", help="do not flush after every result")
+    p.add_argument("--strict", action="store_true", help="exit with status 1 if any line failed")
+    p.set_defaults(func=cmd_stream)
+
+    p = sub.add_parser("replay", help="replay an NDJSON capture of machine events")
+    p.add_argument("input", help="NDJSON events file")
+    p.add_argument("--window-s", type=float, default=3600.0, help="rolling window length")
+    p.add_argument("--speed", type=float, default=None, help="replay speed factor (default: as fast as possible)")
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser("build", help="compile and score a directory tree of instances, incrementally")
+    p.add_argument("src", help="directory of *.json instances")
+    p.add_argument("-o", "--output", default="build", help="output directory (default: build)")
+    p.add_argument("--binary", action="store_true", help="write twins as .dtwin instead of JSON")
+    p.add_argument("--force", action="store_true", help="rebuild everything, ignoring the manifest")
+    p.add_argument("--serial", action="store_true", help="do not use the process pool")
+    p.add_argument("--strict", action="store_true", help="exit with status 1 if any input failed")
+    p.add_argument("--max-errors", type=int, default=20, help="failed inputs to report (default: 20)")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("vendor-ui", help="download the pinned third-party UI assets into ui/vendor/")
+    p.add_argument("--timeout-s", type=float, default=30.0, help="per-download timeout")
+    p.set_defaults(func=cmd_vendor_ui)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
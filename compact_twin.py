@@ -0,0 +1,196 @@
+"""Compact, array-backed in-memory representation of a twin.
+
+A JSON twin spends most of its memory on per-node dicts. `CompactTwin` keeps
+the same information as:
+
+- interned node ids and a one-byte kind code per node;
+- one `array('d')` column per standard station param (NaN = absent), plus
+  a bit per value recording whether it was an int, so JSON round-trips
+  exactly;
+- a CSR edge index (`offsets`/`targets`/`splits`) with the original edge
+  order kept in `edge_order`;
+- sparse dicts for anything non-standard (extra node or edge keys, params).
+
+`CompactTwin.from_twin(twin).to_twin() == twin` for every twin produced by
+`compile_twin`. Node lookup by id is O(1) through an index built on first use.
+"""
+
+import math
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+PARAM_COLUMNS = ("cycle_time_s", "availability_pct", "setup_time_s", "scrap_rate_pct", "machines")
+KINDS = ("source", "station", "sink")
+_KIND_CODE = {k: i for i, k in enumerate(KINDS)}
+_NODE_KEYS = ("id", "kind", "station_type", "params")
+_EDGE_KEYS = ("from", "to", "split")
+_NAN = float("nan")
+
+
+class CompactTwin:
+    __slots__ = ("twin_id", "type", "ids", "kinds", "station_types", "has_params", "columns", "int_mask",
+                 "offsets", "targets", "splits", "edge_order", "extra_params", "extra_nodes",
+                 "extra_edges", "extra", "_index")
+
+    @classmethod
+    def from_twin(cls, twin: Dict[str, Any]) -> "CompactTwin":
+        self = cls()
+        nodes = twin["nodes"]
+        n = len(nodes)
+        self.twin_id = sys.intern(twin["twin_id"])
+        self.type = sys.intern(twin.get("type", ""))
+        self.ids = tuple(sys.intern(node["id"]) for node in nodes)
+        self.kinds = array("b", (_KIND_CODE[node["kind"]] for node in nodes))
+        self.station_types = tuple(
+            sys.intern(node["station_type"]) if "station_type" in node else None for node in nodes
+        )
+        self.has_params = bytearray(n)
+        self.columns = {name: array("d", [_NAN]) * n for name in PARAM_COLUMNS}
+        self.int_mask = {name: bytearray(n) for name in PARAM_COLUMNS}
+        self.extra_params: Dict[int, Dict[str, Any]] = {}
+        self.extra_nodes: Dict[int, Dict[str, Any]] = {}
+        self._index = None
+
+        for i, node in enumerate(nodes):
+            extra = {k: v for k, v in node.items() if k not in _NODE_KEYS}
+            if extra:
+                self.extra_nodes[i] = extra
+            if "params" in node:
+                self.set_params(i, node["params"])
+
+        index = {node_id: i for i, node_id in enumerate(self.ids)}
+        edges = twin["edges"]
+        src = [index[e["from"]] for e in edges]
+        order = sorted(range(len(edges)), key=src.__getitem__)
+        self.offsets = array("i", [0]) * (n + 1)
+        for u in src:
+            self.offsets[u + 1] += 1
+        for u in range(n):
+            self.offsets[u + 1] += self.offsets[u]
+        self.targets = array("i", (index[edges[k]["to"]] for k in order))
+        self.splits = array("d", (float(edges[k].get("split", _NAN)) for k in order))
+        self.edge_order = array("i", order)
+        # per indice d'arco originale (es. "buffer")
+        self.extra_edges: Dict[int, Dict[str, Any]] = {}
+        for k, e in enumerate(edges):
+            extra = {key: v for key, v in e.items() if key not in _EDGE_KEYS}
+            if extra:
+                self.extra_edges[k] = extra
+        self.extra = {k: v for k, v in twin.items() if k not in ("twin_id", "type", "nodes", "edges")}
+        return self
+
+    def set_params(self, i: int, params: Optional[Dict[str, Any]]) -> None:
+        """Replace the params of node `i` (e.g. after an in-place patch)."""
+        for name in PARAM_COLUMNS:
+            self.columns[name][i] = _NAN
+            self.int_mask[name][i] = 0
+        self.extra_params.pop(i, None)
+        self.has_params[i] = params is not None
+        if params is None:
+            return
+        rest = {}
+        for key, value in params.items():
+            column = self.columns.get(key)
+            if column is not None and type(value) in (int, float) and not math.isnan(value):
+                column[i] = value
+                self.int_mask[key][i] = type(value) is int
+            else:
+                rest[key] = value
+        if rest:
+            self.extra_params[i] = rest
+
+    # ---- lookup ----
+
+    def index(self, node_id: str) -> int:
+        if self._index is None:
+            self._index = {node_id: i for i, node_id in enumerate(self.ids)}
+        return self._index[node_id]
+
+    def kind(self, i: int) -> str:
+        return KINDS[self.kinds[i]]
+
+    def stations(self) -> List[int]:
+        code = _KIND_CODE["station"]
+        return [i for i, k in enumerate(self.kinds) if k == code]
+
+    def param(self, i: int, name: str, default: Any = None) -> Any:
+        column = self.columns.get(name)
+        if column is not None:
+            value = column[i]
+            if value == value:
+                return int(value) if self.int_mask[name][i] else value
+        return self.extra_params.get(i, {}).get(name, default)
+
+    def params(self, i: int) -> Optional[Dict[str, Any]]:
+        if not self.has_params[i]:
+            return None
+        out = {}
+        for name in PARAM_COLUMNS:
+            value = self.columns[name][i]
+            if value == value:
+                out[name] = int(value) if self.int_mask[name][i] else value
+        out.update(self.extra_params.get(i, {}))
+        return out
+
+    def successors(self, i: int) -> List[Tuple[int, Optional[float]]]:
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return [(self.targets[p], None if self.splits[p] != self.splits[p] else self.splits[p])
+                for p in range(lo, hi)]
+
+    # ---- JSON twin ----
+
+    def node(self, i: int) -> Dict[str, Any]:
+        node: Dict[str, Any] = {"id": self.ids[i], "kind": KINDS[self.kinds[i]]}
+        if self.station_types[i] is not None:
+            node["station_type"] = self.station_types[i]
+        params = self.params(i)
+        if params is not None:
+            node["params"] = params
+        node.update(self.extra_nodes.get(i, {}))
+        return node
+
+    def to_twin(self) -> Dict[str, Any]:
+        edges: List[Optional[Dict[str, Any]]] = [None] * len(self.targets)
+        for u in range(len(self.ids)):
+            for p in range(self.offsets[u], self.offsets[u + 1]):
+                edge = {"from": self.ids[u], "to": self.ids[self.targets[p]]}
+                split = self.splits[p]
+                if split == split:
+                    edge["split"] = int(split) if split.is_integer() else split
+                edge.update(self.extra_edges.get(self.edge_order[p], {}))
+                edges[self.edge_order[p]] = edge
+        twin = {"twin_id": self.twin_id, "type": self.type,
+                "nodes": [self.node(i) for i in range(len(self.ids))], "edges": edges}
+        twin.update(self.extra)
+        return twin
+
+
+if __name__ == "__main__":
+    import gc
+    import json
+    import tracemalloc
+
+    from api import compile_twin
+
+    def make(k: int) -> Dict[str, Any]:
+        stations = [{"id": f"S{i}", "type": "assembly", "cycle_time_s": 10 + i % 7,
+                     "availability_pct": 90, "scrap_rate_pct": 0.5} for i in range(50)]
+        return compile_twin({"line": {"line_name": f"L{k}", "shift_hours": 8, "target_throughput_pph": 200},
+                             "stations": stations, "quality": {}, "data": {"mode": "simulation"}})
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        objs = [build(k) for k in range(2000)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return objs, size
+
+    twins, _ = measure(make)
+    blobs = [json.dumps(t) for t in twins]
+    _, json_size = measure(lambda k: json.loads(blobs[k]))
+    compact, compact_size = measure(lambda k: CompactTwin.from_twin(json.loads(blobs[k])))
+    assert all(c.to_twin() == t for c, t in zip(compact, twins))
+    print(f"2000 twins x 50 stations: dict {json_size / 1e6:.1f} MB, "
+          f"compact {compact_size / 1e6:.1f} MB ({json_size / compact_size:.1f}x)")
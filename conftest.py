@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# registro e storico dell'app in una cartella temporanea, prima che i test importino api
+_tmp = tempfile.mkdtemp(prefix="dtaas-test-")
+os.environ.setdefault("DTAAS_REGISTRY_PATH", os.path.join(_tmp, "twins.sqlite3"))
+os.environ.setdefault("DTAAS_HISTORY_PATH", os.path.join(_tmp, "kpi_history"))
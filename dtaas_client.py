@@ -0,0 +1,355 @@
+"""Python client for the DTaaS API, blocking and asyncio.
+
+    with Client("http://dtaas:8000") as dt:
+        kpis = dt.compute_kpi(instance)["kpis"]
+
+    async with AsyncClient("http://dtaas:8000") as dt:
+        results = await asyncio.gather(*(dt.compute_kpi(i) for i in instances))
+
+Both flavours keep a pool of keep-alive connections (httpx) and cap the
+requests in flight at `max_concurrency`. Requests that fail on the
+transport or with 429/502/503/504 are retried `retries` times with jittered
+exponential backoff (honouring `Retry-After`); every call of the API is a
+pure computation, so a retry is always safe.
+
+`compute_kpi` calls made concurrently (tasks, or threads sharing a
+`Client`) are merged: the calls for the same template that arrive within
+`batch_window_s` go out as one `/compute-kpi/batch` request of up to
+`max_batch` instances, and each caller gets back its own result or its own
+`DTaaSError`. A call alone in its window goes to `/compute-kpi` as usual.
+Batching needs the twin-less result, so it applies to the default
+`include_twin=False`; `batch_window_s=0` turns it off.
+
+`template_schema` is cached in the client for `schema_ttl_s`.
+
+Any httpx client can be passed as `http`, which also runs the SDK against
+the app in-process::
+
+    Client(http=fastapi.testclient.TestClient(api.app))
+    AsyncClient(http=httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://dtaas"))
+"""
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+DEFAULT_TIMEOUT_S = 30.0
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_RETRIES = 3
+DEFAULT_BATCH_WINDOW_S = 0.002
+DEFAULT_MAX_BATCH = 256
+DEFAULT_SCHEMA_TTL_S = 3600.0
+RETRY_STATUS = frozenset({429, 502, 503, 504})
+BACKOFF_BASE_S = 0.1
+BACKOFF_MAX_S = 10.0
+
+
+class DTaaSError(Exception):
+    """An error returned by the API (`status_code`) or a transport failure (`status_code` None)."""
+
+    def __init__(self, status_code: Optional[int], detail: Any):
+        super().__init__(f"{status_code}: {detail}" if status_code is not None else str(detail))
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+    if response is not None:
+        try:
+            return min(float(response.headers["retry-after"]), BACKOFF_MAX_S)
+        except (KeyError, ValueError):
+            pass
+    # jitter pieno: i client in retry non si risincronizzano sul server
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+
+def _decode(response: httpx.Response) -> Any:
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise DTaaSError(response.status_code, detail)
+    return response.json()
+
+
+def _payload(instance: Dict[str, Any], template_id: Optional[str]) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"instance": instance}
+    if template_id is not None:
+        payload["template_id"] = template_id
+    return payload
+
+
+def _kpi_params(include_twin: bool, fields: Optional[str]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"include_twin": "true" if include_twin else "false"}
+    if fields is not None:
+        params["fields"] = fields
+    return params
+
+
+def _item_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in result:
+        raise DTaaSError(422, result.get("detail", result["error"]))
+    return result
+
+
+def _deliver(items: Sequence[Tuple[Dict[str, Any], Any]], results: Optional[List[Dict[str, Any]]],
+             error: Optional[BaseException] = None) -> None:
+    """Resolve the futures of one batch (concurrent or asyncio: same interface)."""
+    for i, (_, fut) in enumerate(items):
+        if fut.done():
+            continue
+        if error is not None:
+            fut.set_exception(error)
+            continue
+        try:
+            fut.set_result(_item_result(results[i]))
+        except DTaaSError as e:
+            fut.set_exception(e)
+
+
+class _SchemaCache:
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self._data: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    def get(self, template_id: str) -> Optional[Dict[str, Any]]:
+        hit = self._data.get(template_id)
+        if hit is None or hit[0] < time.monotonic():
+            return None
+        return hit[1]
+
+    def put(self, template_id: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+        if schema.get("error"):
+            # l'endpoint risponde 200 anche per un template sconosciuto
+            raise DTaaSError(404, schema["error"])
+        self._data[template_id] = (time.monotonic() + self.ttl_s, schema)
+        return schema
+
+
+class Client:
+    """Blocking DTaaS client; safe to share between threads."""
+
+    def __init__(self, base_url: str = "http://localhost:8000", *, timeout_s: float = DEFAULT_TIMEOUT_S,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, retries: int = DEFAULT_RETRIES,
+                 batch_window_s: float = DEFAULT_BATCH_WINDOW_S, max_batch: int = DEFAULT_MAX_BATCH,
+                 schema_ttl_s: float = DEFAULT_SCHEMA_TTL_S, http: Optional[httpx.Client] = None):
+        self._http = http or httpx.Client(
+            base_url=base_url, timeout=timeout_s,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+        self._owns_http = http is None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.retries = retries
+        self.batch_window_s = batch_window_s
+        self.max_batch = max_batch
+        self._schemas = _SchemaCache(schema_ttl_s)
+        self._lock = threading.Lock()
+        self._pending: Dict[Optional[str], List[Tuple[Dict[str, Any], Future]]] = {}
+
+    def close(self) -> None:
+        if self._owns_http:
+            self._http.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        """One API call with bounded concurrency and retries; returns the decoded JSON."""
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self._slots:
+                    response = self._http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise DTaaSError(None, f"{type(e).__name__}: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return _decode(response)
+            time.sleep(_backoff(attempt, response))
+
+    def status(self) -> Dict[str, Any]:
+        return self.request("GET", "/status")
+
+    def templates(self) -> List[Dict[str, Any]]:
+        return self.request("GET", "/templates")
+
+    def template_schema(self, template_id: str) -> Dict[str, Any]:
+        schema = self._schemas.get(template_id)
+        if schema is None:
+            schema = self._schemas.put(template_id, self.request("GET", f"/templates/{template_id}/schema"))
+        return schema
+
+    def generate_twin(self, instance: Dict[str, Any], template_id: Optional[str] = None) -> Dict[str, Any]:
+        return self.request("POST", "/generate-twin", json=_payload(instance, template_id))["twin"]
+
+    def compute_kpi(self, instance: Dict[str, Any], template_id: Optional[str] = None,
+                    include_twin: bool = False, fields: Optional[str] = None) -> Dict[str, Any]:
+        """`{"twin_id", "kpis"}` (plus `"twin"` with `include_twin`); raises `DTaaSError`."""
+        if include_twin or fields is not None or self.batch_window_s <= 0:
+            return self.request("POST", "/compute-kpi", json=_payload(instance, template_id),
+                                params=_kpi_params(include_twin, fields))
+        fut: Future = Future()
+        with self._lock:
+            items = self._pending.setdefault(template_id, [])
+            items.append((instance, fut))
+            leader = len(items) == 1
+            full = len(items) >= self.max_batch
+            if full:
+                del self._pending[template_id]
+        if full:
+            self._send(template_id, items)
+        elif leader:
+            # il primo chiamante attende la finestra e spedisce, se nessuno l'ha già fatto;
+            # se il batch si riempie prima, la sua risposta lo sveglia subito
+            wait([fut], timeout=self.batch_window_s)
+            with self._lock:
+                mine = self._pending.get(template_id) is items
+                if mine:
+                    del self._pending[template_id]
+            if mine:
+                self._send(template_id, items)
+        return fut.result()
+
+    def _send(self, template_id: Optional[str], items: List[Tuple[Dict[str, Any], Future]]) -> None:
+        try:
+            if len(items) == 1:
+                results = [self.request("POST", "/compute-kpi", json=_payload(items[0][0], template_id),
+                                        params=_kpi_params(False, None))]
+            else:
+                results = self.request("POST", "/compute-kpi/batch",
+                                       json={"instances": [i for i, _ in items], "template_id": template_id}
+                                       )["results"]
+        except Exception as e:
+            _deliver(items, None, e)
+        else:
+            _deliver(items, results)
+
+    def compute_kpis(self, instances: Sequence[Dict[str, Any]],
+                     template_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Bulk scoring in `max_batch` chunks; failed items keep their `{"error": ...}` entry."""
+        out: List[Dict[str, Any]] = []
+        for i in range(0, len(instances), self.max_batch):
+            chunk = list(instances[i:i + self.max_batch])
+            out += self.request("POST", "/compute-kpi/batch",
+                                json={"instances": chunk, "template_id": template_id})["results"]
+        return out
+
+
+class AsyncClient:
+    """asyncio DTaaS client; use it from one event loop."""
+
+    def __init__(self, base_url: str = "http://localhost:8000", *, timeout_s: float = DEFAULT_TIMEOUT_S,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, retries: int = DEFAULT_RETRIES,
+                 batch_window_s: float = DEFAULT_BATCH_WINDOW_S, max_batch: int = DEFAULT_MAX_BATCH,
+                 schema_ttl_s: float = DEFAULT_SCHEMA_TTL_S, http: Optional[httpx.AsyncClient] = None):
+        self._http = http or httpx.AsyncClient(
+            base_url=base_url, timeout=timeout_s,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+        self._owns_http = http is None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.batch_window_s = batch_window_s
+        self.max_batch = max_batch
+        self._schemas = _SchemaCache(schema_ttl_s)
+        self._pending: Dict[Optional[str], Tuple[List[Tuple[Dict[str, Any], asyncio.Future]], Any]] = {}
+        self._tasks: "set[asyncio.Task]" = set()
+
+    async def aclose(self) -> None:
+        for template_id in list(self._pending):
+            self._flush(template_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._owns_http:
+            await self._http.aclose()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.aclose()
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        """One API call with bounded concurrency and retries; returns the decoded JSON."""
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                async with self._slots:
+                    response = await self._http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise DTaaSError(None, f"{type(e).__name__}: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return _decode(response)
+            await asyncio.sleep(_backoff(attempt, response))
+
+    async def status(self) -> Dict[str, Any]:
+        return await self.request("GET", "/status")
+
+    async def templates(self) -> List[Dict[str, Any]]:
+        return await self.request("GET", "/templates")
+
+    async def template_schema(self, template_id: str) -> Dict[str, Any]:
+        schema = self._schemas.get(template_id)
+        if schema is None:
+            schema = self._schemas.put(template_id, await self.request("GET", f"/templates/{template_id}/schema"))
+        return schema
+
+    async def generate_twin(self, instance: Dict[str, Any], template_id: Optional[str] = None) -> Dict[str, Any]:
+        return (await self.request("POST", "/generate-twin", json=_payload(instance, template_id)))["twin"]
+
+    async def compute_kpi(self, instance: Dict[str, Any], template_id: Optional[str] = None,
+                          include_twin: bool = False, fields: Optional[str] = None) -> Dict[str, Any]:
+        """`{"twin_id", "kpis"}` (plus `"twin"` with `include_twin`); raises `DTaaSError`."""
+        if include_twin or fields is not None or self.batch_window_s <= 0:
+            return await self.request("POST", "/compute-kpi", json=_payload(instance, template_id),
+                                      params=_kpi_params(include_twin, fields))
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        pending = self._pending.get(template_id)
+        if pending is None:
+            timer = loop.call_later(self.batch_window_s, self._flush, template_id)
+            pending = self._pending[template_id] = ([], timer)
+        pending[0].append((instance, fut))
+        if len(pending[0]) >= self.max_batch:
+            self._flush(template_id)
+        return await fut
+
+    def _flush(self, template_id: Optional[str]) -> None:
+        items, timer = self._pending.pop(template_id)
+        timer.cancel()
+        task = asyncio.ensure_future(self._send(template_id, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, template_id: Optional[str], items: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        try:
+            if len(items) == 1:
+                results = [await self.request("POST", "/compute-kpi", json=_payload(items[0][0], template_id),
+                                              params=_kpi_params(False, None))]
+            else:
+                results = (await self.request("POST", "/compute-kpi/batch",
+                                              json={"instances": [i for i, _ in items],
+                                                    "template_id": template_id}))["results"]
+        except Exception as e:
+            _deliver(items, None, e)
+        else:
+            _deliver(items, results)
+
+    async def compute_kpis(self, instances: Sequence[Dict[str, Any]],
+                           template_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Bulk scoring in `max_batch` chunks sent concurrently; failed items keep their `{"error": ...}`."""
+        chunks = [list(instances[i:i + self.max_batch]) for i in range(0, len(instances), self.max_batch)]
+        responses = await asyncio.gather(*(
+            self.request("POST", "/compute-kpi/batch", json={"instances": c, "template_id": template_id})
+            for c in chunks))
+        return [r for response in responses for r in response["results"]]
@@ -0,0 +1,169 @@
+"""Fleet-level KPI aggregation over the twin registry.
+
+Twins are grouped by the values of one or more tags (`line.tags` in the
+instance, e.g. `{"site": "Turin", "area": "Body"}`); twins without a tag fall
+in the group with `null` for it. Grouping reads only the registry index
+(`twin_id`, `version`, tags), never the twins themselves.
+
+Each twin contributes a small summary (throughput, target, bottleneck),
+cached by `(twin_id, version)`. Missing summaries are computed over shards
+of the registry in parallel on the process pool; every worker opens the
+registry file itself. Group results are cached too, keyed by the exact set
+of `(twin_id, version)` members, so a group is recomputed only when one of
+its twins changed, was added or was removed.
+"""
+
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from twin_registry import TwinRegistry
+from workers import process_pool, worker_count
+
+SHARD_SIZE = 500
+# sotto questa soglia il pool costa più di quanto fa risparmiare
+PARALLEL_MIN = 1000
+MAX_CACHED_GROUPS = 10_000
+
+
+def _shard_summaries(path: str, twin_ids: List[str]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    registry = TwinRegistry(path)
+    try:
+        return registry.summaries(twin_ids)
+    finally:
+        registry.close()
+
+
+def _fingerprint(members: List[Tuple[str, int]]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for twin_id, version in sorted(members):
+        h.update(f"{twin_id}\0{version}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def aggregate_group(members: Sequence[Tuple[str, Dict[str, Any]]], top: int = 5) -> Dict[str, Any]:
+    """Aggregate (twin_id, summary) pairs into one group result."""
+    throughput = 0.0
+    target_total = 0.0
+    throughput_with_target = 0.0
+    shortfall_total = 0.0
+    below = 0
+    short: List[Tuple[float, str, Dict[str, Any]]] = []
+    for twin_id, s in members:
+        tp = s["throughput_pph"]
+        throughput += tp
+        target = s["target_throughput_pph"]
+        if target is None:
+            continue
+        target_total += target
+        throughput_with_target += tp
+        shortfall = max(0.0, target - tp)
+        if shortfall > 0:
+            below += 1
+            shortfall_total += shortfall
+            short.append((shortfall, twin_id, s))
+    short.sort(key=lambda x: (-x[0], x[1]))
+    return {
+        "twins": len(members),
+        "throughput_pph": round(throughput, 2),
+        "target_throughput_pph": round(target_total, 2),
+        "shortfall_pph": round(shortfall_total, 2),
+        "attainment": round(throughput_with_target / target_total, 4) if target_total else None,
+        "twins_below_target": below,
+        "worst_bottlenecks": [
+            {"twin_id": twin_id, "bottleneck": s["bottleneck"], "throughput_pph": s["throughput_pph"],
+             "target_throughput_pph": s["target_throughput_pph"], "shortfall_pph": round(shortfall, 2)}
+            for shortfall, twin_id, s in short[:top]
+        ],
+    }
+
+
+class FleetAggregator:
+    def __init__(self, registry: TwinRegistry):
+        self.registry = registry
+        self._summaries: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._groups: Dict[Tuple[Any, ...], Tuple[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.group_hits = 0
+        self.group_misses = 0
+        self.summaries_computed = 0
+
+    def _fill_summaries(self, wanted: List[Tuple[str, int]], parallel: bool) -> None:
+        missing = [t for t, v in wanted if self._summaries.get(t, (None,))[0] != v]
+        if not missing:
+            return
+        if parallel and len(missing) >= PARALLEL_MIN and worker_count() > 1:
+            pool = process_pool()
+            shard = max(SHARD_SIZE, -(-len(missing) // worker_count()))
+            futures = [pool.submit(_shard_summaries, self.registry.path, missing[i:i + shard])
+                       for i in range(0, len(missing), shard)]
+            for f in futures:
+                self._summaries.update(f.result())
+        else:
+            self._summaries.update(self.registry.summaries(missing))
+        self.summaries_computed += len(missing)
+
+    def summaries(self, members: List[Tuple[str, int]], parallel: bool = True) -> Dict[str, Dict[str, Any]]:
+        """twin_id -> summary for `(twin_id, version)` members, from the same cache as `aggregate`."""
+        with self._lock:
+            self._fill_summaries(members, parallel)
+            return {t: self._summaries[t][1] for t, _ in members if t in self._summaries}
+
+    def aggregate(self, group_by: Sequence[str], where: Optional[Dict[str, str]] = None,
+                  top: int = 5, parallel: bool = True) -> Dict[str, Any]:
+        where = where or {}
+        group_by = tuple(group_by)
+        groups: Dict[Tuple[Optional[str], ...], List[Tuple[str, int]]] = {}
+        for twin_id, version, tags in self.registry.index():
+            if any(tags.get(k) != v for k, v in where.items()):
+                continue
+            key = tuple(tags.get(k) for k in group_by)
+            groups.setdefault(key, []).append((twin_id, version))
+
+        with self._lock:
+            live = {t for members in groups.values() for t, _ in members}
+            stale: List[Tuple[Tuple[Optional[str], ...], str]] = []
+            results: Dict[Tuple[Optional[str], ...], Dict[str, Any]] = {}
+            for key, members in groups.items():
+                fp = _fingerprint(members)
+                cache_key = (group_by, tuple(sorted(where.items())), top, key)
+                cached = self._groups.get(cache_key)
+                if cached is not None and cached[0] == fp:
+                    results[key] = cached[1]
+                    self.group_hits += 1
+                else:
+                    stale.append((key, fp))
+                    self.group_misses += 1
+            if stale:
+                wanted = [m for key, _ in stale for m in groups[key]]
+                self._fill_summaries(wanted, parallel)
+                for key, fp in stale:
+                    members = [(t, self._summaries[t][1]) for t, _ in groups[key] if t in self._summaries]
+                    result = aggregate_group(members, top)
+                    self._groups[(group_by, tuple(sorted(where.items())), top, key)] = (fp, result)
+                    results[key] = result
+            if not where:
+                # senza filtro l'indice è completo: via i riassunti dei twin cancellati
+                for twin_id in [t for t in self._summaries if t not in live]:
+                    del self._summaries[twin_id]
+            if len(self._groups) > MAX_CACHED_GROUPS:
+                self._groups.clear()
+            all_members = [(t, self._summaries[t][1]) for members in groups.values() for t, _ in members
+                           if t in self._summaries]
+
+        ordered = sorted(results.items(), key=lambda kv: tuple((v is None, v or "") for v in kv[0]))
+        return {
+            "group_by": list(group_by),
+            "where": where,
+            "total": aggregate_group(all_members, top),
+            "groups": [dict(tags=dict(zip(group_by, key)), **result) for key, result in ordered],
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_groups": len(self._groups),
+            "cached_summaries": len(self._summaries),
+            "group_hits": self.group_hits,
+            "group_misses": self.group_misses,
+            "summaries_computed": self.summaries_computed,
+        }
@@ -0,0 +1,243 @@
+"""Background job queue for long-running twin computations.
+
+Jobs wait in a priority heap (higher `priority` first, FIFO within a level)
+and at most `max_workers` run at once, each on a dedicated process pool, so
+the request threadpool and the shared engine pool stay free for interactive
+calls. A job function is a picklable module-level callable
+`fn(body, progress)`; `progress(fraction)` publishes progress through shared
+memory and is also the cancellation point: once a running job is cancelled
+the next `progress` call raises `JobCancelled` inside the worker. Queued jobs
+are cancelled immediately.
+
+Finished jobs (succeeded, failed, cancelled) are kept for `result_ttl_s`
+and then dropped.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.sharedctypes import RawArray
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+_FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+JobFunction = Callable[[Dict[str, Any], Callable[[float], None]], Any]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+# ---- worker side ----
+
+_cancel_flags = None
+_progress = None
+_slot = -1
+
+
+def _init_worker(cancel_flags, progress) -> None:
+    global _cancel_flags, _progress
+    _cancel_flags, _progress = cancel_flags, progress
+
+
+def _report(fraction: float) -> None:
+    _progress[_slot] = min(1.0, max(0.0, float(fraction)))
+    if _cancel_flags[_slot]:
+        raise JobCancelled()
+
+
+def _run(fn: JobFunction, body: Dict[str, Any], slot: int) -> Any:
+    global _slot
+    _slot = slot
+    _progress[slot] = 0.0
+    return fn(body, _report)
+
+
+# ---- parent side ----
+
+class Job:
+    __slots__ = ("job_id", "kind", "priority", "status", "body", "fn", "submitted_at", "started_at",
+                 "finished_at", "result", "error", "slot")
+
+    def __init__(self, kind: str, fn: JobFunction, body: Dict[str, Any], priority: int):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.status = QUEUED
+        self.body = body
+        self.fn = fn
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.slot = -1
+
+
+class JobQueue:
+    def __init__(self, max_workers: int = 1, result_ttl_s: float = 3600.0, max_queued: int = 1000):
+        self.max_workers = max_workers
+        self.result_ttl_s = result_ttl_s
+        self.max_queued = max_queued
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._free_slots = list(range(max_workers))
+        self._cancel_flags = RawArray("b", max_workers)
+        self._progress = RawArray("d", max_workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._queued = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                             initargs=(self._cancel_flags, self._progress))
+        return self._pool
+
+    # ---- scheduling ----
+
+    def _dispatch(self) -> None:
+        while self._free_slots and self._heap:
+            job = heapq.heappop(self._heap)[2]
+            if job.status != QUEUED:
+                continue
+            self._queued -= 1
+            slot = self._free_slots.pop()
+            self._cancel_flags[slot] = 0
+            self._progress[slot] = 0.0
+            job.slot = slot
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                future = self._executor().submit(_run, job.fn, job.body, slot)
+            except BrokenProcessPool:
+                self._pool = None
+                future = self._executor().submit(_run, job.fn, job.body, slot)
+            job.body = None
+            future.add_done_callback(lambda f, job=job: self._done(job, f))
+
+    def _done(self, job: Job, future: Future) -> None:
+        with self._lock:
+            job.finished_at = time.time()
+            try:
+                job.result = future.result()
+                job.status = SUCCEEDED
+            except JobCancelled:
+                job.status = CANCELLED
+            except BrokenProcessPool:
+                job.status = FAILED
+                job.error = "worker process died"
+                self._pool = None
+            except Exception as e:
+                job.status = FAILED
+                job.error = "".join(traceback.format_exception_only(type(e), e)).strip()
+            self._free_slots.append(job.slot)
+            job.slot = -1
+            self._dispatch()
+
+    def _expire(self, now: float) -> None:
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in _FINISHED and job.finished_at + self.result_ttl_s <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    # ---- public API ----
+
+    def submit(self, kind: str, fn: JobFunction, body: Dict[str, Any], priority: int = 0) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.time())
+            if self._queued >= self.max_queued:
+                raise QueueFull(f"{self._queued} jobs already queued")
+            job = Job(kind, fn, body, priority)
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, (-priority, next(self._seq), job))
+            self._queued += 1
+            self._dispatch()
+            return self._describe(job)
+
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            out = self._describe(job)
+            if include_result and job.status == SUCCEEDED:
+                out["result"] = job.result
+            return out
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._expire(time.time())
+            return [self._describe(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued or running job; a finished job is forgotten instead."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                job.body = None
+                self._queued -= 1
+            elif job.status == RUNNING:
+                # cooperativo: il worker si ferma al prossimo progress()
+                self._cancel_flags[job.slot] = 1
+            else:
+                del self._jobs[job_id]
+            return self._describe(job)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return dict(counts, max_workers=self.max_workers)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _describe(self, job: Job) -> Dict[str, Any]:
+        if job.status == RUNNING:
+            progress = self._progress[job.slot]
+        else:
+            progress = 1.0 if job.status == SUCCEEDED else None
+        out = {
+            "job_id": job.job_id,
+            "kind": job.kind,
+            "priority": job.priority,
+            "status": job.status,
+            "progress": progress,
+            "submitted_at": job.submitted_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+        if job.status == RUNNING and self._cancel_flags[job.slot]:
+            out["cancel_requested"] = True
+        if job.finished_at is not None:
+            out["expires_at"] = job.finished_at + self.result_ttl_s
+        if job.error is not None:
+            out["error"] = job.error
+        return out
+
+
+def default_workers() -> int:
+    # metà delle CPU: il resto resta alle chiamate interattive
+    return int(os.environ.get("DTAAS_JOB_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
@@ -0,0 +1,362 @@
+"""Append-only, file-based KPI history per twin, with downsampled rollups.
+
+Each twin has a directory of segments; every point is `(ts, throughput_pph,
+availability, scrap_rate)` with `ts` in epoch seconds:
+
+- new points are appended to `raw-<seq>.log` (fixed 32-byte rows) and kept
+  in memory too;
+- when the log reaches `SEGMENT_ROWS` it is sealed into columnar segments:
+  `raw-<seq>.seg` with the points sorted by time, plus `1m-`, `1h-` and
+  `shift-<seq>.seg` with per-bucket count, sum, min and max of every metric.
+
+A segment is a 32-byte header (magic "DTKH", version, columns, rows, first
+and last ts) followed by `float64[columns][rows]`. Sealed segments never
+change: queries memory-map them (maps are cached), skip the ones outside
+the range using the header, and slice the rest with a binary search on the
+ts column. Rollup rows are partial aggregates, so a bucket split across two
+segments, or still in the log, is merged at query time.
+
+Sealing writes the rollups first and the raw segment last, then removes the
+log: on open, a log whose raw segment exists is a leftover and is dropped,
+and rollups without their raw segment are the remains of an interrupted
+seal and are dropped too.
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+METRICS = ("throughput_pph", "availability", "scrap_rate")
+SEGMENT_ROWS = 16_384
+SHIFT_S = 8 * 3600
+# risoluzioni dei rollup, dalla più fine: nome -> ampiezza del bucket
+ROLLUPS = {"1m": 60, "1h": 3600, "shift": SHIFT_S}
+RESOLUTIONS = ("raw",) + tuple(ROLLUPS)
+DEFAULT_MAX_POINTS = 1000
+MAX_OPEN_SEGMENTS = 4096
+
+MAGIC = b"DTKH"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHQdd")
+# rollup: ts del bucket, conteggio, poi somma/min/max di ogni metrica
+_ROLLUP_COLS = 2 + 3 * len(METRICS)
+_RAW_COLS = 1 + len(METRICS)
+
+
+def _dirname(twin_id: str) -> str:
+    # niente "." nei nomi: nessun twin_id può diventare ".." o un file nascosto
+    return quote(twin_id, safe="").replace(".", "%2E")
+
+
+def write_segment(path: str, columns: np.ndarray) -> None:
+    """Write `columns` (float64, shape (n_columns, rows), row 0 = ts) as a segment."""
+    columns = np.ascontiguousarray(columns, dtype="<f8")
+    ts = columns[0]
+    header = _HEADER.pack(MAGIC, VERSION, columns.shape[0], columns.shape[1],
+                          float(ts[0]) if len(ts) else 0.0, float(ts[-1]) if len(ts) else 0.0)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(columns.tobytes())
+    os.replace(tmp, path)
+
+
+def read_header(path: str) -> Tuple[int, int, float, float]:
+    with open(path, "rb") as f:
+        magic, version, n_cols, rows, t_min, t_max = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not a KPI history segment (version {VERSION})")
+    return n_cols, rows, t_min, t_max
+
+
+def rollup(columns: np.ndarray, width: float) -> np.ndarray:
+    """Raw columns sorted by ts -> rollup columns, one row per bucket of `width` seconds."""
+    ts = columns[0]
+    if not len(ts):
+        return np.empty((_ROLLUP_COLS, 0))
+    bucket = np.floor(ts / width) * width
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    values = columns[1:]
+    out = np.empty((_ROLLUP_COLS, len(starts)))
+    out[0] = bucket[starts]
+    out[1] = np.diff(np.append(starts, len(ts)))
+    out[2::3] = np.add.reduceat(values, starts, axis=1)
+    out[3::3] = np.minimum.reduceat(values, starts, axis=1)
+    out[4::3] = np.maximum.reduceat(values, starts, axis=1)
+    return out
+
+
+def merge_rollups(columns: np.ndarray) -> np.ndarray:
+    """Merge rollup rows of the same bucket (rows from different segments)."""
+    ts = columns[0]
+    if len(ts) < 2:
+        return columns
+    if (np.diff(ts) < 0).any():
+        columns = columns[:, np.argsort(ts, kind="stable")]
+        ts = columns[0]
+    starts = np.flatnonzero(np.concatenate(([True], ts[1:] != ts[:-1])))
+    if len(starts) == len(ts):
+        return columns
+    out = np.empty((_ROLLUP_COLS, len(starts)))
+    out[0] = ts[starts]
+    out[1] = np.add.reduceat(columns[1], starts)
+    out[2::3] = np.add.reduceat(columns[2::3], starts, axis=1)
+    out[3::3] = np.minimum.reduceat(columns[3::3], starts, axis=1)
+    out[4::3] = np.maximum.reduceat(columns[4::3], starts, axis=1)
+    return out
+
+
+class _Segment:
+    __slots__ = ("path", "seq", "rows", "t_min", "t_max")
+
+    def __init__(self, path: str, seq: int):
+        self.path = path
+        self.seq = seq
+        _, self.rows, self.t_min, self.t_max = read_header(path)
+
+
+class _TwinLog:
+    """Sealed segments per resolution plus the open log of one twin."""
+
+    __slots__ = ("path", "seq", "segments", "active", "n")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments: Dict[str, List[_Segment]] = {r: [] for r in RESOLUTIONS}
+        self.active = np.empty((_RAW_COLS, 256))
+        self.n = 0
+        self.seq = 0
+        os.makedirs(path, exist_ok=True)
+        found: Dict[str, Dict[int, str]] = {r: {} for r in RESOLUTIONS}
+        logs: Dict[int, str] = {}
+        for name in os.listdir(path):
+            stem, ext = os.path.splitext(name)
+            level, _, seq = stem.rpartition("-")
+            if not seq.isdigit():
+                continue
+            if ext == ".seg" and level in found:
+                found[level][int(seq)] = os.path.join(path, name)
+            elif ext == ".log" and level == "raw":
+                logs[int(seq)] = os.path.join(path, name)
+        sealed = set(found["raw"])
+        for level, by_seq in found.items():
+            for seq, seg_path in sorted(by_seq.items()):
+                if seq not in sealed:
+                    os.remove(seg_path)
+                    continue
+                self.segments[level].append(_Segment(seg_path, seq))
+        for seq, log_path in list(logs.items()):
+            if seq in sealed:
+                os.remove(log_path)
+                del logs[seq]
+        self.seq = max(logs) if logs else max(sealed, default=-1) + 1
+        log_path = self.log_path
+        if os.path.exists(log_path):
+            data = np.fromfile(log_path, dtype="<f8")
+            rows = len(data) // _RAW_COLS
+            # una riga troncata da un crash si scarta
+            if rows * _RAW_COLS != len(data):
+                with open(log_path, "r+b") as f:
+                    f.truncate(rows * _RAW_COLS * 8)
+            self._reserve(rows)
+            self.active[:, :rows] = data[:rows * _RAW_COLS].reshape(rows, _RAW_COLS).T
+            self.n = rows
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.path, f"raw-{self.seq:08d}.log")
+
+    def _reserve(self, rows: int) -> None:
+        if rows > self.active.shape[1]:
+            grown = np.empty((_RAW_COLS, max(rows, 2 * self.active.shape[1])))
+            grown[:, :self.n] = self.active[:, :self.n]
+            self.active = grown
+
+    def append(self, rows: np.ndarray) -> None:
+        """Append raw columns (shape (_RAW_COLS, k)); seals full logs."""
+        while rows.shape[1]:
+            take = min(rows.shape[1], SEGMENT_ROWS - self.n)
+            chunk = rows[:, :take]
+            with open(self.log_path, "ab") as f:
+                f.write(np.ascontiguousarray(chunk.T, dtype="<f8").tobytes())
+            self._reserve(self.n + take)
+            self.active[:, self.n:self.n + take] = chunk
+            self.n += take
+            rows = rows[:, take:]
+            if self.n >= SEGMENT_ROWS:
+                self.seal()
+
+    def seal(self) -> None:
+        if not self.n:
+            return
+        columns = self.active[:, :self.n]
+        columns = columns[:, np.argsort(columns[0], kind="stable")]
+        written = []
+        for level, width in ROLLUPS.items():
+            written.append((level, self._write(level, rollup(columns, width))))
+        # il segmento raw per ultimo: è lui a rendere valido il sigillo
+        written.append(("raw", self._write("raw", columns)))
+        for level, seg_path in written:
+            self.segments[level].append(_Segment(seg_path, self.seq))
+        os.remove(self.log_path)
+        self.seq += 1
+        self.active = np.empty((_RAW_COLS, 256))
+        self.n = 0
+
+    def _write(self, level: str, columns: np.ndarray) -> str:
+        seg_path = os.path.join(self.path, f"{level}-{self.seq:08d}.seg")
+        write_segment(seg_path, columns)
+        return seg_path
+
+
+class KpiHistory:
+    """KPI time series of many twins under one directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._twins: Dict[str, _TwinLog] = {}
+        self._maps: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.points_appended = 0
+
+    def _twin(self, twin_id: str, create: bool) -> Optional[_TwinLog]:
+        log = self._twins.get(twin_id)
+        if log is None:
+            path = os.path.join(self.root, _dirname(twin_id))
+            if not create and not os.path.isdir(path):
+                return None
+            log = self._twins[twin_id] = _TwinLog(path)
+        return log
+
+    def twins(self) -> List[str]:
+        with self._lock:
+            on_disk = {unquote(name) for name in os.listdir(self.root)
+                       if os.path.isdir(os.path.join(self.root, name))}
+            return sorted(on_disk | set(self._twins))
+
+    def append(self, twin_id: str, ts: Any, **metrics: Any) -> int:
+        """Append points given as columns: `ts` plus one array per metric in `METRICS`."""
+        missing = [m for m in METRICS if m not in metrics]
+        unknown = [m for m in metrics if m not in METRICS]
+        if missing or unknown:
+            raise ValueError(f"metrics must be exactly {list(METRICS)}")
+        try:
+            rows = np.array([ts] + [metrics[m] for m in METRICS], dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("ts and every metric must be numbers, or lists of the same length") from None
+        if rows.ndim == 1:
+            rows = rows[:, None]
+        if rows.ndim != 2:
+            raise ValueError("ts and every metric must be flat lists of numbers")
+        if not np.isfinite(rows).all():
+            raise ValueError("ts and metrics must be finite numbers")
+        with self._lock:
+            self._twin(twin_id, create=True).append(rows)
+            self.points_appended += rows.shape[1]
+        return rows.shape[1]
+
+    def record(self, twin_id: str, kpis: Mapping[str, Any], ts: Optional[float] = None) -> None:
+        """Append one KPI result (as returned by compute_kpis) at `ts` (default: now)."""
+        self.append(twin_id, time.time() if ts is None else ts, **{m: kpis[m] for m in METRICS})
+
+    def flush(self, twin_id: Optional[str] = None) -> None:
+        """Seal the open logs now (of one twin, or of every twin opened so far)."""
+        with self._lock:
+            for tid in [twin_id] if twin_id is not None else list(self._twins):
+                log = self._twin(tid, create=False)
+                if log is not None:
+                    log.seal()
+
+    def _map(self, path: str, n_cols: int, rows: int) -> np.ndarray:
+        columns = self._maps.get(path)
+        if columns is None:
+            columns = np.memmap(path, dtype="<f8", mode="r", offset=_HEADER.size, shape=(n_cols, rows))
+            self._maps[path] = columns
+            while len(self._maps) > MAX_OPEN_SEGMENTS:
+                self._maps.popitem(last=False)
+        else:
+            self._maps.move_to_end(path)
+        return columns
+
+    def _read(self, log: _TwinLog, resolution: str, start: float, end: float) -> np.ndarray:
+        n_cols = _RAW_COLS if resolution == "raw" else _ROLLUP_COLS
+        lo, hi = start, end
+        if resolution != "raw":
+            # bucket interi: conta quello che contiene `start` e quello che inizia prima di `end`
+            width = ROLLUPS[resolution]
+            lo, hi = np.floor(start / width) * width, np.ceil(end / width) * width
+        parts = []
+        with self._lock:
+            segments = [s for s in log.segments[resolution] if s.t_max >= lo and s.t_min < end]
+            maps = [self._map(s.path, n_cols, s.rows) for s in segments]
+            active = log.active[:, :log.n]
+        for columns in maps:
+            ts = columns[0]
+            i, j = np.searchsorted(ts, lo, "left"), np.searchsorted(ts, end, "left")
+            if j > i:
+                parts.append(np.asarray(columns[:, i:j]))
+        if active.shape[1]:
+            tail = active[:, (active[0] >= lo) & (active[0] < hi)]
+            if tail.shape[1]:
+                tail = tail[:, np.argsort(tail[0], kind="stable")]
+                parts.append(tail if resolution == "raw" else rollup(tail, ROLLUPS[resolution]))
+        if not parts:
+            return np.empty((n_cols, 0))
+        out = np.concatenate(parts, axis=1)
+        if resolution == "raw":
+            if len(parts) > 1 and (np.diff(out[0]) < 0).any():
+                out = out[:, np.argsort(out[0], kind="stable")]
+            return out
+        return merge_rollups(out)
+
+    def query(self, twin_id: str, start: Optional[float] = None, end: Optional[float] = None,
+              resolution: str = "auto", max_points: int = DEFAULT_MAX_POINTS) -> Optional[Dict[str, Any]]:
+        """Points of `twin_id` with `start <= ts < end`; None if the twin has no history.
+
+        `resolution="auto"` picks the finest rollup with at most `max_points`
+        buckets over the range (the coarsest one if none fits).
+        """
+        end = time.time() if end is None else end
+        start = end - 86400.0 if start is None else start
+        if end <= start:
+            raise ValueError("end must be after start")
+        if resolution == "auto":
+            resolution = next((r for r, width in ROLLUPS.items() if (end - start) / width <= max_points),
+                              RESOLUTIONS[-1])
+        elif resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be 'auto' or one of {list(RESOLUTIONS)}")
+        with self._lock:
+            log = self._twin(twin_id, create=False)
+        if log is None:
+            return None
+        # l'indicizzazione mista può dare righe non contigue: orjson le vuole contigue
+        columns = np.ascontiguousarray(self._read(log, resolution, start, end))
+        out: Dict[str, Any] = {"twin_id": twin_id, "resolution": resolution, "start": start, "end": end,
+                               "points": columns.shape[1], "ts": columns[0]}
+        if resolution == "raw":
+            for k, m in enumerate(METRICS):
+                out[m] = columns[1 + k]
+            return out
+        out["bucket_s"] = ROLLUPS[resolution]
+        out["count"] = columns[1].astype(np.int64)
+        for k, m in enumerate(METRICS):
+            out[m] = {"mean": columns[2 + 3 * k] / columns[1], "min": columns[3 + 3 * k],
+                      "max": columns[4 + 3 * k]}
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "twins_open": len(self._twins),
+                "segments": sum(len(s) for log in self._twins.values() for s in log.segments.values()),
+                "open_points": sum(log.n for log in self._twins.values()),
+                "mapped_segments": len(self._maps),
+                "points_appended": self.points_appended,
+            }
@@ -0,0 +1,107 @@
+"""Push of live KPI values to subscribers, keyed by twin id.
+
+Each twin with at least one subscriber has a `Topic` holding only its
+latest value and a version; the topic is dropped with its last subscriber,
+and publishing to a twin nobody watches is a no-op. A subscriber parks on
+the topic's `asyncio.Event` until the value changes, so an idle subscriber
+is a single pending wait. Publishing an equal value is a no-op too. Subscribers always read the latest value after their own rate-limit
+sleep, so bursts are coalesced and a slow client never builds up a backlog.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+
+class Topic:
+    __slots__ = ("value", "version", "subscribers", "changed")
+
+    def __init__(self):
+        self.value: Any = None
+        self.version = 0
+        self.subscribers = 0
+        self.changed: Optional[asyncio.Event] = None
+
+    def notify(self) -> None:
+        if self.changed is not None:
+            self.changed.set()
+            self.changed = None
+
+
+class KpiBroadcaster:
+    def __init__(self):
+        self.topics: Dict[str, Topic] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def has_subscribers(self, twin_id: str) -> bool:
+        topic = self.topics.get(twin_id)
+        return topic is not None and topic.subscribers > 0
+
+    def publish(self, twin_id: str, value: Any) -> bool:
+        """Store a new value for the subscribers of a twin; safe to call from worker threads."""
+        topic = self.topics.get(twin_id)
+        if topic is None or topic.value == value:
+            return False
+        topic.value = value
+        topic.version += 1
+        loop = self._loop
+        if topic.subscribers and loop is not None:
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                topic.notify()
+            else:
+                loop.call_soon_threadsafe(topic.notify)
+        return True
+
+    async def subscribe(self, twin_id: str, min_interval_s: float = 0.5, heartbeat_s: float = 15.0,
+                        initial: Any = None) -> AsyncIterator[Optional[Any]]:
+        """Yield the latest value on change (None = heartbeat), at most once per interval.
+
+        `initial` (e.g. the registered KPIs) seeds a topic nobody was watching yet.
+        """
+        self._loop = asyncio.get_running_loop()
+        topic = self.topics.get(twin_id)
+        if topic is None:
+            topic = self.topics[twin_id] = Topic()
+            if initial is not None:
+                topic.value = initial
+                topic.version = 1
+        topic.subscribers += 1
+        seen = 0
+        try:
+            while True:
+                if topic.version == seen:
+                    if topic.changed is None:
+                        topic.changed = asyncio.Event()
+                    try:
+                        await asyncio.wait_for(topic.changed.wait(), heartbeat_s)
+                    except asyncio.TimeoutError:
+                        yield None
+                        continue
+                seen = topic.version
+                yield topic.value
+                await asyncio.sleep(min_interval_s)
+        finally:
+            topic.subscribers -= 1
+            if topic.subscribers == 0 and self.topics.get(twin_id) is topic:
+                del self.topics[twin_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "topics": len(self.topics),
+            "subscribers": sum(t.subscribers for t in self.topics.values()),
+        }
+
+
+async def sse_events(updates: AsyncIterator[Optional[Any]], event: str = "kpis") -> AsyncIterator[bytes]:
+    version = 0
+    async for value in updates:
+        if value is None:
+            yield b": keepalive\n\n"
+            continue
+        version += 1
+        data = json.dumps(value, separators=(",", ":"))
+        yield f"event: {event}\nid: {version}\ndata: {data}\n\n".encode("utf-8")
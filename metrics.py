@@ -0,0 +1,235 @@
+"""Low-overhead metrics, per-stage timing and an on-demand sampling profiler.
+
+- `MetricsMiddleware` (pure ASGI) times every request into a per-route
+  latency histogram and adds a `Server-Timing` header listing the stages
+  recorded while handling it.
+- `stage("compile")` times a block into the current request's stages and a
+  per-stage histogram; outside a request it only feeds the histogram.
+- Gauges and counters are callbacks registered with `register_gauges` /
+  `register_counters` and read only when `/metrics` is scraped; counter
+  names end in `_total`.
+- `Profiler` samples every thread's stack from a background thread while
+  enabled and aggregates them as collapsed stacks (flame graph input).
+
+`render_metrics()` returns the Prometheus text exposition format.
+"""
+
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request: ContextVar[Optional["_RequestTimer"]] = ContextVar("dtaas_request", default=None)
+
+
+class _RequestTimer:
+    __slots__ = ("t0", "stages")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [conteggi per bucket..., +Inf, somma]
+                series = self._series[label_values] = [0.0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(k, list(v)) for k, v in self._series.items()]
+        for label_values, series in sorted(snapshot):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += int(count)
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+            braces = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{braces} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{braces} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_LATENCY = Histogram("dtaas_http_request_duration_seconds", "HTTP request latency by route.",
+                            ("method", "route", "status"))
+STAGE_LATENCY = Histogram("dtaas_stage_duration_seconds", "Time spent in each request stage.", ("stage",))
+
+_gauges: List[Callable[[], Dict[str, Tuple[float, str]]]] = []
+_counters: List[Callable[[], Dict[str, Tuple[float, str]]]] = []
+
+
+def register_gauges(fn: Callable[[], Dict[str, Tuple[float, str]]]) -> None:
+    """Register a callback returning {metric name: (value, help)}, read at scrape time."""
+    _gauges.append(fn)
+
+
+def register_counters(fn: Callable[[], Dict[str, Tuple[float, str]]]) -> None:
+    """Like register_gauges, for values that only grow; names must end in `_total`."""
+    _counters.append(fn)
+
+
+def render_metrics() -> str:
+    lines = REQUEST_LATENCY.render() + STAGE_LATENCY.render()
+    for kind, fns in (("gauge", _gauges), ("counter", _counters)):
+        for fn in fns:
+            for name, (value, help) in sorted(fn().items()):
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {float(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# ---- per-request stages ----
+
+def record(name: str, seconds: float) -> None:
+    STAGE_LATENCY.observe(seconds, name)
+    timer = _request.get()
+    if timer is not None:
+        timer.stages.append((name, seconds))
+
+
+def mark(name: str) -> None:
+    """Record the time since the request started as stage `name` (e.g. body parsing)."""
+    timer = _request.get()
+    if timer is not None:
+        record(name, time.perf_counter() - timer.t0)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+def server_timing(stages: List[Tuple[str, float]], total_s: float) -> str:
+    parts = [f"{name};dur={seconds * 1e3:.3f}" for name, seconds in stages]
+    parts.append(f"total;dur={total_s * 1e3:.3f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timer = _RequestTimer()
+        token = _request.set(timer)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                total = time.perf_counter() - timer.t0
+                headers.append((b"server-timing", server_timing(timer.stages, total).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
+            route = scope.get("route")
+            # solo template di route: niente path con id nelle label
+            path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.observe(time.perf_counter() - timer.t0, scope["method"], path, str(status[0]))
+
+
+# ---- sampling profiler ----
+
+class Profiler:
+    """Samples all thread stacks every `interval_s` while enabled."""
+
+    def __init__(self):
+        self.interval_s = 0.005
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval_s: float = 0.005, reset: bool = True) -> None:
+        self.stop()
+        with self._lock:
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+            self.interval_s = interval_s
+            self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dtaas-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            stacks = []
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(names)))
+            with self._lock:
+                self.samples += 1
+                for key in stacks:
+                    self._stacks[key] = self._stacks.get(key, 0) + 1
+
+    def collapsed(self, limit: Optional[int] = None) -> str:
+        """Collapsed stacks (`frame;frame;frame count`), most frequent first."""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda kv: kv[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in items[:limit])
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "interval_s": self.interval_s,
+                    "samples": self.samples, "stacks": len(self._stacks), "started_at": self.started_at}
+
+
+profiler = Profiler()
@@ -0,0 +1,143 @@
+"""Monte Carlo throughput distribution for a compiled twin.
+
+Station params are drawn from the requested distributions as NumPy arrays,
+one chunk at a time, and pushed through `twin_graph.vector_throughput`.
+Chunk `i` always uses the `i`-th child of `SeedSequence(seed)`, and the
+convergence check walks chunks in index order, so a given seed gives the
+same answer whether chunks ran inline or on the process pool. Sampling stops
+as soon as the standard error of the miss probability drops below
+`tolerance`.
+"""
+
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from sweep import resolve_param
+from twin_graph import LineGraph, vector_throughput
+from workers import process_pool, worker_count
+
+MAX_SAMPLES = 20_000_000
+MAX_CHUNK_SIZE = 1_000_000
+# ogni chunk è un giro nel pool (o inline): troppi chunk piccoli costano più del campionamento
+MAX_CHUNKS = 10_000
+
+_BOUNDS = {
+    "cycle_time_s": (1e-6, math.inf),
+    "availability_pct": (0.0, 100.0),
+    "scrap_rate_pct": (0.0, 100.0),
+}
+
+
+def draw(rng: np.random.Generator, spec: Dict[str, Any], n: int) -> np.ndarray:
+    dist = spec.get("dist", "normal")
+    if dist == "normal":
+        x = rng.normal(float(spec["mean"]), float(spec["std"]), n)
+    elif dist == "uniform":
+        x = rng.uniform(float(spec["low"]), float(spec["high"]), n)
+    elif dist == "triangular":
+        x = rng.triangular(float(spec["low"]), float(spec["mode"]), float(spec["high"]), n)
+    elif dist == "beta":
+        low, high = float(spec.get("low", 0.0)), float(spec.get("high", 1.0))
+        x = low + (high - low) * rng.beta(float(spec["a"]), float(spec["b"]), n)
+    elif dist == "fixed":
+        x = np.full(n, float(spec["value"]))
+    else:
+        raise ValueError(f"unknown distribution {dist!r}")
+    return x
+
+
+def _sample_chunk(twin: Dict[str, Any], specs: Dict[str, Dict[str, Any]],
+                  seed: int, index: int, n: int) -> np.ndarray:
+    graph = LineGraph.from_twin(twin)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+    overrides = {}
+    for name in sorted(specs):
+        u, param = resolve_param(graph, name)
+        if param not in _BOUNDS:
+            raise ValueError(f"param {param!r} cannot be sampled")
+        low, high = _BOUNDS[param]
+        overrides[(u, param)] = np.clip(draw(rng, specs[name], n), low, high)
+    throughput, _ = vector_throughput(graph, overrides)
+    return np.broadcast_to(throughput, (n,)).astype(np.float64, copy=False)
+
+
+def monte_carlo(twin: Dict[str, Any], distributions: Dict[str, Dict[str, Any]], seed: int = 0,
+                max_samples: int = 1_000_000, min_samples: int = 10_000, chunk_size: int = 50_000,
+                tolerance: float = 0.0025, target_throughput_pph: Optional[float] = None,
+                percentiles: Sequence[float] = (5, 25, 50, 75, 95), parallel: bool = True,
+                progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    if not distributions:
+        raise ValueError("no distributions given")
+    if chunk_size < 1 or max_samples < 1:
+        raise ValueError("chunk_size and max_samples must be >= 1")
+    if max_samples > MAX_SAMPLES:
+        raise ValueError(f"max_samples is {max_samples}, limit is {MAX_SAMPLES}")
+    if chunk_size > MAX_CHUNK_SIZE:
+        raise ValueError(f"chunk_size is {chunk_size}, limit is {MAX_CHUNK_SIZE}")
+    n_chunks = -(-max_samples // chunk_size)
+    if n_chunks > MAX_CHUNKS:
+        raise ValueError(f"{n_chunks} chunks of {chunk_size} samples, limit is {MAX_CHUNKS}; raise chunk_size")
+    line = twin.get("line", {})
+    target = target_throughput_pph if target_throughput_pph is not None else line.get("target_throughput_pph")
+    hours = float(line.get("shift_hours", 8))
+    # fail fast on bad param names before any work is scheduled
+    graph = LineGraph.from_twin(twin)
+    for name in distributions:
+        resolve_param(graph, name)
+
+    def size(k: int) -> int:
+        return min(chunk_size, max_samples - k * chunk_size)
+
+    per_round = worker_count() if parallel and n_chunks > 1 else 1
+
+    chunks: List[np.ndarray] = []
+    n = 0
+    misses = 0
+    converged = False
+    i = 0
+    while i < n_chunks and not converged:
+        batch = range(i, min(i + per_round, n_chunks))
+        if per_round > 1:
+            pool = process_pool()
+            futures = [pool.submit(_sample_chunk, twin, distributions, seed, k, size(k)) for k in batch]
+            results = [f.result() for f in futures]
+        else:
+            results = [_sample_chunk(twin, distributions, seed, k, size(k)) for k in batch]
+        for tp in results:
+            chunks.append(tp)
+            n += tp.size
+            i += 1
+            if progress is not None:
+                progress(i / n_chunks)
+            if target is None:
+                continue
+            misses += int(np.count_nonzero(tp < float(target)))
+            p = misses / n
+            if n >= min_samples and math.sqrt(max(p * (1 - p), 1.0 / n) / n) < tolerance:
+                converged = True
+                break
+
+    samples = np.concatenate(chunks)
+    pct = np.percentile(samples, percentiles)
+    result: Dict[str, Any] = {
+        "samples": int(samples.size),
+        "seed": seed,
+        "shift_hours": hours,
+        "throughput_pph": {
+            "mean": round(float(samples.mean()), 2),
+            "std": round(float(samples.std()), 2),
+            **{f"p{q:g}": round(float(v), 2) for q, v in zip(percentiles, pct)},
+        },
+        "output_per_shift": {f"p{q:g}": round(float(v) * hours, 1) for q, v in zip(percentiles, pct)},
+    }
+    if target is not None:
+        p = misses / n
+        result.update({
+            "target_throughput_pph": float(target),
+            "miss_probability": round(p, 6),
+            "miss_probability_se": round(math.sqrt(p * (1 - p) / n), 6),
+            "converged": converged,
+        })
+    return result
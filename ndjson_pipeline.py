@@ -0,0 +1,91 @@
+"""Generator pipeline for bulk NDJSON scoring.
+
+Input chunks are split into lines, each line is decoded and scored, and each
+result is encoded back to one NDJSON line as soon as it is ready. Nothing
+holds more than the current line, so memory stays flat however long the
+stream is; the consumer pulling results drives how fast input is read.
+
+The async side scores the lines of each input chunk together through an
+``offload`` callable (e.g. starlette's ``run_in_threadpool``), so a slow
+scorer never blocks the event loop. Errors found once the response has
+started, like an over-long line, end the stream with an error record.
+"""
+
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+Scorer = Callable[[Any], Dict[str, Any]]
+Offload = Callable[..., Awaitable[Any]]
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        yield from lines
+        if len(buf) > MAX_LINE_BYTES:
+            raise LineTooLong(f"line longer than {MAX_LINE_BYTES} bytes")
+    if buf:
+        yield buf
+
+
+async def aiter_line_batches(chunks: AsyncIterable[bytes]) -> AsyncIterator[List[bytes]]:
+    """Like iter_lines, but yields the complete lines of each chunk together."""
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        if lines:
+            yield lines
+        if len(buf) > MAX_LINE_BYTES:
+            raise LineTooLong(f"line longer than {MAX_LINE_BYTES} bytes")
+    if buf:
+        yield [buf]
+
+
+def score_line(n: int, line: bytes, score: Scorer) -> Dict[str, Any]:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return {"line": n, "error": f"invalid JSON: {e}"}
+    result = {"line": n}
+    result.update(score(record))
+    return result
+
+
+def score_lines(lines: Iterable[bytes], score: Scorer) -> Iterator[Dict[str, Any]]:
+    for n, line in enumerate(lines, 1):
+        if line.strip():
+            yield score_line(n, line, score)
+
+
+def score_batch(start: int, lines: List[bytes], score: Scorer) -> List[Dict[str, Any]]:
+    return [score_line(n, line, score) for n, line in enumerate(lines, start + 1) if line.strip()]
+
+
+async def ascore_lines(batches: AsyncIterable[List[bytes]], score: Scorer,
+                       offload: Optional[Offload] = None) -> AsyncIterator[Dict[str, Any]]:
+    n = 0
+    try:
+        async for lines in batches:
+            if offload is None:
+                results = score_batch(n, lines, score)
+            else:
+                results = await offload(score_batch, n, lines, score)
+            n += len(lines)
+            for result in results:
+                yield result
+    except LineTooLong as e:
+        # gli header sono già partiti: l'errore va nello stream, non in uno status code
+        yield {"line": n + 1, "error": str(e)}
+
+
+def encode(result: Dict[str, Any]) -> bytes:
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
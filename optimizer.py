@@ -0,0 +1,415 @@
+"""Buffer-allocation and station-count optimizer for multi-station lines.
+
+Throughput evaluator (coupling approximation). A station's capacity is the
+flow model's `machines * 3600 / cycle * availability`, reduced by the
+stoppages of the other stations that reach it through the line:
+
+    A_eff[i] = A[i] / (1 + sum_j C[i, j] * D[j] / m[j]),   D = (1 - A) / A
+
+`C[i, j]` is the probability that a stoppage of j propagates to i: the
+product over the path between them of `p(b) = exp(-t(b) / MTTR)`, where
+`t(b)` is how long a buffer of `b` parts keeps its neighbour going at the
+target flow. With no buffers every stoppage couples (`C = 1`, the classic
+`1 / (1 + sum D)` of a rigid line); with large buffers `C -> 0` and the
+result is exactly the flow model of `twin_graph.line_kpis`. Repairs use
+`mttr_s` (default `simulation.DEFAULT_MTTR_S`). Setup time is ignored.
+
+Search. Machine counts start from a per-station lower bound (the machines
+needed even with infinite buffers) and grow one machine at a time at the
+tightest stations, with branch and bound: a node whose machine cost alone
+is not below the best total found so far is pruned. For each node, buffers
+are filled greedily by throughput gain per unit cost until the target is
+met, then trimmed; a child starts from its parent's buffers, which still
+meet the target with one machine more, and only trims them. Nodes are
+expanded cheapest estimate first and evaluated in parallel on the process
+pool. Serial and tree-shaped lines evaluate the coupling with one matrix
+product; lines with parallel branches use a Floyd-Warshall closure.
+"""
+
+import heapq
+import math
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from simulation import DEFAULT_MTTR_S
+from twin_graph import LineGraph, propagate_visits
+from workers import process_pool, worker_count
+
+# oltre (stazioni^2 * archi) celle la tabella dei percorsi pesa più del Floyd-Warshall
+PATH_TABLE_MAX = 4_000_000
+DEFAULT_MACHINE_COST = 100.0
+DEFAULT_BUFFER_COST = 1.0
+
+
+class LineModel:
+    """Per-station arrays of a compiled twin, picklable for the worker pool."""
+
+    def __init__(self, twin: Dict[str, Any]):
+        graph = LineGraph.from_twin(twin)
+        visits = propagate_visits(graph)
+        self.stations = graph.stations()
+        if not self.stations:
+            raise ValueError("twin has no station node")
+        local = {u: i for i, u in enumerate(self.stations)}
+        self.ids = [graph.ids[u] for u in self.stations]
+        params = [graph.nodes[u]["params"] for u in self.stations]
+        cycle = np.array([float(p["cycle_time_s"]) for p in params])
+        if (cycle <= 0).any():
+            raise ValueError("cycle_time_s must be > 0")
+        self.rate = 3600.0 / cycle
+        self.availability = np.array([float(p["availability_pct"]) / 100.0 for p in params])
+        if (self.availability <= 0).any():
+            raise ValueError("availability_pct must be > 0")
+        self.downtime = (1.0 - self.availability) / self.availability
+        self.mttr = np.array([float(p.get("mttr_s", DEFAULT_MTTR_S)) for p in params])
+        self.machines = np.array([int(p.get("machines", 1)) for p in params])
+        self.visits = np.array([visits[u] for u in self.stations])
+        self.out_per_release = sum(visits[u] for u, k in enumerate(graph.kinds) if k == "sink")
+
+        # buffer candidati: archi stazione -> stazione, con il flusso per pezzo rilasciato
+        self.edges: List[Tuple[int, int]] = []
+        self.edge_flow: List[float] = []
+        for u in self.stations:
+            scrap = float(graph.nodes[u]["params"].get("scrap_rate_pct", 0.0)) / 100.0
+            for v, share in graph.succ[u]:
+                if v in local:
+                    self.edges.append((local[u], local[v]))
+                    self.edge_flow.append(visits[u] * (1.0 - scrap) * share)
+        self.edge_src = np.array([e[0] for e in self.edges], dtype=np.intp)
+        self.edge_dst = np.array([e[1] for e in self.edges], dtype=np.intp)
+        self.edge_mttr = (self.mttr[self.edge_src] + self.mttr[self.edge_dst]) / 2 if self.edges else np.zeros(0)
+        self.target: Optional[float] = None
+        self._decay = np.zeros(len(self.edges))
+        self._paths = self._path_incidence()
+
+    def _path_incidence(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """For a line whose undirected graph is a forest: (pairs x edges incidence, connected mask).
+
+        Paths are then unique and the coupling is one matrix product instead
+        of a Floyd-Warshall closure. None for graphs with parallel branches or
+        too large to tabulate.
+        """
+        n, n_edges = len(self.ids), len(self.edges)
+        if not n_edges or n * n * n_edges > PATH_TABLE_MAX:
+            return None
+        adj: List[List[Tuple[int, int]]] = [[] for _ in range(n)]
+        for e, (u, v) in enumerate(self.edges):
+            adj[u].append((v, e))
+            adj[v].append((u, e))
+        incidence = np.zeros((n, n, n_edges))
+        connected = np.zeros((n, n), dtype=bool)
+        for root in range(n):
+            stack = [(root, -1)]
+            connected[root, root] = True
+            while stack:
+                u, via = stack.pop()
+                for v, e in adj[u]:
+                    if e == via:
+                        continue
+                    if connected[root, v]:
+                        return None  # ciclo non orientato: più percorsi tra due stazioni
+                    connected[root, v] = True
+                    incidence[root, v] = incidence[root, u]
+                    incidence[root, v, e] = 1.0
+                    stack.append((v, e))
+        return incidence.reshape(n * n, n_edges), connected
+
+    def set_target(self, target_pph: float) -> None:
+        """Fix the flow used to size buffers in seconds of coverage."""
+        self.target = target_pph
+        release = target_pph / self.out_per_release
+        flow_pph = np.maximum(release * np.asarray(self.edge_flow, dtype=np.float64), 1e-9)
+        # per ogni pezzo in buffer: secondi di copertura / MTTR
+        self._decay = 3600.0 / (flow_pph * self.edge_mttr) if self.edges else np.zeros(0)
+
+    def release_capacity(self, machines: np.ndarray, buffers: np.ndarray) -> np.ndarray:
+        """Parts released per hour each station sustains, for K configurations: (K, n)."""
+        machines = np.atleast_2d(machines).astype(np.float64)
+        buffers = np.atleast_2d(buffers).astype(np.float64)
+        k, n = machines.shape
+        idx = np.arange(n)
+        if self._paths is not None:
+            incidence, connected = self._paths
+            coupling = np.exp(-(buffers * self._decay) @ incidence.T).reshape(k, n, n) * connected
+        else:
+            coupling = np.zeros((k, n, n))
+            coupling[:, idx, idx] = 1.0
+        if self._paths is None and self.edges:
+            p = np.exp(-buffers * self._decay)
+            coupling[:, self.edge_src, self.edge_dst] = np.maximum(coupling[:, self.edge_src, self.edge_dst], p)
+            coupling[:, self.edge_dst, self.edge_src] = coupling[:, self.edge_src, self.edge_dst]
+            # chiusura max-prodotto (Floyd-Warshall) sul grafo non orientato
+            for m in range(n):
+                np.maximum(coupling, coupling[:, :, m, None] * coupling[:, None, m, :], out=coupling)
+        coupling[:, idx, idx] = 0.0
+        others = np.einsum("kij,kj->ki", coupling, self.downtime / machines)
+        a_eff = self.availability / (1.0 + others)
+        capacity = machines * self.rate * a_eff
+        with np.errstate(divide="ignore"):
+            return np.where(self.visits > 0, capacity / self.visits, np.inf)
+
+    def throughput(self, machines: np.ndarray, buffers: np.ndarray) -> np.ndarray:
+        """Throughput (pph) of K configurations: machines (K, n), buffers (K, E)."""
+        return self.release_capacity(machines, buffers).min(axis=1) * self.out_per_release
+
+
+def _cost_vector(model: LineModel, cost: Union[float, Dict[str, float]], default: float,
+                 name: str) -> np.ndarray:
+    # per stazione: le stazioni non elencate usano il costo di default
+    if isinstance(cost, dict):
+        unknown = set(cost) - set(model.ids)
+        if unknown:
+            raise ValueError(f"{name} for unknown stations: {sorted(unknown)}")
+        return np.array([float(cost.get(i, default)) for i in model.ids])
+    return np.full(len(model.ids), float(cost))
+
+
+def allocate_buffers(model: LineModel, machines: np.ndarray, target: float, max_buffer: int,
+                     buffer_cost: np.ndarray, budget: float = math.inf,
+                     warm: Optional[np.ndarray] = None) -> Tuple[Optional[np.ndarray], int]:
+    """Buffers reaching `target` for fixed machines: (buffers or None, evaluations).
+
+    Gives up (None) as soon as the buffers would cost `budget` or more. A
+    `warm` allocation already known to reach the target is only trimmed.
+    """
+    n_edges = len(model.edges)
+    buffers = np.zeros(n_edges, dtype=np.int64)
+    tp = float(model.throughput(machines, buffers)[0])
+    evals = 1
+    if tp >= target:
+        return buffers, evals
+    if not n_edges or budget <= 0:
+        return None, evals
+    eye = np.eye(n_edges, dtype=np.int64)
+    if warm is not None:
+        buffers = warm.copy()
+    else:
+        full = np.full(n_edges, max_buffer)
+        evals += 1
+        if float(model.throughput(machines, full)[0]) < target:
+            return None, evals
+        buffers, evals = _fill(model, machines, target, max_buffer, buffer_cost, budget, buffers, tp, evals, eye)
+        if buffers is None:
+            return None, evals
+    return _trim(model, machines, target, buffer_cost, buffers, evals, eye)
+
+
+def _fill(model: LineModel, machines: np.ndarray, target: float, max_buffer: int, buffer_cost: np.ndarray,
+          budget: float, buffers: np.ndarray, tp: float, evals: int,
+          eye: np.ndarray) -> Tuple[Optional[np.ndarray], int]:
+    spent = 0.0
+    while tp < target:
+        open_ = np.flatnonzero(buffers < max_buffer)
+        # passo adattivo: un buffer cresce al più del 50% per volta
+        steps = np.minimum(np.maximum(1, buffers[open_] // 2), max_buffer - buffers[open_])
+        cand = buffers + eye[open_] * steps[:, None]
+        gains = model.throughput(np.broadcast_to(machines, (len(open_), len(machines))), cand) - tp
+        evals += len(open_)
+        score = gains / (steps * buffer_cost[open_])
+        best = int(np.argmax(score))
+        buffers = cand[best]
+        tp += float(gains[best])
+        spent += float(steps[best] * buffer_cost[open_[best]])
+        if spent >= budget:
+            return None, evals
+    return buffers, evals
+
+
+def _trim(model: LineModel, machines: np.ndarray, target: float, buffer_cost: np.ndarray,
+          buffers: np.ndarray, evals: int, eye: np.ndarray) -> Tuple[np.ndarray, int]:
+    # rifinitura: toglie slot finché il target regge, a passi che si dimezzano
+    steps = np.maximum(1, buffers // 4)
+    while True:
+        filled = np.flatnonzero(buffers > 0)
+        if not len(filled):
+            break
+        step = np.minimum(steps[filled], buffers[filled])
+        cand = buffers - eye[filled] * step[:, None]
+        tps = model.throughput(np.broadcast_to(machines, (len(filled), len(machines))), cand)
+        evals += len(filled)
+        ok = np.flatnonzero(tps >= target)
+        if len(ok):
+            # risparmio maggiore; a parità, il taglio che costa meno throughput
+            best = ok[np.lexsort((-tps[ok], -(step[ok] * buffer_cost[filled][ok])))[0]]
+            buffers = cand[best]
+        elif (steps[filled] > 1).any():
+            steps[filled] = np.maximum(1, steps[filled] // 2)
+        else:
+            break
+    return buffers, evals
+
+
+def _evaluate_node(model: LineModel, machines: np.ndarray, target: float, max_buffer: int,
+                   buffer_cost: np.ndarray, budget: float,
+                   warm: Optional[np.ndarray]) -> Tuple[Optional[np.ndarray], int, np.ndarray]:
+    buffers, evals = allocate_buffers(model, machines, target, max_buffer, buffer_cost, budget, warm)
+    # margine di ogni stazione con i buffer al massimo: dove conviene aggiungere macchine
+    slack = model.release_capacity(machines, np.full(len(model.edges), max_buffer))[0]
+    return buffers, evals, slack
+
+
+def optimize(twin: Dict[str, Any], target_throughput_pph: Optional[float] = None,
+             machine_cost: Union[float, Dict[str, float]] = DEFAULT_MACHINE_COST,
+             buffer_cost: Union[float, Dict[str, float]] = DEFAULT_BUFFER_COST,
+             max_machines: int = 4, max_buffer: int = 50, max_nodes: int = 2000,
+             branching: int = 3, parallel: bool = True,
+             progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+    """Cheapest machines + buffers meeting the target throughput.
+
+    Costs are one number or {station id: cost}, unlisted stations at the
+    default; `buffer_cost` per station applies to the buffers downstream of it.
+    Each node branches on its `branching` tightest stations only.
+    """
+    target = target_throughput_pph
+    if target is None:
+        target = twin.get("line", {}).get("target_throughput_pph")
+    if target is None:
+        raise ValueError("no target_throughput_pph given and none in the twin")
+    target = float(target)
+    if target <= 0:
+        raise ValueError("target_throughput_pph must be > 0")
+    if max_machines < 1 or max_buffer < 0 or branching < 1:
+        raise ValueError("max_machines and branching must be >= 1, max_buffer >= 0")
+
+    model = LineModel(twin)
+    model.set_target(target)
+    m_cost = _cost_vector(model, machine_cost, DEFAULT_MACHINE_COST, "machine_cost")
+    b_cost = _cost_vector(model, buffer_cost, DEFAULT_BUFFER_COST, "buffer_cost")[model.edge_src] \
+        if model.edges else np.zeros(0)
+    if (m_cost < 0).any():
+        raise ValueError("machine_cost must be >= 0")
+    if (b_cost <= 0).any():
+        raise ValueError("buffer_cost must be > 0")
+    limit = np.maximum(model.machines, max_machines)
+
+    # limite inferiore: macchine necessarie anche con buffer infiniti
+    need = target / model.out_per_release * model.visits / (model.rate * model.availability)
+    start = np.maximum(model.machines, np.ceil(need - 1e-9).astype(np.int64))
+    baseline = {
+        "throughput_pph": round(float(model.throughput(model.machines, np.zeros(len(model.edges)))[0]), 2),
+        "throughput_pph_unlimited_buffers": round(float(model.throughput(
+            model.machines, np.full(len(model.edges), 1e9))[0]), 2),
+    }
+    result: Dict[str, Any] = {"target_throughput_pph": target, "baseline": baseline}
+    if (start > limit).any():
+        short = [model.ids[i] for i in np.flatnonzero(start > limit)]
+        return dict(result, feasible=False,
+                    reason=f"stations need more than max_machines={max_machines} even with unlimited buffers: {short}")
+
+    def machine_total(m: np.ndarray) -> float:
+        return float(((m - model.machines) * m_cost).sum())
+
+    best: Optional[Tuple[float, np.ndarray, np.ndarray]] = None
+    # (stima, costo macchine, configurazione): la stima è il costo del padre più la macchina,
+    # un limite superiore per il figlio perché i buffer del padre gli bastano
+    frontier: List[Tuple[float, float, Tuple[int, ...]]] = [(0.0, machine_total(start), tuple(start))]
+    seen = {tuple(start)}
+    warm: Dict[Tuple[int, ...], np.ndarray] = {}
+    explored = evaluations = pruned = 0
+    width = worker_count() if parallel else 1
+
+    while frontier and explored < max_nodes:
+        batch = []
+        while frontier and len(batch) < width:
+            _, cost, m = heapq.heappop(frontier)
+            if best is not None and cost >= best[0]:
+                pruned += 1
+                continue
+            batch.append((cost, np.array(m)))
+        if not batch:
+            break
+        budget = math.inf if best is None else best[0]
+        if len(batch) > 1:
+            pool = process_pool()
+            futures = [pool.submit(_evaluate_node, model, m, target, max_buffer, b_cost, budget - cost,
+                                   warm.pop(tuple(m), None)) for cost, m in batch]
+            outcomes = [f.result() for f in futures]
+        else:
+            cost, m = batch[0]
+            outcomes = [_evaluate_node(model, m, target, max_buffer, b_cost, budget - cost, warm.pop(tuple(m), None))]
+        for (cost, m), (buffers, evals, slack) in zip(batch, outcomes):
+            explored += 1
+            evaluations += evals
+            if buffers is not None:
+                total = cost + float((buffers * b_cost).sum())
+                if best is None or total < best[0]:
+                    best = (total, m, buffers)
+            else:
+                pruned += 1
+            open_ = np.flatnonzero(m < limit)
+            for i in open_[np.argsort(slack[open_], kind="stable")[:branching]]:
+                child = m.copy()
+                child[i] += 1
+                key = tuple(child)
+                child_cost = machine_total(child)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if best is None or child_cost < best[0]:
+                    if buffers is not None:
+                        # più macchine non peggiorano: i buffer del padre bastano al figlio
+                        warm[key] = buffers
+                        estimate = child_cost + float((buffers * b_cost).sum())
+                    else:
+                        estimate = child_cost
+                    heapq.heappush(frontier, (estimate, child_cost, key))
+                else:
+                    pruned += 1
+
+        if progress is not None:
+            progress(explored / max_nodes)
+
+    result.update(nodes_explored=explored, nodes_pruned=pruned, evaluations=evaluations,
+                  exhausted=not frontier)
+    if best is None:
+        return dict(result, feasible=False, reason="target not reachable within max_machines/max_buffer"
+                    if not frontier else f"no solution within max_nodes={max_nodes}")
+    total, machines, buffers = best
+    machine_part = machine_total(machines)
+    return dict(
+        result,
+        feasible=True,
+        throughput_pph=round(float(model.throughput(machines, buffers)[0]), 2),
+        cost={"machines": round(machine_part, 2), "buffers": round(total - machine_part, 2), "total": round(total, 2)},
+        machines={sid: int(m) for sid, m in zip(model.ids, machines)},
+        added_machines={sid: int(m - m0) for sid, m, m0 in zip(model.ids, machines, model.machines) if m > m0},
+        buffers=[{"from": model.ids[i], "to": model.ids[j], "capacity": int(b)}
+                 for (i, j), b in zip(model.edges, buffers)],
+        twin=apply_configuration(twin, model, machines, buffers),
+    )
+
+
+def apply_configuration(twin: Dict[str, Any], model: LineModel, machines: np.ndarray,
+                        buffers: np.ndarray) -> Dict[str, Any]:
+    """Copy of the twin with the chosen machine counts and edge buffers."""
+    m_by_id = {sid: int(m) for sid, m in zip(model.ids, machines)}
+    b_by_edge = {(model.ids[i], model.ids[j]): int(b) for (i, j), b in zip(model.edges, buffers)}
+    nodes = []
+    for node in twin["nodes"]:
+        if node["id"] in m_by_id:
+            node = dict(node, params=dict(node["params"], machines=m_by_id[node["id"]]))
+        nodes.append(node)
+    edges = []
+    for edge in twin["edges"]:
+        b = b_by_edge.get((edge["from"], edge["to"]))
+        edges.append(dict(edge, buffer=b) if b is not None else edge)
+    return dict(twin, nodes=nodes, edges=edges)
+
+
+if __name__ == "__main__":
+    import time
+
+    from api import compile_twin
+
+    rng = np.random.default_rng(0)
+    stations = [{"id": f"S{i}", "type": "assembly", "cycle_time_s": float(rng.integers(12, 20)),
+                 "availability_pct": float(rng.choice([88, 92, 95])), "scrap_rate_pct": 0.3}
+                for i in range(30)]
+    twin = compile_twin({"line": {"line_name": "Opt30", "shift_hours": 8, "target_throughput_pph": 160},
+                         "stations": stations, "quality": {}, "data": {"mode": "simulation"}})
+    t0 = time.perf_counter()
+    out = optimize(twin)
+    print(f"30 stations: {time.perf_counter() - t0:.2f}s, feasible={out['feasible']}, "
+          f"cost={out.get('cost')}, nodes={out['nodes_explored']}, evals={out['evaluations']}")
+    print("baseline", out["baseline"], "->", out.get("throughput_pph"), out.get("added_machines"))
@@ -0,0 +1,265 @@
+"""Realtime ingest of machine events with rolling-window KPIs.
+
+Events are plain dicts::
+
+    {"twin_id": "Cell_1", "station": "S1", "type": "cycle", "ts": 1700000000.0}
+    {"twin_id": "Cell_1", "station": "S1", "type": "scrap", "ts": ...}
+    {"twin_id": "Cell_1", "station": "S1", "type": "downtime", "ts": ..., "duration_s": 42}
+
+`cycle` is one completed part (good or bad), `scrap` marks one completed part
+as scrapped, `downtime` reports a stop that ended at `ts`. Each station keeps
+a preallocated ring buffer of its recent events plus running sums, so an
+event costs O(1): it is appended, and whatever fell out of the window is
+subtracted again. Downtime is attributed entirely to the moment it ends.
+
+Rates are taken over the span the window actually covers: from the newest
+event that left it (by age or because the ring was full) to now, capped at
+`window_s`. The very first event of a station only opens that span. Until
+it is `min_span_s` long the window is `warming_up` and reports no
+throughput or availability.
+
+The hub serialises ingest and reads behind one lock, since sync HTTP handlers
+post batches concurrently from the threadpool and a window is not safe to
+update from two threads at once.
+
+Sources are async iterables of events; `QueueSource` is an in-process stand-in
+for a broker and `FileReplaySource` replays an NDJSON capture.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Optional, Protocol, Tuple
+
+DEFAULT_WINDOW_S = 3600.0
+DEFAULT_CAPACITY = 8192
+DEFAULT_MIN_SPAN_S = 60.0
+
+_CYCLE, _SCRAP, _DOWNTIME = 0, 1, 2
+_KINDS = {"cycle": _CYCLE, "scrap": _SCRAP, "downtime": _DOWNTIME}
+
+
+class EventSource(Protocol):
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]: ...
+
+
+class StationWindow:
+    __slots__ = ("window_s", "capacity", "min_span_s", "ts", "kind", "value", "head", "size",
+                 "cycles", "scrap", "downtime_s", "horizon", "last_ts")
+
+    def __init__(self, window_s: float = DEFAULT_WINDOW_S, capacity: int = DEFAULT_CAPACITY,
+                 min_span_s: float = DEFAULT_MIN_SPAN_S):
+        self.window_s = window_s
+        self.capacity = capacity
+        self.min_span_s = min(min_span_s, window_s)
+        self.ts = [0.0] * capacity
+        self.kind = [0] * capacity
+        self.value = [0.0] * capacity
+        self.head = 0
+        self.size = 0
+        self.cycles = 0
+        self.scrap = 0
+        self.downtime_s = 0.0
+        # inizio (escluso) del tratto coperto: ts dell'ultimo evento uscito dalla finestra
+        self.horizon: Optional[float] = None
+        self.last_ts = 0.0
+
+    def _evict_oldest(self) -> None:
+        i = self.head - self.size
+        if i < 0:
+            i += self.capacity
+        k = self.kind[i]
+        if k == _CYCLE:
+            self.cycles -= 1
+        elif k == _SCRAP:
+            self.scrap -= 1
+        else:
+            self.downtime_s -= self.value[i]
+        self.size -= 1
+        self.horizon = self.ts[i]
+
+    def add(self, ts: float, kind: int, value: float = 0.0) -> None:
+        if self.horizon is None:
+            # il primo evento apre il tratto osservato, non si conta
+            self.horizon = self.last_ts = ts
+            return
+        if self.size == self.capacity:
+            self._evict_oldest()
+        i = self.head
+        self.ts[i] = ts
+        self.kind[i] = kind
+        self.value[i] = value
+        self.head = i + 1 if i + 1 < self.capacity else 0
+        self.size += 1
+        if kind == _CYCLE:
+            self.cycles += 1
+        elif kind == _SCRAP:
+            self.scrap += 1
+        else:
+            self.downtime_s += value
+        if ts > self.last_ts:
+            self.last_ts = ts
+        self.expire(self.last_ts)
+
+    def expire(self, now: float) -> None:
+        cutoff = now - self.window_s
+        ts = self.ts
+        cap = self.capacity
+        while self.size:
+            i = self.head - self.size
+            if i < 0:
+                i += cap
+            if ts[i] > cutoff:
+                break
+            self._evict_oldest()
+
+    def kpis(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = self.last_ts if now is None else now
+        self.expire(now)
+        start = now if self.horizon is None else max(self.horizon, now - self.window_s)
+        elapsed = max(now - start, 0.0)
+        warming_up = elapsed < self.min_span_s or elapsed <= 0.0
+        good = self.cycles - self.scrap
+        return {
+            "throughput_pph": None if warming_up else round(max(good, 0) * 3600.0 / elapsed, 2),
+            "availability": None if warming_up else round(min(1.0, max(0.0, 1.0 - self.downtime_s / elapsed)), 4),
+            "scrap_rate": round(min(1.0, self.scrap / self.cycles), 4) if self.cycles else 0.0,
+            "window_s": round(elapsed, 3),
+            "events": self.size,
+            "warming_up": warming_up,
+        }
+
+
+async def _aenumerate(source: AsyncIterable[Any]) -> AsyncIterator[Tuple[int, Any]]:
+    i = 0
+    async for item in source:
+        i += 1
+        yield i, item
+
+
+class IngestHub:
+    """Routes events to per-station windows, grouped by twin."""
+
+    def __init__(self, window_s: float = DEFAULT_WINDOW_S, capacity: int = DEFAULT_CAPACITY,
+                 min_span_s: float = DEFAULT_MIN_SPAN_S):
+        self.window_s = window_s
+        self.capacity = capacity
+        self.min_span_s = min_span_s
+        self.twins: Dict[str, Dict[str, StationWindow]] = {}
+        self._windows: Dict[Tuple[str, str], StationWindow] = {}
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _window(self, twin_id: str, station: str) -> StationWindow:
+        w = StationWindow(self.window_s, self.capacity, self.min_span_s)
+        self._windows[(twin_id, station)] = w
+        self.twins.setdefault(twin_id, {})[station] = w
+        return w
+
+    def ingest(self, event: Dict[str, Any]) -> bool:
+        with self._lock:
+            return self._ingest(event)
+
+    def _ingest(self, event: Dict[str, Any]) -> bool:
+        try:
+            key = (event["twin_id"], event["station"])
+            kind = _KINDS[event["type"]]
+            ts = event.get("ts")
+            ts = time.time() if ts is None else float(ts)
+            value = float(event.get("duration_s", 0.0)) if kind == _DOWNTIME else 0.0
+        except (KeyError, TypeError, ValueError):
+            self.rejected += 1
+            return False
+        w = self._windows.get(key)
+        if w is None:
+            w = self._window(*key)
+        w.add(ts, kind, value)
+        self.accepted += 1
+        return True
+
+    def ingest_many(self, events: Iterable[Dict[str, Any]]) -> int:
+        ingest = self._ingest
+        # un lock per batch, non per evento
+        with self._lock:
+            return sum(1 for e in events if ingest(e))
+
+    async def run(self, source: AsyncIterable[Dict[str, Any]], yield_every: int = 1024) -> int:
+        """Consume a source until it is exhausted; returns accepted events."""
+        n = 0
+        ingest = self.ingest
+        async for i, event in _aenumerate(source):
+            n += ingest(event)
+            if i % yield_every == 0:
+                await asyncio.sleep(0)
+        return n
+
+    def twin_kpis(self, twin_id: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stations = self.twins.get(twin_id)
+            if not stations:
+                return None
+            # kpis() fa scadere gli eventi vecchi: anche la lettura modifica la finestra
+            per_station = {sid: w.kpis(now) for sid, w in stations.items()}
+        # una stazione ancora in riscaldamento potrebbe essere la più lenta: la linea aspetta
+        if any(k["warming_up"] for k in per_station.values()):
+            return {"throughput_pph": None, "availability": None, "scrap_rate": None,
+                    "bottleneck": None, "warming_up": True, "stations": per_station}
+        # approssimazione linea seriale: comanda la stazione più lenta
+        bottleneck = min(per_station, key=lambda sid: per_station[sid]["throughput_pph"])
+        b = per_station[bottleneck]
+        return {
+            "throughput_pph": b["throughput_pph"],
+            "availability": b["availability"],
+            "scrap_rate": b["scrap_rate"],
+            "bottleneck": bottleneck,
+            "warming_up": False,
+            "stations": per_station,
+        }
+
+
+class QueueSource:
+    """In-process broker stand-in: producers `put` events, the hub iterates."""
+
+    _CLOSED = object()
+
+    def __init__(self, maxsize: int = 0):
+        self.queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize)
+
+    async def put(self, event: Dict[str, Any]) -> None:
+        await self.queue.put(event)
+
+    def put_nowait(self, event: Dict[str, Any]) -> None:
+        self.queue.put_nowait(event)
+
+    async def close(self) -> None:
+        await self.queue.put(self._CLOSED)
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        while True:
+            event = await self.queue.get()
+            if event is self._CLOSED:
+                return
+            yield event
+
+
+class FileReplaySource:
+    """Replay an NDJSON event capture; `speed` scales real time, None = as fast as possible."""
+
+    def __init__(self, path: str, speed: Optional[float] = None):
+        self.path = path
+        self.speed = speed
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        prev_ts = None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if self.speed and "ts" in event:
+                    if prev_ts is not None and event["ts"] > prev_ts:
+                        await asyncio.sleep((event["ts"] - prev_ts) / self.speed)
+                    prev_ts = event["ts"]
+                yield event
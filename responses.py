@@ -0,0 +1,99 @@
+"""Fast response encoding and response shaping.
+
+Endpoints that return large documents (compiled twins) build their response
+here instead of going through FastAPI's `jsonable_encoder` + `json.dumps`:
+the content is encoded once with orjson, or with MessagePack when the
+client asks for it in `Accept` and `msgpack` is installed.
+
+`shape` trims a result before encoding: `include_twin=false` drops the
+compiled twin, `fields=` keeps only the listed top-level keys and/or
+individual KPIs (`fields=twin_id,kpis.throughput_pph,kpis.bottleneck`).
+"""
+
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+import numpy as np
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # MessagePack è opzionale
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+_JSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Iterable[str]]:
+    if fields is None:
+        return None
+    return [f.strip() for f in fields.split(",") if f.strip()]
+
+
+def shape(result: Dict[str, Any], fields: Optional[str] = None, include_twin: bool = True) -> Dict[str, Any]:
+    """Return the part of `result` the client asked for (never mutates it)."""
+    selected = parse_fields(fields)
+    if selected is None:
+        if include_twin or "twin" not in result:
+            return result
+        return {k: v for k, v in result.items() if k != "twin"}
+
+    out: Dict[str, Any] = {}
+    for name in selected:
+        head, _, sub = name.partition(".")
+        if head not in result or (head == "twin" and not include_twin):
+            raise HTTPException(status_code=400, detail=f"unknown field {name!r}")
+        if not sub:
+            out[head] = result[head]
+            continue
+        value = result[head]
+        if not isinstance(value, dict) or sub not in value:
+            raise HTTPException(status_code=400, detail=f"unknown field {name!r}")
+        part = out.setdefault(head, {})
+        if part is not value:
+            part[sub] = value[sub]
+    return out
+
+
+def _quality(accept: str, media_types: Iterable[str]) -> float:
+    best = 0.0
+    for media_range in accept.split(","):
+        media, *params = [p.strip() for p in media_range.split(";")]
+        if media in media_types:
+            q = 1.0
+            for p in params:
+                if p.startswith("q="):
+                    try:
+                        q = float(p[2:])
+                    except ValueError:
+                        q = 0.0
+            best = max(best, q)
+    return best
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    if msgpack is None or not accept:
+        return False
+    q = _quality(accept, MSGPACK_TYPES)
+    return q > 0 and q >= _quality(accept, (JSON_TYPE, "application/*", "*/*"))
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"cannot serialize {type(obj).__name__}")
+
+
+def render(content: Any, accept: Optional[str] = None, status_code: int = 200,
+           headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Encode `content` as MessagePack or JSON depending on `Accept`."""
+    if wants_msgpack(accept):
+        body, media_type = msgpack.packb(content, use_bin_type=True, default=_msgpack_default), MSGPACK_TYPES[0]
+    else:
+        body, media_type = orjson.dumps(content, option=_JSON_OPTS), JSON_TYPE
+    response = Response(body, status_code=status_code, headers=headers, media_type=media_type)
+    response.headers["Vary"] = "Accept"
+    return response
@@ -0,0 +1,216 @@
+"""Routing-matrix solver for twin graphs with loops.
+
+Visits per released part solve `v = b + P^T v`, i.e. `(I - P^T) v = b`,
+where `b` marks the sources and `P[u, w]` is the probability that a part
+leaving u goes next to w. Loops come from cyclic edges (re-test, return
+routes) and from rework, which enters as a self-loop on the station that
+reprocesses the part (`P[u, u]`).
+
+The system is solved in block triangular form: the strongly connected
+components of the graph are visited in topological order, singletons by
+substitution and each loop with its own factorization of `I - P_BB^T` --
+an explicit inverse for small blocks, `scipy.sparse.linalg.splu` for large
+ones when SciPy is installed (dense NumPy otherwise). Factorizations are
+cached per block together with the block's probabilities, and solvers are
+cached per graph structure, so a scrap change refactors only the loop it
+belongs to and a change that leaves the probabilities alone (cycle time,
+availability, machines) costs no solve at all.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from scipy.sparse import csc_matrix
+    from scipy.sparse.linalg import splu
+except ImportError:  # opzionale: senza SciPy i blocchi grandi si risolvono densi
+    splu = None
+
+# blocchi fino a questa taglia: inversa esplicita, riusata come prodotto matrice-vettore
+DENSE_MAX = 64
+MAX_CACHED_SOLVERS = 256
+
+
+def _components(n: int, src: np.ndarray, dst: np.ndarray) -> List[List[int]]:
+    """Strongly connected components in topological order (iterative Tarjan)."""
+    succ: List[List[int]] = [[] for _ in range(n)]
+    for u, w in zip(src.tolist(), dst.tolist()):
+        succ[u].append(w)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    out: List[List[int]] = []
+    counter = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        work = [(root, 0)]
+        while work:
+            u, i = work.pop()
+            if i == 0:
+                index[u] = low[u] = counter
+                counter += 1
+                stack.append(u)
+                on_stack[u] = True
+            recurse = False
+            for j in range(i, len(succ[u])):
+                w = succ[u][j]
+                if index[w] < 0:
+                    work.append((u, j + 1))
+                    work.append((w, 0))
+                    recurse = True
+                    break
+                if on_stack[w]:
+                    low[u] = min(low[u], index[w])
+            if recurse:
+                continue
+            if low[u] == index[u]:
+                comp = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    comp.append(w)
+                    if w == u:
+                        break
+                out.append(comp)
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[u])
+    # Tarjan emette le componenti in ordine topologico inverso
+    out.reverse()
+    return out
+
+
+class _Block:
+    __slots__ = ("nodes", "local_src", "local_dst", "edges", "key", "factor")
+
+    def __init__(self, nodes: List[int], local_src: np.ndarray, local_dst: np.ndarray, edges: np.ndarray):
+        self.nodes = np.array(nodes, dtype=np.intp)
+        self.local_src = local_src
+        self.local_dst = local_dst
+        self.edges = edges
+        self.key: Optional[bytes] = None
+        self.factor: Any = None
+
+    def solve(self, prob: np.ndarray, self_prob: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+        p = prob[self.edges]
+        diag = self_prob[self.nodes]
+        key = p.tobytes() + diag.tobytes()
+        if key != self.key:
+            self.factor = self._factorize(p, diag)
+            self.key = key
+        if callable(self.factor):
+            return self.factor(rhs)
+        return self.factor @ rhs
+
+    def _factorize(self, p: np.ndarray, diag: np.ndarray) -> Any:
+        k = len(self.nodes)
+        if splu is not None and k > DENSE_MAX:
+            rows = np.concatenate([np.arange(k), self.local_dst])
+            cols = np.concatenate([np.arange(k), self.local_src])
+            vals = np.concatenate([1.0 - diag, -p])
+            lu = splu(csc_matrix((vals, (rows, cols)), shape=(k, k)))
+            return lu.solve
+        a = np.eye(k) - np.diag(diag)
+        np.subtract.at(a, (self.local_dst, self.local_src), p)
+        try:
+            if k > DENSE_MAX:
+                # senza SciPy: niente inversa di una matrice grande, si risolve ogni volta
+                return lambda rhs, a=a: np.linalg.solve(a, rhs)
+            return np.linalg.inv(a)
+        except np.linalg.LinAlgError:
+            raise ValueError("routing loop has no exit: parts circulate forever") from None
+
+
+class RoutingSolver:
+    """Visits of one graph structure for any set of routing probabilities.
+
+    `src`/`dst` are the edges (no self-loops: those go in `self_prob`),
+    `sources` the node indices where parts are released (one each).
+    """
+
+    def __init__(self, n: int, src: np.ndarray, dst: np.ndarray, sources: np.ndarray):
+        self.n = n
+        self.src = src
+        self.dst = dst
+        self.b = np.zeros(n)
+        self.b[sources] = 1.0
+        comps = _components(n, src, dst)
+        comp_of = np.empty(n, dtype=np.intp)
+        for c, nodes in enumerate(comps):
+            comp_of[nodes] = c
+        internal = comp_of[src] == comp_of[dst]
+        self.acyclic = len(comps) == n
+        # per nodo: archi entranti da altre componenti, già risolte quando ci si arriva
+        order = np.argsort(dst, kind="stable")
+        order = order[~internal[order]]
+        self._in_edges = np.split(order, np.searchsorted(dst[order], np.arange(1, n)))
+        self._steps: List[Tuple[int, Optional[_Block]]] = []
+        for nodes in comps:
+            if len(nodes) == 1:
+                self._steps.append((nodes[0], None))
+                continue
+            local = {u: i for i, u in enumerate(nodes)}
+            edges = np.flatnonzero(internal & (comp_of[src] == comp_of[nodes[0]]))
+            block = _Block(nodes, np.array([local[u] for u in src[edges].tolist()], dtype=np.intp),
+                           np.array([local[u] for u in dst[edges].tolist()], dtype=np.intp), edges)
+            self._steps.append((-1, block))
+        self.blocks = sum(1 for _, b in self._steps if b is not None)
+        self._last: Optional[Tuple[bytes, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    def solve(self, prob: np.ndarray, self_prob: np.ndarray) -> np.ndarray:
+        """Visits per released part for edge probabilities `prob` and per-node self-loop `self_prob`."""
+        key = prob.tobytes() + self_prob.tobytes()
+        with self._lock:
+            if self._last is not None and self._last[0] == key:
+                return self._last[1]
+            v = np.zeros(self.n)
+            flow = prob.tolist()
+            src = self.src.tolist()
+            b = self.b
+            for u, block in self._steps:
+                if block is None:
+                    inflow = b[u]
+                    for e in self._in_edges[u].tolist():
+                        inflow += flow[e] * v[src[e]]
+                    stay = self_prob[u]
+                    if stay >= 1.0:
+                        raise ValueError("routing loop has no exit: parts circulate forever")
+                    v[u] = inflow / (1.0 - stay) if stay else inflow
+                    continue
+                rhs = b[block.nodes].copy()
+                for i, u in enumerate(block.nodes.tolist()):
+                    for e in self._in_edges[u].tolist():
+                        rhs[i] += flow[e] * v[src[e]]
+                x = block.solve(prob, self_prob, rhs)
+                if not np.isfinite(x).all() or (x < -1e-9).any():
+                    raise ValueError("routing loop has no exit: parts circulate forever")
+                v[block.nodes] = x
+            v.setflags(write=False)
+            self._last = (key, v)
+            return v
+
+
+_solvers: "OrderedDict[bytes, RoutingSolver]" = OrderedDict()
+_solvers_lock = threading.Lock()
+
+
+def solver_for(n: int, src: np.ndarray, dst: np.ndarray, sources: np.ndarray) -> RoutingSolver:
+    """Cached solver for this graph structure (LRU over `MAX_CACHED_SOLVERS`)."""
+    key = b"%d:" % n + src.tobytes() + b":" + dst.tobytes() + b":" + sources.tobytes()
+    with _solvers_lock:
+        solver = _solvers.get(key)
+        if solver is not None:
+            _solvers.move_to_end(key)
+            return solver
+    solver = RoutingSolver(n, src, dst, sources)
+    with _solvers_lock:
+        _solvers[key] = solver
+        while len(_solvers) > MAX_CACHED_SOLVERS:
+            _solvers.popitem(last=False)
+    return solver
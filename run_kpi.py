@@ -1,28 +1,26 @@
-import json
 import os
+import sys
 
-base_dir = os.path.dirname(os.path.abspath(__file__))
-twin_path = os.path.join(base_dir, "twin.json")
-
-with open(twin_path, "r", encoding="utf-8") as f:
-    twin = json.load(f)
+from api import compute_kpis
+from twin_binary import TwinFile, is_binary, load_twin
+from twin_graph import line_kpis
 
-# Prendo la stazione dal twin
-station_node = next(n for n in twin["nodes"] if n["kind"] == "station")
-p = station_node["params"]
-
-cycle = float(p["cycle_time_s"])
-availability = float(p["availability_pct"]) / 100.0
-scrap = float(p.get("scrap_rate_pct", 0.0)) / 100.0
+base_dir = os.path.dirname(os.path.abspath(__file__))
+twin_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "twin.json")
 
-# KPI semplici ma sensati:
-# throughput effettivo = (3600/cycle) * availability * (1 - scrap)
-throughput_pph = (3600.0 / cycle) * availability * (1.0 - scrap)
+if is_binary(twin_path):
+    # .dtwin: stesso motore di compute_kpis, ma sulle colonne mappate, senza decodificare il twin
+    with TwinFile(twin_path) as tf:
+        twin = {"twin_id": tf.twin_id}
+        kpis = line_kpis(tf.line_graph())
+else:
+    twin = load_twin(twin_path)
+    kpis = compute_kpis(twin)
 
 print("=== KPI OUTPUT ===")
 print("twin_id:", twin["twin_id"])
-print("station_type:", station_node["station_type"])
-print("cycle_time_s:", cycle)
-print("availability:", availability)
-print("scrap_rate:", scrap)
-print("throughput_pph:", round(throughput_pph, 1))
+print("bottleneck:", kpis["bottleneck"])
+print("cycle_time_s:", kpis["cycle_time_s"])
+print("availability:", kpis["availability"])
+print("scrap_rate:", kpis["scrap_rate"])
+print("throughput_pph:", kpis["throughput_pph"])
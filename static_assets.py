@@ -0,0 +1,212 @@
+"""Prebuilt, self-hosted UI pages and static assets.
+
+The files under `ui/` are read and rendered once, at startup, into
+immutable byte blobs:
+
+- assets (`*.css`, `*.js`, `vendor/*`) get a content-hashed URL such as
+  `/static/app.3f2a9c1d7e.css`, served with a one-year `immutable` cache:
+  a new deploy changes the URL, never the content behind it;
+- pages (`*.html`) get `{{ asset:app.css }}` replaced by those URLs and
+  `{{ name }}` by the values passed to `build`; they are served with
+  `no-cache`, so the browser revalidates with the ETag and gets a 304.
+
+Every blob is compressed once, gzip always and brotli when the optional
+`brotli` package is installed; a request gets the smallest variant its
+`Accept-Encoding` allows. ETags are strong and distinct per variant.
+
+Third-party assets are pinned and vendored into `ui/vendor/` with
+`python cli.py vendor-ui` (run it where the CDN is reachable and commit the
+files). The UI never loads them from a third party by default: a missing
+vendor asset gets an empty URL, and the template page reports that the form
+editor is not installed. `build(cdn_fallback=True)` points missing assets at
+the same pinned version on the CDN instead.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import urllib.request
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from fastapi.responses import Response
+
+from kpi_cache import etag_matches
+
+try:
+    import brotli
+except ImportError:  # opzionale: senza brotli si servono solo gzip e identity
+    brotli = None
+
+UI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui")
+STATIC_PREFIX = "/static/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# sotto questa taglia la compressione non ripaga gli header
+MIN_COMPRESS = 256
+
+JSON_EDITOR_VERSION = "2.15.1"
+_JSON_EDITOR_CDN = f"https://cdn.jsdelivr.net/npm/@json-editor/json-editor@{JSON_EDITOR_VERSION}/dist/"
+VENDOR = {
+    "vendor/jsoneditor.min.js": _JSON_EDITOR_CDN + "jsoneditor.min.js",
+    "vendor/jsoneditor.min.css": _JSON_EDITOR_CDN + "css/jsoneditor.min.css",
+}
+
+_MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".json": "application/json",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".woff2": "font/woff2",
+}
+_PLACEHOLDER = re.compile(r"\{\{\s*(asset:)?([\w./-]+)\s*\}\}")
+
+
+def _media_type(name: str) -> str:
+    return _MEDIA_TYPES.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
+
+
+def _accepted(accept_encoding: Optional[str]) -> Dict[str, float]:
+    q: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        q[coding] = weight
+    return q
+
+
+class Blob:
+    """One immutable response body with its precompressed variants."""
+
+    __slots__ = ("media_type", "cache_control", "digest", "variants")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{self.digest}"')}
+        if len(body) < MIN_COMPRESS:
+            return
+        # mtime=0: stesso contenuto, stessi byte (e stesso ETag) a ogni avvio
+        compressed = [("gzip", "gz", gzip.compress(body, 9, mtime=0))]
+        if brotli is not None:
+            compressed.append(("br", "br", brotli.compress(body, quality=11)))
+        for coding, suffix, data in compressed:
+            if len(data) < len(body):
+                self.variants[coding] = (data, f'"{self.digest}-{suffix}"')
+
+    def choose(self, accept_encoding: Optional[str]) -> str:
+        """Smallest variant the client accepts (identity is always acceptable)."""
+        q = _accepted(accept_encoding)
+        star = q.get("*", 0.0)
+        best = "identity"
+        for coding, (data, _) in self.variants.items():
+            if coding != "identity" and q.get(coding, star) > 0 and len(data) < len(self.variants[best][0]):
+                best = coding
+        return best
+
+    def respond(self, headers: Mapping[str, str]) -> Response:
+        coding = self.choose(headers.get("accept-encoding"))
+        body, etag = self.variants[coding]
+        out = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=out)
+        if coding != "identity":
+            out["Content-Encoding"] = coding
+        return Response(body, media_type=self.media_type, headers=out)
+
+
+class UiAssets:
+    """Pages and hashed assets of one `ui/` directory, rendered once."""
+
+    def __init__(self, root: str, values: Mapping[str, str], cdn_fallback: bool = False):
+        self.root = root
+        self.urls: Dict[str, str] = {}
+        self.assets: Dict[str, Blob] = {}
+        self.pages: Dict[str, Blob] = {}
+        page_files: List[str] = []
+        for name in sorted(self._files()):
+            if name.endswith(".html"):
+                page_files.append(name)
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                blob = Blob(f.read(), _media_type(name), IMMUTABLE)
+            stem, ext = os.path.splitext(name)
+            hashed = f"{stem}.{blob.digest[:10]}{ext}"
+            self.assets[hashed] = blob
+            self.urls[name] = STATIC_PREFIX + hashed
+        # vendor non ancora scaricato: URL vuoto (nessuna richiesta), il CDN solo se chiesto esplicitamente
+        self.missing = sorted(name for name in VENDOR if name not in self.urls)
+        for name in self.missing:
+            self.urls[name] = VENDOR[name] if cdn_fallback else ""
+        for name in page_files:
+            with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                html = self._render(name, f.read(), values)
+            self.pages[name] = Blob(html.encode("utf-8"), _media_type(name), REVALIDATE)
+
+    def _files(self) -> List[str]:
+        out = []
+        for top, _, files in os.walk(self.root):
+            rel = os.path.relpath(top, self.root)
+            for name in files:
+                if not name.startswith("."):
+                    out.append(name if rel == "." else f"{rel}/{name}".replace(os.sep, "/"))
+        return out
+
+    def _render(self, page: str, text: str, values: Mapping[str, str]) -> str:
+        def sub(m: "re.Match[str]") -> str:
+            table = self.urls if m.group(1) else values
+            if m.group(2) not in table:
+                kind = "asset" if m.group(1) else "value"
+                raise ValueError(f"{page}: unknown {kind} '{m.group(2)}'")
+            return table[m.group(2)]
+        return _PLACEHOLDER.sub(sub, text)
+
+    def page(self, name: str, headers: Mapping[str, str]) -> Response:
+        return self.pages[name].respond(headers)
+
+    def asset(self, hashed: str, headers: Mapping[str, str]) -> Optional[Response]:
+        blob = self.assets.get(hashed)
+        return None if blob is None else blob.respond(headers)
+
+    def stats(self) -> Dict[str, object]:
+        """Bytes per encoding of every page and asset."""
+        def sizes(blob: Blob) -> Dict[str, int]:
+            return {coding: len(v[0]) for coding, v in blob.variants.items()}
+        return {
+            "pages": {name: sizes(blob) for name, blob in self.pages.items()},
+            "assets": {STATIC_PREFIX + name: sizes(blob) for name, blob in self.assets.items()},
+            "missing_vendor": self.missing,
+        }
+
+def build(root: str = UI_DIR, cdn_fallback: bool = False, **values: str) -> UiAssets:
+    """Read and render every page and asset under `root`."""
+    return UiAssets(root, values, cdn_fallback)
+
+
+def vendor(root: str = UI_DIR, timeout_s: float = 30.0) -> Dict[str, int]:
+    """Download the pinned third-party assets into `root/vendor/`; returns sizes."""
+    out: Dict[str, int] = {}
+    for name, url in VENDOR.items():
+        path = os.path.join(root, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=timeout_s) as r:
+            data = r.read()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        out[name] = len(data)
+    return out
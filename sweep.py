@@ -0,0 +1,170 @@
+"""What-if sweeps of station params over a Cartesian grid.
+
+Every swept param becomes one broadcast axis and the whole grid is
+evaluated in a single pass of `twin_graph.vector_throughput`, which
+applies the same flow model as `compute_kpis`.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from twin_graph import LineGraph, vector_throughput
+
+SWEEPABLE = ("cycle_time_s", "availability_pct", "scrap_rate_pct", "machines")
+MAX_POINTS = 20_000_000
+
+
+def axis_size(spec: Dict[str, Any]) -> int:
+    """Number of points `grid_axis(spec)` would produce, without allocating them."""
+    if "values" in spec:
+        return len(spec["values"])
+    if "steps" in spec:
+        steps = int(spec["steps"])
+        if steps < 1:
+            raise ValueError("steps must be >= 1")
+        return steps
+    if "step" in spec:
+        step = float(spec["step"])
+        if not step > 0:
+            raise ValueError("step must be > 0")
+        span = float(spec["max"]) - float(spec["min"])
+        if not np.isfinite(span / step):
+            raise ValueError("step range must be finite")
+        # stesso conteggio di np.arange(min, max + step / 2, step)
+        return max(0, int(np.ceil((span + step / 2) / step)))
+    raise ValueError("axis needs 'values', 'steps' or 'step'")
+
+
+def grid_axis(spec: Dict[str, Any]) -> np.ndarray:
+    """`{"values": [...]}`, `{"min", "max", "steps"}` or `{"min", "max", "step"}`."""
+    if "values" in spec:
+        axis = np.asarray(spec["values"], dtype=np.float64)
+    elif "steps" in spec:
+        axis = np.linspace(float(spec["min"]), float(spec["max"]), axis_size(spec))
+    elif "step" in spec:
+        axis_size(spec)
+        step = float(spec["step"])
+        axis = np.arange(float(spec["min"]), float(spec["max"]) + step / 2, step)
+    else:
+        raise ValueError("axis needs 'values', 'steps' or 'step'")
+    if axis.ndim != 1 or axis.size == 0:
+        raise ValueError("axis must be a non-empty list of numbers")
+    return axis
+
+
+def resolve_param(graph: LineGraph, name: str) -> Tuple[int, str]:
+    """`"S2.cycle_time_s"`, or a bare param name on single-station twins."""
+    if "." in name:
+        station_id, param = name.rsplit(".", 1)
+        if station_id not in graph.index or graph.kinds[graph.index[station_id]] != "station":
+            raise ValueError(f"unknown station {station_id!r}")
+        u = graph.index[station_id]
+    else:
+        stations = graph.stations()
+        if len(stations) != 1:
+            raise ValueError(f"param {name!r} is ambiguous on a multi-station line; use '<station>.{name}'")
+        u, param = stations[0], name
+    if param not in SWEEPABLE:
+        raise ValueError(f"param {param!r} cannot be swept (allowed: {', '.join(SWEEPABLE)})")
+    return u, param
+
+
+def _base_value(graph: LineGraph, u: int, param: str) -> float:
+    defaults = {"scrap_rate_pct": 0.0, "machines": 1}
+    return float(graph.nodes[u]["params"].get(param, defaults.get(param, 0.0)))
+
+
+def sensitivity(graph: LineGraph, keys: List[Tuple[int, str]], names: List[str]) -> Dict[str, Dict[str, float]]:
+    """Central-difference derivative and elasticity of throughput at the current params."""
+    base, _ = vector_throughput(graph, {})
+    base = float(base)
+    out = {}
+    for name, (u, param) in zip(names, keys):
+        x = _base_value(graph, u, param)
+        h = max(abs(x) * 1e-4, 1e-6)
+        tp, _ = vector_throughput(graph, {(u, param): np.array([x - h, x + h])})
+        d = float(tp[1] - tp[0]) / (2 * h)
+        out[name] = {
+            "value": x,
+            "d_throughput": round(d, 6),
+            "elasticity": round(d * x / base, 6) if base else 0.0,
+        }
+    return out
+
+
+def sweep(twin: Dict[str, Any], params: Dict[str, Dict[str, Any]],
+          target_throughput_pph: Optional[float] = None, max_results: int = 100) -> Dict[str, Any]:
+    if not params:
+        raise ValueError("no params to sweep")
+    graph = LineGraph.from_twin(twin)
+    names = list(params)
+    keys = [resolve_param(graph, name) for name in names]
+    # dimensione della griglia controllata prima di allocare gli assi (interi Python: niente overflow)
+    n_points = 1
+    for name in names:
+        n_points *= axis_size(params[name])
+    if n_points > MAX_POINTS:
+        raise ValueError(f"grid has {n_points} points, limit is {MAX_POINTS}")
+    axes = [grid_axis(params[name]) for name in names]
+    shape = tuple(a.size for a in axes)
+    n_points = int(np.prod(shape))
+
+    overrides = {}
+    for dim, (key, axis) in enumerate(zip(keys, axes)):
+        view = [1] * len(axes)
+        view[dim] = axis.size
+        overrides[key] = axis.reshape(view)
+    throughput, bottleneck = vector_throughput(graph, overrides)
+    throughput = np.broadcast_to(throughput, shape)
+    bottleneck = np.broadcast_to(bottleneck, shape)
+
+    target = target_throughput_pph
+    if target is None:
+        target = twin.get("line", {}).get("target_throughput_pph")
+
+    def point(flat: int) -> Dict[str, Any]:
+        idx = np.unravel_index(flat, shape)
+        cfg = {name: float(axes[d][i]) for d, (name, i) in enumerate(zip(names, idx))}
+        cfg["throughput_pph"] = round(float(throughput[idx]), 2)
+        cfg["bottleneck"] = graph.label(int(bottleneck[idx]))
+        return cfg
+
+    flat_tp = throughput.reshape(-1)
+    result: Dict[str, Any] = {
+        "n_points": n_points,
+        "shape": list(shape),
+        "throughput_pph": {
+            "min": round(float(flat_tp.min()), 2),
+            "max": round(float(flat_tp.max()), 2),
+        },
+        "best": point(int(flat_tp.argmax())),
+        "sensitivity": sensitivity(graph, keys, names),
+    }
+    if target is None:
+        return result
+
+    target = float(target)
+    feasible = throughput >= target
+    n_feasible = int(np.count_nonzero(feasible))
+    region = {}
+    for d, name in enumerate(names):
+        other = tuple(i for i in range(len(names)) if i != d)
+        ok = axes[d][feasible.any(axis=other)] if other else axes[d][feasible]
+        region[name] = {"min": float(ok.min()), "max": float(ok.max())} if ok.size else None
+
+    flat_ok = np.flatnonzero(feasible.reshape(-1))
+    if flat_ok.size > max_results:
+        # le configurazioni più vicine al target (minimo margine) per prime
+        margin = flat_tp[flat_ok] - target
+        flat_ok = flat_ok[np.argpartition(margin, max_results - 1)[:max_results]]
+    flat_ok = flat_ok[np.argsort(flat_tp[flat_ok], kind="stable")]
+
+    result.update({
+        "target_throughput_pph": target,
+        "n_feasible": n_feasible,
+        "feasible_fraction": round(n_feasible / n_points, 6),
+        "feasible_region": region,
+        "configurations": [point(int(i)) for i in flat_ok],
+    })
+    return result
@@ -0,0 +1,238 @@
+import asyncio
+import copy
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from monte_carlo import monte_carlo
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(base_dir, "instance.json"), "r", encoding="utf-8") as f:
+    INSTANCE = json.load(f)
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(api.app) as tc:
+        yield tc
+
+
+def station(**params):
+    inst = copy.deepcopy(INSTANCE)
+    inst["station"].update(params)
+    return inst
+
+
+def single(client, inst):
+    return client.post("/compute-kpi", json={"instance": inst}, params={"include_twin": "false"})
+
+
+def batch(client, instances):
+    response = client.post("/compute-kpi/batch", json={"instances": instances})
+    assert response.status_code == 200
+    return response.json()["results"]
+
+
+# --- /compute-kpi/batch ---
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"machines": 1},
+    {"machines": 2},
+    {"machines": 3, "scrap_rate_pct": 5.5},
+    {"cycle_time_s": 7, "availability_pct": 81.3},
+])
+def test_batch_matches_single(client, params):
+    inst = station(**params)
+    one = single(client, inst)
+    assert one.status_code == 200
+    assert batch(client, [inst]) == [one.json()]
+
+
+def test_batch_machines_multiply_throughput(client):
+    one, two = batch(client, [station(machines=1), station(machines=2)])
+    assert two["kpis"]["throughput_pph"] == pytest.approx(2 * one["kpis"]["throughput_pph"], abs=0.01)
+
+
+def test_batch_mixed_with_lines_matches_single(client):
+    line = copy.deepcopy(INSTANCE)
+    del line["station"]
+    line["stations"] = [
+        {"id": "A", "type": "assembly", "cycle_time_s": 20, "availability_pct": 90, "machines": 2},
+        {"id": "B", "type": "welding", "cycle_time_s": 30, "availability_pct": 95},
+    ]
+    instances = [station(machines=2), line]
+    assert batch(client, instances) == [single(client, i).json() for i in instances]
+
+
+@pytest.mark.parametrize("params", [{"machines": 0}, {"machines": 1.5}, {"cycle_time_s": 0}])
+def test_batch_rejects_what_single_rejects(client, params):
+    inst = station(**params)
+    assert single(client, inst).status_code == 422
+    [result] = batch(client, [inst])
+    assert "error" in result
+
+
+@pytest.mark.parametrize("name", ["cycle_time_s", "availability_pct", "scrap_rate_pct"])
+@pytest.mark.parametrize("value", [float("nan"), float("inf")])
+def test_non_finite_params_are_rejected(name, value):
+    inst = station(**{name: value})
+    with pytest.raises(ValueError):
+        api.compile_twin(inst)
+    [result] = api.compute_kpis_batch([inst])
+    assert "finite" in result["error"]
+
+
+# --- live KPIs ---
+
+def test_compute_kpi_does_not_create_live_topics(client):
+    topics = api.live_kpis.stats()["topics"]
+    for i in range(20):
+        inst = station()
+        inst["line"]["line_name"] = f"what-if-{i}"
+        assert single(client, inst).status_code == 200
+    assert api.live_kpis.stats()["topics"] == topics
+
+
+def test_stream_rate_is_capped(client, monkeypatch):
+    seen = {}
+
+    def subscribe(twin_id, min_interval_s, initial=None):
+        seen["interval"] = min_interval_s
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr(api.live_kpis, "subscribe", subscribe)
+    for rate in ("1000", "inf"):
+        with pytest.raises(RuntimeError):
+            client.get("/twins/x/kpis/stream", params={"max_rate_hz": rate})
+        assert seen["interval"] == pytest.approx(1.0 / api.LIVE_MAX_RATE_HZ)
+    with pytest.raises(RuntimeError):
+        client.get("/twins/x/kpis/stream", params={"max_rate_hz": "0.5"})
+    assert seen["interval"] == pytest.approx(2.0)
+
+
+# --- /monte-carlo ---
+
+MC_DISTRIBUTIONS = {"cycle_time_s": {"dist": "normal", "mean": 18, "std": 2}}
+
+
+@pytest.mark.parametrize("max_samples", [10**12, 20_000_001, 0])
+def test_monte_carlo_rejects_unbounded_samples(client, max_samples):
+    response = client.post("/monte-carlo", json={"instance": INSTANCE, "distributions": MC_DISTRIBUTIONS,
+                                                 "max_samples": max_samples})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("kwargs", [{"max_samples": 10**7, "chunk_size": 1}, {"chunk_size": 10**9}])
+def test_monte_carlo_bounds_chunks(kwargs):
+    with pytest.raises(ValueError):
+        monte_carlo(api.compile_twin(INSTANCE), MC_DISTRIBUTIONS, **kwargs)
+
+
+def test_monte_carlo_last_chunk_is_partial():
+    result = monte_carlo(api.compile_twin(INSTANCE), MC_DISTRIBUTIONS, max_samples=1000, chunk_size=300,
+                         parallel=False)
+    assert result["samples"] == 1000
+
+
+# --- /compute-kpi/stream ---
+
+def test_stream_scores_off_the_event_loop(client, monkeypatch):
+    on_loop = []
+    score = api.score_record
+
+    def score_record(record):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(record)
+        except RuntimeError:
+            pass
+        return score(record)
+
+    monkeypatch.setattr(api, "score_record", score_record)
+    body = "\n".join(json.dumps(i) for i in (INSTANCE, station(machines=2))) + "\n\n{bad\n"
+    response = client.post("/compute-kpi/stream", content=body)
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["line"] for r in records] == [1, 2, 4]
+    assert "kpis" in records[1] and "error" in records[2]
+    assert on_loop == []
+
+
+def test_stream_reports_line_too_long(client, monkeypatch):
+    monkeypatch.setattr("ndjson_pipeline.MAX_LINE_BYTES", 64)
+    body = json.dumps(INSTANCE) + "\n" + "x" * 200
+    response = client.post("/compute-kpi/stream", content=body)
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert records[-1]["error"].startswith("line longer than")
+
+
+# --- /realtime/events ---
+
+@pytest.mark.parametrize("event", [
+    {"twin_id": ["Cell_1"], "station": "S1", "type": "cycle"},
+    {"twin_id": "Cell_1", "station": {"id": "S1"}, "type": "cycle"},
+    {"station": "S1", "type": "cycle"},
+    {"twin_id": "Cell_1", "station": "S1", "type": "cycle", "ts": "soon"},
+])
+def test_malformed_realtime_event_is_422(client, event):
+    response = client.post("/realtime/events", json={"events": [event]})
+    assert response.status_code == 422
+
+
+def test_unknown_realtime_event_type_is_counted_as_rejected(client):
+    events = [{"twin_id": "rt-1", "station": "S1", "type": "cycle", "ts": 1.0},
+              {"twin_id": "rt-1", "station": "S1", "type": "jam", "ts": 2.0}]
+    response = client.post("/realtime/events", json={"events": events})
+    assert response.json() == {"accepted": 1, "rejected": 1}
+
+
+def test_concurrent_realtime_posts_keep_windows_consistent(client):
+    from concurrent.futures import ThreadPoolExecutor
+    batches = [[{"twin_id": "rt-2", "station": "S1", "type": "cycle", "ts": 1000.0 + b + i / 100}
+                for i in range(50)] for b in range(40)]
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda events: client.post("/realtime/events", json={"events": events}), batches))
+    assert all(r.json()["accepted"] == 50 for r in responses)
+    window = api.realtime_hub.twins["rt-2"]["S1"]
+    # il primo evento apre soltanto la finestra
+    assert window.size == window.cycles == 40 * 50 - 1
+
+
+# --- /simulate ---
+
+@pytest.mark.parametrize("error", [KeyError("availability_pct"), TypeError("bad param"), ValueError("bad shift")])
+def test_simulate_maps_model_errors_to_400(client, monkeypatch, error):
+    def simulate(twin, **kwargs):
+        raise error
+
+    monkeypatch.setattr(api, "simulate", simulate)
+    response = client.post("/simulate", json={"instance": INSTANCE, "replications": 2})
+    assert response.status_code == 400
+
+
+# --- /metrics, /debug/profiler ---
+
+def test_monotonic_metrics_are_counters(client):
+    assert single(client, INSTANCE).status_code == 200
+    text = client.get("/metrics").text
+    for name in ("dtaas_kpi_cache_hits_total", "dtaas_kpi_cache_misses_total",
+                 "dtaas_realtime_events_accepted_total", "dtaas_realtime_events_rejected_total"):
+        assert f"# TYPE {name} counter" in text
+    assert "# TYPE dtaas_kpi_cache_entries gauge" in text
+    assert "dtaas_kpi_cache_hits " not in text
+
+
+def test_profiler_switch_needs_token(client, monkeypatch):
+    monkeypatch.setattr(api, "PROFILER_TOKEN", "")
+    assert client.post("/debug/profiler", params={"enabled": "true"}).status_code == 403
+    monkeypatch.setattr(api, "PROFILER_TOKEN", "s3cret")
+    assert client.post("/debug/profiler", params={"enabled": "true"}).status_code == 403
+    assert client.post("/debug/profiler", params={"enabled": "true"},
+                       headers={"X-Profiler-Token": "wrong"}).status_code == 403
+    assert not api.profiler.enabled
+    response = client.post("/debug/profiler", params={"enabled": "false"}, headers={"X-Profiler-Token": "s3cret"})
+    assert response.status_code == 200
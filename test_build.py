@@ -0,0 +1,102 @@
+import copy
+import json
+import os
+
+import pytest
+
+import build
+from build import MANIFEST, build as run_build
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(base_dir, "instance.json"), "r", encoding="utf-8") as f:
+    INSTANCE = json.load(f)
+
+
+def write(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    # mtime_ns diverso anche su filesystem a bassa risoluzione
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def manifest(out):
+    with open(os.path.join(out, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_serial(src, out, **kwargs):
+    return run_build(str(src), str(out), parallel=False, **kwargs)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    write(str(src / "a" / "cell.json"), INSTANCE)
+    other = copy.deepcopy(INSTANCE)
+    other["line"]["line_name"] = "Cell_2"
+    write(str(src / "other.json"), other)
+    return src, out
+
+
+def test_build_then_noop(tree):
+    src, out = tree
+    first = build_serial(src, out)
+    assert (first["built"], first["failed"]) == (2, 0)
+    with open(out / "a" / "cell.kpis.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["kpis"]["throughput_pph"] == 188.48
+    second = build_serial(src, out)
+    assert (second["built"], second["unchanged"]) == (0, 2)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_failed_rebuild_removes_stale_outputs(tree, binary):
+    src, out = tree
+    build_serial(src, out, binary=binary)
+    outputs = build._outputs(str(out), "a/cell.json", binary)
+    assert all(os.path.exists(p) for p in outputs)
+
+    broken = copy.deepcopy(INSTANCE)
+    del broken["station"]["cycle_time_s"]
+    write(str(src / "a" / "cell.json"), broken)
+    summary = build_serial(src, out, binary=binary)
+    assert summary["failed"] == 1 and "a/cell.json" in summary["errors"]
+    assert not any(os.path.exists(p) for p in outputs)
+    assert "a/cell.json" not in manifest(out)["files"]
+    assert "other.json" in manifest(out)["files"]
+
+    # riprovato al giro dopo, ricostruito appena torna valido
+    assert build_serial(src, out, binary=binary)["failed"] == 1
+    write(str(src / "a" / "cell.json"), INSTANCE)
+    assert build_serial(src, out, binary=binary)["built"] == 1
+    assert all(os.path.exists(p) for p in outputs)
+
+
+def test_invalid_json_removes_stale_outputs(tree):
+    src, out = tree
+    build_serial(src, out)
+    with open(src / "other.json", "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert build_serial(src, out)["failed"] == 1
+    assert not os.path.exists(out / "other.twin.json")
+    assert not os.path.exists(out / "other.kpis.json")
+
+
+def test_outputs_next_to_inputs_are_not_inputs(tree):
+    src, _ = tree
+    first = build_serial(src, src)
+    assert (first["inputs"], first["built"]) == (2, 2)
+    assert os.path.exists(src / "a" / "cell.twin.json")
+    second = build_serial(src, src)
+    assert (second["inputs"], second["built"], second["failed"]) == (2, 0, 0)
+
+
+def test_engine_change_forces_rebuild(tree, monkeypatch):
+    src, out = tree
+    build_serial(src, out)
+    assert manifest(out)["engine"] == build.engine_version()
+    monkeypatch.setattr(build, "engine_version", lambda: "new-engine")
+    assert build_serial(src, out)["built"] == 2
+    assert manifest(out)["engine"] == "new-engine"
+    assert build_serial(src, out)["built"] == 0
@@ -0,0 +1,361 @@
+import asyncio
+import copy
+import json
+import os
+import threading
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import dtaas_client
+from dtaas_client import AsyncClient, Client, DTaaSError
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(base_dir, "instance.json"), "r", encoding="utf-8") as f:
+    INSTANCE = json.load(f)
+
+
+def instance(cycle_time_s=18.0, name="Cell_1", machines=None):
+    inst = copy.deepcopy(INSTANCE)
+    inst["line"]["line_name"] = name
+    inst["station"]["cycle_time_s"] = cycle_time_s
+    if machines is not None:
+        inst["station"]["machines"] = machines
+    return inst
+
+
+def bad_instance():
+    inst = instance()
+    del inst["station"]["cycle_time_s"]
+    return inst
+
+
+def expected(inst):
+    return api.compute_kpis(api.compile_twin(inst))["throughput_pph"]
+
+
+class Flaky:
+    """Answers the first `failures` requests with `status`, then hands over to `inner`."""
+
+    def __init__(self, inner, failures, status, retry_after="0"):
+        self.inner = inner
+        self.failures = failures
+        self.status = status
+        self.retry_after = retry_after
+        self.paths = []
+
+    def response(self, request):
+        self.paths.append(request.url.path)
+        if len(self.paths) <= self.failures:
+            headers = {"retry-after": self.retry_after} if self.retry_after is not None else {}
+            return httpx.Response(self.status, json={"detail": "busy"}, headers=headers)
+        return None
+
+
+class FlakyTransport(httpx.BaseTransport):
+    def __init__(self, inner, *args, **kwargs):
+        self.flaky = Flaky(inner, *args, **kwargs)
+
+    def handle_request(self, request):
+        return self.flaky.response(request) or self.flaky.inner.handle_request(request)
+
+
+class AsyncFlakyTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner, *args, **kwargs):
+        self.flaky = Flaky(inner, *args, **kwargs)
+
+    async def handle_async_request(self, request):
+        return self.flaky.response(request) or await self.flaky.inner.handle_async_request(request)
+
+
+@pytest.fixture
+def http():
+    with TestClient(api.app) as tc:
+        tc.paths = []
+        tc.event_hooks["request"].append(lambda request: tc.paths.append(request.url.path))
+        yield tc
+
+
+def async_http(failures=0, status=503, retry_after="0"):
+    transport = AsyncFlakyTransport(httpx.ASGITransport(app=api.app), failures, status, retry_after)
+    return httpx.AsyncClient(transport=transport, base_url="http://dtaas"), transport.flaky
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+# --- blocking client ---
+
+def test_compute_kpi_single_call(http):
+    with Client(http=http) as dt:
+        result = dt.compute_kpi(INSTANCE)
+    assert result["twin_id"] == "Cell_1"
+    assert result["kpis"]["throughput_pph"] == expected(INSTANCE)
+    # da solo nella finestra: niente batch
+    assert http.paths == ["/compute-kpi"]
+
+
+def test_concurrent_threads_are_batched(http):
+    instances = [instance(10.0 + i, f"Cell_{i}") for i in range(8)]
+    results = [None] * len(instances)
+    barrier = threading.Barrier(len(instances))
+    with Client(http=http, batch_window_s=0.2) as dt:
+        def call(i):
+            barrier.wait()
+            results[i] = dt.compute_kpi(instances[i])
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(instances))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert http.paths == ["/compute-kpi/batch"]
+    for inst, result in zip(instances, results):
+        assert result["twin_id"] == inst["line"]["line_name"]
+        assert result["kpis"]["throughput_pph"] == expected(inst)
+
+
+def test_batched_results_match_single_calls(http):
+    instances = [instance(10.0 + i, f"Cell_{i}", machines=1 + i % 3) for i in range(6)]
+    with Client(http=http, batch_window_s=0) as dt:
+        singles = [dt.compute_kpi(i) for i in instances]
+    results = [None] * len(instances)
+    barrier = threading.Barrier(len(instances))
+    with Client(http=http, batch_window_s=0.2) as dt:
+        def call(i):
+            barrier.wait()
+            results[i] = dt.compute_kpi(instances[i])
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(instances))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert http.paths == ["/compute-kpi"] * len(instances) + ["/compute-kpi/batch"]
+    assert results == singles
+    # machines conta: 2 macchine, il doppio della portata
+    assert singles[1]["kpis"]["throughput_pph"] == pytest.approx(2 * dt_rate(instances[1]), abs=0.01)
+
+
+def dt_rate(inst):
+    st = inst["station"]
+    return 3600.0 / st["cycle_time_s"] * st["availability_pct"] / 100 * (1 - st["scrap_rate_pct"] / 100)
+
+
+def test_full_batch_is_sent_without_waiting(http):
+    instances = [instance(10.0 + i, f"Cell_{i}") for i in range(4)]
+    results = [None] * len(instances)
+    with Client(http=http, batch_window_s=60.0, max_batch=len(instances)) as dt:
+        threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, dt.compute_kpi(instances[i])))
+                   for i in range(len(instances))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+            assert not t.is_alive()
+    assert http.paths == ["/compute-kpi/batch"]
+    assert [r["twin_id"] for r in results] == [i["line"]["line_name"] for i in instances]
+
+
+def test_batch_window_zero_disables_batching(http):
+    with Client(http=http, batch_window_s=0) as dt:
+        dt.compute_kpi(INSTANCE)
+        dt.compute_kpi(INSTANCE, include_twin=True)
+    assert http.paths == ["/compute-kpi", "/compute-kpi"]
+
+
+def test_single_call_error_is_raised(http):
+    with Client(http=http) as dt:
+        with pytest.raises(DTaaSError) as exc:
+            dt.compute_kpi(bad_instance())
+    assert exc.value.status_code == 422
+
+
+def test_compute_kpis_keeps_per_item_errors(http):
+    instances = [instance(12.0), bad_instance(), instance(24.0)]
+    with Client(http=http, max_batch=2) as dt:
+        results = dt.compute_kpis(instances)
+    assert http.paths == ["/compute-kpi/batch", "/compute-kpi/batch"]
+    assert len(results) == 3
+    assert results[0]["kpis"]["throughput_pph"] == expected(instances[0])
+    assert "error" in results[1]
+    assert results[2]["kpis"]["throughput_pph"] == expected(instances[2])
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_on_busy_status(http, status):
+    transport = FlakyTransport(http._transport, failures=2, status=status)
+    with httpx.Client(transport=transport, base_url="http://testserver") as h, Client(http=h, retries=3) as dt:
+        assert dt.compute_kpi(INSTANCE)["kpis"]["throughput_pph"] == expected(INSTANCE)
+    assert transport.flaky.paths == ["/compute-kpi"] * 3
+
+
+def test_retries_exhausted_raise_last_status(http):
+    transport = FlakyTransport(http._transport, failures=10, status=429)
+    with httpx.Client(transport=transport, base_url="http://testserver") as h, Client(http=h, retries=2) as dt:
+        with pytest.raises(DTaaSError) as exc:
+            dt.status()
+    assert exc.value.status_code == 429
+    assert len(transport.flaky.paths) == 3
+
+
+def test_client_errors_are_not_retried(http):
+    transport = FlakyTransport(http._transport, failures=10, status=400)
+    with httpx.Client(transport=transport, base_url="http://testserver") as h, Client(http=h) as dt:
+        with pytest.raises(DTaaSError) as exc:
+            dt.status()
+    assert exc.value.status_code == 400
+    assert len(transport.flaky.paths) == 1
+
+
+def test_backoff(monkeypatch):
+    busy = httpx.Response(503, headers={"retry-after": "2"})
+    assert dtaas_client._backoff(0, busy) == 2.0
+    huge = httpx.Response(503, headers={"retry-after": "3600"})
+    assert dtaas_client._backoff(0, huge) == dtaas_client.BACKOFF_MAX_S
+    # senza Retry-After: jitter pieno entro base * 2^attempt
+    monkeypatch.setattr(dtaas_client.random, "uniform", lambda lo, hi: hi)
+    assert dtaas_client._backoff(3, httpx.Response(503)) == dtaas_client.BACKOFF_BASE_S * 8
+    assert dtaas_client._backoff(30, None) == dtaas_client.BACKOFF_MAX_S
+
+
+def test_schema_is_cached(http):
+    with Client(http=http) as dt:
+        schema = dt.template_schema("line_v1")
+        assert dt.template_schema("line_v1") is schema
+    assert http.paths == ["/templates/line_v1/schema"]
+
+
+def test_schema_cache_expires(http):
+    with Client(http=http, schema_ttl_s=0) as dt:
+        dt.template_schema("line_v1")
+        dt.template_schema("line_v1")
+    assert http.paths == ["/templates/line_v1/schema"] * 2
+
+
+def test_unknown_template_is_not_cached(http):
+    with Client(http=http) as dt:
+        for _ in range(2):
+            with pytest.raises(DTaaSError) as exc:
+                dt.template_schema("nope")
+            assert exc.value.status_code == 404
+    assert len(http.paths) == 2
+
+
+# --- asyncio client ---
+
+def test_async_gather_is_one_batch():
+    instances = [instance(10.0 + i, f"Cell_{i}") for i in range(20)]
+
+    async def main():
+        h, flaky = async_http()
+        async with h, AsyncClient(http=h) as dt:
+            results = await asyncio.gather(*(dt.compute_kpi(i) for i in instances))
+        return results, flaky.paths
+
+    results, paths = run(main())
+    assert paths == ["/compute-kpi/batch"]
+    assert [r["kpis"]["throughput_pph"] for r in results] == [expected(i) for i in instances]
+
+
+def test_async_batched_results_match_single_calls():
+    instances = [instance(10.0 + i, f"Cell_{i}", machines=1 + i % 3) for i in range(6)]
+
+    async def main():
+        h, flaky = async_http()
+        async with h:
+            async with AsyncClient(http=h, batch_window_s=0) as dt:
+                singles = [await dt.compute_kpi(i) for i in instances]
+            async with AsyncClient(http=h) as dt:
+                batched = await asyncio.gather(*(dt.compute_kpi(i) for i in instances))
+        return singles, batched, flaky.paths
+
+    singles, batched, paths = run(main())
+    assert paths == ["/compute-kpi"] * len(instances) + ["/compute-kpi/batch"]
+    assert batched == singles
+
+
+def test_async_max_batch_splits():
+    instances = [instance(10.0 + i, f"Cell_{i}") for i in range(5)]
+
+    async def main():
+        h, flaky = async_http()
+        async with h, AsyncClient(http=h, max_batch=2) as dt:
+            results = await asyncio.gather(*(dt.compute_kpi(i) for i in instances))
+        return results, flaky.paths
+
+    results, paths = run(main())
+    # 2 + 2 pieni, l'ultimo da solo va su /compute-kpi
+    assert sorted(paths) == ["/compute-kpi", "/compute-kpi/batch", "/compute-kpi/batch"]
+    assert [r["twin_id"] for r in results] == [i["line"]["line_name"] for i in instances]
+
+
+def test_async_per_item_errors():
+    instances = [instance(12.0), bad_instance(), instance(24.0)]
+
+    async def main():
+        h, flaky = async_http()
+        async with h, AsyncClient(http=h) as dt:
+            results = await asyncio.gather(*(dt.compute_kpi(i) for i in instances), return_exceptions=True)
+        return results, flaky.paths
+
+    results, paths = run(main())
+    assert paths == ["/compute-kpi/batch"]
+    assert results[0]["kpis"]["throughput_pph"] == expected(instances[0])
+    assert isinstance(results[1], DTaaSError) and results[1].status_code == 422
+    assert results[2]["kpis"]["throughput_pph"] == expected(instances[2])
+
+
+def test_async_batch_failure_reaches_every_caller():
+    async def main():
+        h, flaky = async_http(failures=10, status=503)
+        async with h, AsyncClient(http=h, retries=1) as dt:
+            results = await asyncio.gather(*(dt.compute_kpi(instance()) for _ in range(3)),
+                                           return_exceptions=True)
+        return results, flaky.paths
+
+    results, paths = run(main())
+    assert paths == ["/compute-kpi/batch"] * 2
+    assert all(isinstance(r, DTaaSError) and r.status_code == 503 for r in results)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_async_retries_on_busy_status(status):
+    async def main():
+        h, flaky = async_http(failures=2, status=status)
+        async with h, AsyncClient(http=h, retries=3) as dt:
+            result = await dt.compute_kpi(INSTANCE)
+        return result, flaky.paths
+
+    result, paths = run(main())
+    assert result["kpis"]["throughput_pph"] == expected(INSTANCE)
+    assert paths == ["/compute-kpi"] * 3
+
+
+def test_async_compute_kpis_chunks():
+    instances = [instance(10.0 + i, f"Cell_{i}") for i in range(5)] + [bad_instance()]
+
+    async def main():
+        h, flaky = async_http()
+        async with h, AsyncClient(http=h, max_batch=4) as dt:
+            results = await dt.compute_kpis(instances)
+        return results, flaky.paths
+
+    results, paths = run(main())
+    assert paths == ["/compute-kpi/batch"] * 2
+    assert [r.get("twin_id") for r in results[:5]] == [i["line"]["line_name"] for i in instances[:5]]
+    assert "error" in results[5]
+
+
+def test_async_schema_is_cached():
+    async def main():
+        h, flaky = async_http()
+        async with h, AsyncClient(http=h) as dt:
+            first = await dt.template_schema("line_v1")
+            second = await dt.template_schema("line_v1")
+        return first is second, flaky.paths
+
+    same, paths = run(main())
+    assert same
+    assert paths == ["/templates/line_v1/schema"]
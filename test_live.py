@@ -0,0 +1,51 @@
+import asyncio
+
+from live import KpiBroadcaster
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_publish_without_subscribers_keeps_nothing():
+    hub = KpiBroadcaster()
+    for i in range(100):
+        assert not hub.publish(f"what-if-{i}", {"throughput_pph": i})
+    assert hub.stats() == {"topics": 0, "subscribers": 0}
+
+
+def test_topic_lives_with_its_subscribers():
+    hub = KpiBroadcaster()
+
+    async def main():
+        updates = hub.subscribe("T1", min_interval_s=0, initial={"throughput_pph": 1.0})
+        first = await updates.__anext__()
+        during = hub.stats()
+        assert hub.publish("T1", {"throughput_pph": 2.0})
+        second = await updates.__anext__()
+        await updates.aclose()
+        return first, second, during
+
+    first, second, during = run(main())
+    assert first == {"throughput_pph": 1.0}
+    assert second == {"throughput_pph": 2.0}
+    assert during == {"topics": 1, "subscribers": 1}
+    assert hub.stats() == {"topics": 0, "subscribers": 0}
+
+
+def test_topic_stays_while_another_subscriber_remains():
+    hub = KpiBroadcaster()
+
+    async def main():
+        a = hub.subscribe("T1", min_interval_s=0, initial=1)
+        b = hub.subscribe("T1", min_interval_s=0, initial=2)
+        assert await a.__anext__() == 1
+        # il topic esiste già: il valore iniziale del secondo non lo sovrascrive
+        assert await b.__anext__() == 1
+        await a.aclose()
+        remaining = hub.stats()
+        await b.aclose()
+        return remaining
+
+    assert run(main()) == {"topics": 1, "subscribers": 1}
+    assert hub.stats()["topics"] == 0
@@ -0,0 +1,96 @@
+import copy
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from twin_registry import PatchError, TwinRegistry
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(base_dir, "instance.json"), "r", encoding="utf-8") as f:
+    INSTANCE = json.load(f)
+
+MALFORMED = [
+    [{"op": "replace", "path": 5, "value": 1}],
+    [{"op": "replace", "path": None, "value": 1}],
+    [{"op": "replace", "path": "nodes/1", "value": 1}],
+    [{"op": 3, "path": "/line/shift_hours", "value": 1}],
+    [{"op": "move", "path": "/line/shift_hours", "value": 1}],
+    [{"op": "replace", "path": "/line/shift_hours"}],
+    [{"path": "/line/shift_hours", "value": 1}],
+    [{"op": "replace", "path": "/nodes/1", "value": 5}],
+    [{"op": "add", "path": "/nodes/-", "value": "S9"}],
+    [{"op": "replace", "path": "/edges/0", "value": [1]}],
+    [{"op": "replace", "path": "/nodes", "value": {}}],
+    [{"op": "replace", "path": "/nodes/1/params", "value": [1, 2]}],
+    [{"op": "replace", "path": "/quality", "value": [1]}],
+    [{"op": "test", "path": "/nodes/1/id/x", "value": 1}],
+    [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": "fast"}],
+    [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": -1}],
+]
+
+
+@pytest.fixture
+def registry(tmp_path):
+    reg = TwinRegistry(str(tmp_path / "twins.sqlite3"), checker=api.TwinChecker(api.TEMPLATES["line_v1"]["schema"]))
+    reg.put(api.compile_twin(INSTANCE))
+    yield reg
+    reg.close()
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(api.app) as tc:
+        assert tc.post("/twins", json={"instance": INSTANCE}).status_code == 200
+        yield tc
+
+
+@pytest.mark.parametrize("ops", MALFORMED)
+def test_malformed_patch_is_rejected(registry, ops):
+    before = copy.deepcopy(registry.get("Cell_1"))
+    with pytest.raises(PatchError):
+        registry.patch("Cell_1", ops)
+    after = registry.get("Cell_1")
+    assert after["version"] == before["version"]
+    assert after["twin"] == before["twin"]
+
+
+@pytest.mark.parametrize("ops", MALFORMED)
+def test_malformed_patch_is_400(client, ops):
+    version = client.get("/twins/Cell_1").json()["version"]
+    response = client.patch("/twins/Cell_1", json={"ops": ops})
+    assert response.status_code == 400
+    assert client.get("/twins/Cell_1").json()["version"] == version
+
+
+def test_failed_fast_patch_rolls_back(registry):
+    ops = [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": 36},
+           {"op": "test", "path": "/nodes/S1/params/availability_pct", "value": 1}]
+    with pytest.raises(PatchError):
+        registry.patch("Cell_1", ops)
+    assert registry.get("Cell_1")["twin"]["nodes"][1]["params"]["cycle_time_s"] == 18
+
+
+def test_param_patch_updates_kpis(registry):
+    record = registry.patch("Cell_1", [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": 36}])
+    assert record["version"] == 2
+    assert record["kpis"]["throughput_pph"] == 94.24
+
+
+def test_patch_survives_reload(registry, tmp_path):
+    registry.patch("Cell_1", [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": 36}])
+    registry.patch("Cell_1", [{"op": "replace", "path": "/line/shift_hours", "value": 10}])
+    twin = copy.deepcopy(registry.get("Cell_1"))
+    reopened = TwinRegistry(registry.path)
+    try:
+        assert reopened.get("Cell_1") == twin
+    finally:
+        reopened.close()
+
+
+def test_versions_survive_delete(registry):
+    registry.patch("Cell_1", [{"op": "replace", "path": "/nodes/S1/params/cycle_time_s", "value": 36}])
+    assert registry.delete("Cell_1")
+    assert registry.put(api.compile_twin(INSTANCE))["version"] == 3
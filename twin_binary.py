@@ -0,0 +1,348 @@
+"""Binary, memory-mapped twin file format (`.dtwin`).
+
+Layout (little-endian, every section 8-byte aligned)::
+
+    header   magic "DTWN", version, node/edge/column counts, section offsets
+    strings  u32 offsets[n_strings + 1] + UTF-8 blob
+             (twin_id, type, node ids, then distinct station types)
+    nodes    i8 kind[n], u8 has_params[n], i32 station_type[n] (-1 = none)
+    params   f64 columns[n_columns][n] (NaN = absent), u8 int_mask[n_columns][n]
+    edges    CSR: i32 offsets[n + 1], i32 targets[m], f64 splits[m], i32 order[m]
+    meta     JSON: column names, twin-level extras, non-standard params/node/edge keys
+
+`TwinFile` maps the file and decodes nothing up front: every section is a
+zero-copy NumPy view created on first access, and strings are decoded one
+at a time.
+
+    python twin_binary.py to-bin twin.json twin.dtwin
+    python twin_binary.py to-json twin.dtwin twin.json
+    python twin_binary.py bench --stations 5000
+"""
+
+import json
+import mmap
+import struct
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from compact_twin import KINDS, PARAM_COLUMNS, CompactTwin
+from twin_graph import LineGraph, rework_settings
+
+MAGIC = b"DTWN"
+VERSION = 1
+_SECTIONS = ("str_offsets", "str_blob", "kinds", "has_params", "station_type",
+             "columns", "int_mask", "csr_offsets", "targets", "splits", "edge_order", "meta")
+# i soli parametri letti da twin_graph.line_kpis
+ENGINE_PARAMS = ("cycle_time_s", "availability_pct", "scrap_rate_pct", "machines")
+_HEADER = struct.Struct("<4sHHIIII" + "QQ" * len(_SECTIONS))
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_twin(twin: Dict[str, Any], path: str) -> None:
+    ct = CompactTwin.from_twin(twin)
+    n = len(ct.ids)
+    m = len(ct.targets)
+    station_types = sorted({t for t in ct.station_types if t is not None})
+    strings = [ct.twin_id, ct.type, *ct.ids, *station_types]
+    encoded = [s.encode("utf-8") for s in strings]
+    str_offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(b) for b in encoded], out=str_offsets[1:])
+    type_index = {t: i for i, t in enumerate(station_types)}
+    meta = {
+        "columns": list(PARAM_COLUMNS),
+        "extra": ct.extra,
+        "extra_params": {str(i): v for i, v in ct.extra_params.items()},
+        "extra_nodes": {str(i): v for i, v in ct.extra_nodes.items()},
+        "extra_edges": {str(i): v for i, v in ct.extra_edges.items()},
+    }
+    blobs = {
+        "str_offsets": str_offsets.tobytes(),
+        "str_blob": b"".join(encoded),
+        "kinds": np.frombuffer(ct.kinds, dtype="i1").tobytes(),
+        "has_params": bytes(ct.has_params),
+        "station_type": np.array([type_index[t] if t is not None else -1 for t in ct.station_types],
+                                 dtype="<i4").tobytes(),
+        "columns": b"".join(np.frombuffer(ct.columns[c], dtype="<f8").tobytes() for c in PARAM_COLUMNS),
+        "int_mask": b"".join(bytes(ct.int_mask[c]) for c in PARAM_COLUMNS),
+        "csr_offsets": np.frombuffer(ct.offsets, dtype="<i4").tobytes(),
+        "targets": np.frombuffer(ct.targets, dtype="<i4").tobytes(),
+        "splits": np.frombuffer(ct.splits, dtype="<f8").tobytes(),
+        "edge_order": np.frombuffer(ct.edge_order, dtype="<i4").tobytes(),
+        "meta": json.dumps(meta, separators=(",", ":")).encode("utf-8"),
+    }
+    pos = _align(_HEADER.size)
+    layout = []
+    for name in _SECTIONS:
+        layout += [pos, len(blobs[name])]
+        pos = _align(pos + len(blobs[name]))
+    header = _HEADER.pack(MAGIC, VERSION, 0, n, m, len(PARAM_COLUMNS), len(strings), *layout)
+    with open(path, "wb") as f:
+        f.write(header)
+        for name, (off, size) in zip(_SECTIONS, zip(layout[::2], layout[1::2])):
+            f.seek(off)
+            f.write(blobs[name])
+        f.truncate(pos)
+
+
+class TwinFile:
+    """Lazy, read-only view of a `.dtwin` file."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self._mm, 0)
+        magic, version = fields[0], fields[1]
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a DTWN file")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported DTWN version {version}")
+        self.n_nodes, self.n_edges, self.n_columns, self.n_strings = fields[3:7]
+        raw = fields[7:]
+        self._sections = {name: (raw[2 * i], raw[2 * i + 1]) for i, name in enumerate(_SECTIONS)}
+        self._views: Dict[str, np.ndarray] = {}
+        self._meta: Optional[Dict[str, Any]] = None
+
+    def close(self) -> None:
+        self._views.clear()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "TwinFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _view(self, name: str, dtype: str) -> np.ndarray:
+        view = self._views.get(name)
+        if view is None:
+            off, size = self._sections[name]
+            view = np.frombuffer(self._mm, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=off)
+            self._views[name] = view
+        return view
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        if self._meta is None:
+            off, size = self._sections["meta"]
+            self._meta = json.loads(self._mm[off:off + size])
+        return self._meta
+
+    def string(self, i: int) -> str:
+        offsets = self._view("str_offsets", "<u4")
+        off, _ = self._sections["str_blob"]
+        return self._mm[off + int(offsets[i]):off + int(offsets[i + 1])].decode("utf-8")
+
+    @property
+    def twin_id(self) -> str:
+        return self.string(0)
+
+    def node_id(self, i: int) -> str:
+        return self.string(2 + i)
+
+    def station_type(self, i: int) -> Optional[str]:
+        k = int(self._view("station_type", "<i4")[i])
+        return self.string(2 + self.n_nodes + k) if k >= 0 else None
+
+    def stations(self) -> np.ndarray:
+        return np.flatnonzero(self.kinds == KINDS.index("station"))
+
+    @property
+    def kinds(self) -> np.ndarray:
+        return self._view("kinds", "i1")
+
+    def column(self, name: str) -> np.ndarray:
+        """Zero-copy view of one param column (NaN where absent)."""
+        k = self.meta["columns"].index(name)
+        return self._view("columns", "<f8")[k * self.n_nodes:(k + 1) * self.n_nodes]
+
+    @property
+    def csr(self) -> Dict[str, np.ndarray]:
+        return {
+            "offsets": self._view("csr_offsets", "<i4"),
+            "targets": self._view("targets", "<i4"),
+            "splits": self._view("splits", "<f8"),
+        }
+
+    def to_twin(self) -> Dict[str, Any]:
+        meta = self.meta
+        n = self.n_nodes
+        columns = meta["columns"]
+        values = self._view("columns", "<f8").reshape(len(columns), n).tolist()
+        int_mask = self._view("int_mask", "u1").reshape(len(columns), n).tolist()
+        has_params = self._view("has_params", "u1").tolist()
+        kinds = self.kinds.tolist()
+        n_types = self.n_strings - 2 - n
+        types = [self.string(2 + n + k) for k in range(n_types)]
+        station_type = self._view("station_type", "<i4").tolist()
+        ids = [self.node_id(i) for i in range(n)]
+        extra_params = meta["extra_params"]
+        extra_nodes = meta["extra_nodes"]
+        extra_edges = meta.get("extra_edges", {})
+
+        nodes: List[Dict[str, Any]] = []
+        for i in range(n):
+            node: Dict[str, Any] = {"id": ids[i], "kind": KINDS[kinds[i]]}
+            if station_type[i] >= 0:
+                node["station_type"] = types[station_type[i]]
+            if has_params[i]:
+                params = {}
+                for k, name in enumerate(columns):
+                    v = values[k][i]
+                    if v == v:
+                        params[name] = int(v) if int_mask[k][i] else v
+                params.update(extra_params.get(str(i), {}))
+                node["params"] = params
+            node.update(extra_nodes.get(str(i), {}))
+            nodes.append(node)
+
+        csr = self.csr
+        offsets, targets, splits = csr["offsets"].tolist(), csr["targets"].tolist(), csr["splits"].tolist()
+        order = self._view("edge_order", "<i4").tolist()
+        edges: List[Any] = [None] * self.n_edges
+        for u in range(n):
+            for p in range(offsets[u], offsets[u + 1]):
+                edge = {"from": ids[u], "to": ids[targets[p]]}
+                if splits[p] == splits[p]:
+                    edge["split"] = int(splits[p]) if splits[p].is_integer() else splits[p]
+                edge.update(extra_edges.get(str(order[p]), {}))
+                edges[order[p]] = edge
+        twin = {"twin_id": self.twin_id, "type": self.string(1), "nodes": nodes, "edges": edges}
+        twin.update(meta["extra"])
+        return twin
+
+    def line_graph(self) -> LineGraph:
+        """`LineGraph` for the KPI engine, built from the mapped columns and CSR.
+
+        Only ids, kinds, engine params and edges are read; station types,
+        non-standard keys and extras other than `quality` are never decoded.
+        """
+        n = self.n_nodes
+        columns = self.meta["columns"]
+        block = self._view("columns", "<f8").reshape(len(columns), n)
+        kinds = self.kinds.tolist()
+        # id dei nodi da un'unica fetta del blob
+        offsets = self._view("str_offsets", "<u4")[2:n + 3].tolist()
+        off, _ = self._sections["str_blob"]
+        blob = self._mm[off + offsets[0]:off + offsets[-1]]
+        ids = [blob[a - offsets[0]:b - offsets[0]].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+        stations = self.stations()
+        values = {name: block[columns.index(name)][stations].tolist()
+                  for name in ENGINE_PARAMS if name in columns}
+        nodes: List[Dict[str, Any]] = [{"id": ids[i], "kind": KINDS[kinds[i]]} for i in range(n)]
+        for j, u in enumerate(stations.tolist()):
+            # NaN = parametro assente: il motore usa il suo default
+            nodes[u]["params"] = {name: col[j] for name, col in values.items() if col[j] == col[j]}
+
+        csr = self.csr
+        offsets, targets, splits = csr["offsets"].tolist(), csr["targets"].tolist(), csr["splits"].tolist()
+        order = self._view("edge_order", "<i4").tolist()
+        edges: List[Any] = [None] * self.n_edges
+        for u in range(n):
+            for p in range(offsets[u], offsets[u + 1]):
+                edge = {"from": ids[u], "to": ids[targets[p]]}
+                if splits[p] == splits[p]:
+                    edge["split"] = splits[p]
+                edges[order[p]] = edge
+        return LineGraph(nodes, edges, rework_settings(self.meta["extra"].get("quality")))
+
+
+def is_binary(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == MAGIC
+
+
+def load_twin(path: str) -> Dict[str, Any]:
+    """Load a twin from either a `.dtwin` or a JSON file."""
+    if is_binary(path):
+        with TwinFile(path) as tf:
+            return tf.to_twin()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_twin(twin: Dict[str, Any], path: str) -> None:
+    if path.endswith(".dtwin"):
+        write_twin(twin, path)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(twin, f, indent=2)
+
+
+def _bench(n_stations: int, repeat: int) -> None:
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    from api import compile_twin
+
+    stations = [{"id": f"S{i}", "type": "assembly", "cycle_time_s": 10 + i % 7,
+                 "availability_pct": 90, "scrap_rate_pct": 0.5} for i in range(n_stations)]
+    twin = compile_twin({"line": {"line_name": "Bench", "shift_hours": 8, "target_throughput_pph": 200},
+                         "stations": stations, "quality": {}, "data": {"mode": "simulation"}})
+
+    def run(label, fn):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:<34} {best * 1e3:9.3f} ms  peak {peak / 1e6:8.2f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "twin.json")
+        bin_path = os.path.join(tmp, "twin.dtwin")
+        save_twin(twin, json_path)
+        write_twin(twin, bin_path)
+        print(f"{n_stations} stations: json {os.path.getsize(json_path) / 1e3:.0f} kB, "
+              f"dtwin {os.path.getsize(bin_path) / 1e3:.0f} kB")
+
+        def json_column():
+            t = load_twin(json_path)
+            return sum(n["params"]["cycle_time_s"] for n in t["nodes"] if n["kind"] == "station")
+
+        def bin_column():
+            with TwinFile(bin_path) as tf:
+                return float(np.nansum(tf.column("cycle_time_s")))
+
+        def bin_full():
+            with TwinFile(bin_path) as tf:
+                return tf.to_twin()
+
+        assert load_twin(bin_path) == twin
+        run("json: load + read one column", json_column)
+        run("dtwin: map + read one column", bin_column)
+        run("dtwin: map + full decode", bin_full)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DTWN binary twin format tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("to-bin", help="convert twin.json to .dtwin")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p = sub.add_parser("to-json", help="convert .dtwin to twin.json")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p = sub.add_parser("bench", help="compare JSON and DTWN load time and peak memory")
+    p.add_argument("--stations", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "to-bin":
+        write_twin(load_twin(args.src), args.dst)
+    elif args.command == "to-json":
+        save_twin(load_twin(args.src), args.dst)
+    else:
+        _bench(args.stations, args.repeat)
@@ -0,0 +1,394 @@
+"""Indexed graph view of a compiled twin and the flow-based KPI engine.
+
+`LineGraph.from_twin` turns the `nodes`/`edges` lists of a twin into integer
+indexed adjacency lists plus a topological order, in a single pass. The KPI
+engine then walks that order once (O(V+E)) to propagate how many parts reach
+each node per part released by the source, and derives the line throughput
+from the most constrained station.
+
+Rework and cyclic routing. When the twin's `quality` block has both
+`inspection_enabled` and `rework_enabled`, detected defects (the station's
+`scrap_rate_pct`) go to a shared rework cell (`rework_cycle_time_s`, one
+operator) and come back to the station that made them for reprocessing;
+`rework_yield_pct` (default 100) of them make it back, the rest are
+scrapped. Without inspection defects are not caught and nothing is
+reworked. Rework loops, and edges that route parts back upstream, make the
+graph cyclic: visits are then solved from the routing matrix by
+`routing.RoutingSolver` instead of the topological walk, and the rework
+cell counts as a station (`REWORK`) in the bottleneck search.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from routing import RoutingSolver, solver_for
+
+REWORK_ID = "REWORK"
+# indice del rework nei risultati per nodo (non è un nodo del grafo)
+REWORK = -1
+DEFAULT_REWORK_CYCLE_S = 60.0
+
+
+def rework_settings(quality: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+    """(rework cycle s, rework yield) when detected defects are reworked, else None."""
+    if not quality or not quality.get("inspection_enabled") or not quality.get("rework_enabled"):
+        return None
+    cycle = float(quality.get("rework_cycle_time_s", DEFAULT_REWORK_CYCLE_S))
+    if cycle <= 0:
+        raise ValueError("rework_cycle_time_s must be > 0")
+    rework_yield = float(quality.get("rework_yield_pct", 100.0)) / 100.0
+    if not 0.0 <= rework_yield <= 1.0:
+        raise ValueError("rework_yield_pct must be between 0 and 100")
+    return cycle, rework_yield
+
+
+class LineGraph:
+    __slots__ = ("ids", "index", "kinds", "nodes", "succ", "pred", "n_pred", "order", "rework", "_routing")
+
+    def __init__(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]],
+                 rework: Optional[Tuple[float, float]] = None):
+        self.nodes = nodes
+        self.rework = rework
+        self._routing: Optional[Tuple[RoutingSolver, np.ndarray, np.ndarray, np.ndarray]] = None
+        self.ids: List[str] = [n["id"] for n in nodes]
+        self.kinds: List[str] = [n["kind"] for n in nodes]
+        self.index: Dict[str, int] = {node_id: i for i, node_id in enumerate(self.ids)}
+        if len(self.index) != len(self.ids):
+            raise ValueError("duplicate node id in twin")
+
+        # succ[u] = [(v, share), ...] with shares normalized per node
+        succ: List[List[Tuple[int, float]]] = [[] for _ in nodes]
+        n_pred = [0] * len(nodes)
+        for e in edges:
+            try:
+                u = self.index[e["from"]]
+                v = self.index[e["to"]]
+            except KeyError as exc:
+                raise ValueError(f"edge references unknown node {exc.args[0]!r}") from None
+            succ[u].append((v, float(e.get("split", 1.0))))
+            n_pred[v] += 1
+        for u, out in enumerate(succ):
+            total = sum(w for _, w in out)
+            if total <= 0 and out:
+                raise ValueError(f"node {self.ids[u]!r} has no positive split weight")
+            if out:
+                succ[u] = [(v, w / total) for v, w in out]
+        pred: List[List[Tuple[int, float]]] = [[] for _ in nodes]
+        for u, out in enumerate(succ):
+            for v, share in out:
+                pred[v].append((u, share))
+        self.succ = succ
+        self.pred = pred
+        self.n_pred = n_pred
+        # None se il grafo ha cicli: le visite passano dal solver di routing
+        self.order = self._topological_order()
+
+    @classmethod
+    def from_twin(cls, twin: Dict[str, Any]) -> "LineGraph":
+        return cls(twin["nodes"], twin["edges"], rework_settings(twin.get("quality")))
+
+    @property
+    def routed(self) -> bool:
+        """True when visits need the routing-matrix solve (rework or cycles)."""
+        return self.rework is not None or self.order is None
+
+    def label(self, u: int) -> str:
+        return REWORK_ID if u == REWORK else self.ids[u]
+
+    def routing(self) -> Tuple[RoutingSolver, np.ndarray, np.ndarray, np.ndarray]:
+        """(solver, edge sources, edge shares, explicit self-loop share per node)."""
+        if self._routing is None:
+            src, dst, share = [], [], []
+            self_share = np.zeros(len(self.ids))
+            for u, out in enumerate(self.succ):
+                for v, w in out:
+                    if v == u:
+                        self_share[u] += w
+                    else:
+                        src.append(u)
+                        dst.append(v)
+                        share.append(w)
+            src_a = np.array(src, dtype=np.intp)
+            sources = np.array([u for u, k in enumerate(self.kinds) if k == "source"], dtype=np.intp)
+            solver = solver_for(len(self.ids), src_a, np.array(dst, dtype=np.intp), sources)
+            self._routing = (solver, src_a, np.array(share, dtype=np.float64), self_share)
+        return self._routing
+
+    def _topological_order(self) -> Optional[List[int]]:
+        indeg = list(self.n_pred)
+        stack = [i for i, d in enumerate(indeg) if d == 0]
+        order: List[int] = []
+        while stack:
+            u = stack.pop()
+            order.append(u)
+            for v, _ in self.succ[u]:
+                indeg[v] -= 1
+                if indeg[v] == 0:
+                    stack.append(v)
+        if len(order) != len(self.ids):
+            return None
+        return order
+
+    def stations(self) -> List[int]:
+        return [i for i, kind in enumerate(self.kinds) if kind == "station"]
+
+
+def station_capacity_pph(params: Dict[str, Any]) -> float:
+    """Parts per hour a station can process (before scrap)."""
+    cycle = float(params["cycle_time_s"])
+    if cycle <= 0:
+        raise ValueError("cycle_time_s must be > 0")
+    availability = float(params["availability_pct"]) / 100.0
+    machines = int(params.get("machines", 1))
+    return machines * (3600.0 / cycle) * availability
+
+
+def routed_flows(graph: LineGraph) -> Tuple[List[float], float]:
+    """Visits per node and parts sent to rework, per released part, from the routing matrix."""
+    solver, src, share, self_share = graph.routing()
+    scrap = np.zeros(len(graph.ids))
+    for u in graph.stations():
+        scrap[u] = float(graph.nodes[u]["params"].get("scrap_rate_pct", 0.0)) / 100.0
+    keep = 1.0 - scrap
+    stay = self_share * keep
+    if graph.rework is not None:
+        stay = stay + scrap * graph.rework[1]
+    visits = solver.solve(share * keep[src], stay)
+    rework_visits = float(scrap @ visits) if graph.rework is not None else 0.0
+    return visits.tolist(), rework_visits
+
+
+def propagate_visits(graph: LineGraph) -> List[float]:
+    """Parts reaching each node per part released by every source."""
+    if graph.routed:
+        return routed_flows(graph)[0]
+    visits = [0.0] * len(graph.ids)
+    for u in graph.order:
+        kind = graph.kinds[u]
+        if kind == "source":
+            visits[u] = 1.0
+            out = 1.0
+        elif kind == "station":
+            scrap = float(graph.nodes[u]["params"].get("scrap_rate_pct", 0.0)) / 100.0
+            out = visits[u] * (1.0 - scrap)
+        else:
+            continue
+        for v, share in graph.succ[u]:
+            visits[v] += out * share
+    return visits
+
+
+def line_kpis(graph: LineGraph) -> Dict[str, Any]:
+    """Throughput, bottleneck and per-station load of a compiled line.
+
+    `cycle_time_s`, `availability` and `scrap_rate` describe the bottleneck
+    station; the per-station breakdown is only added for multi-station lines.
+    """
+    if graph.routed:
+        visits, rework_visits = routed_flows(graph)
+    else:
+        visits, rework_visits = propagate_visits(graph), 0.0
+    capacity = {u: station_capacity_pph(graph.nodes[u]["params"]) for u in graph.stations()}
+    return kpis_from_flows(graph, visits, capacity, rework_visits=rework_visits)
+
+
+def kpis_from_flows(graph: LineGraph, visits: List[float], capacity: Dict[int, float],
+                    breakdown: bool = True, rework_visits: float = 0.0) -> Dict[str, Any]:
+    """Build the KPI dict from per-node visits and per-station capacity.
+
+    With rework, `rework_visits` (parts sent to rework per released part)
+    loads the rework cell, which can be the bottleneck.
+    """
+    stations = graph.stations()
+    if not stations:
+        raise ValueError("twin has no station node")
+
+    release_rate = float("inf")
+    bottleneck = None
+    for u in stations:
+        if visits[u] > 0:
+            rate = capacity[u] / visits[u]
+            if rate < release_rate:
+                release_rate = rate
+                bottleneck = u
+    if bottleneck is None:
+        raise ValueError("no station is reachable from a source")
+    rework_capacity = 3600.0 / graph.rework[0] if graph.rework is not None else 0.0
+    if rework_visits > 0 and rework_capacity / rework_visits < release_rate:
+        release_rate = rework_capacity / rework_visits
+        bottleneck = REWORK
+
+    out_per_release = sum(visits[u] for u, k in enumerate(graph.kinds) if k == "sink")
+    if bottleneck == REWORK:
+        cycle, rework_yield = graph.rework
+        kpis = {
+            "throughput_pph": round(release_rate * out_per_release, 2),
+            "cycle_time_s": cycle,
+            "availability": 1.0,
+            "scrap_rate": round(1.0 - rework_yield, 6),
+            "bottleneck": REWORK_ID,
+        }
+    else:
+        p = graph.nodes[bottleneck]["params"]
+        kpis = {
+            "throughput_pph": round(release_rate * out_per_release, 2),
+            "cycle_time_s": float(p["cycle_time_s"]),
+            "availability": float(p["availability_pct"]) / 100.0,
+            "scrap_rate": float(p.get("scrap_rate_pct", 0.0)) / 100.0,
+            "bottleneck": graph.ids[bottleneck],
+        }
+    if graph.rework is not None:
+        kpis["rework_pph"] = round(release_rate * rework_visits, 2)
+    if breakdown and (len(stations) > 1 or graph.rework is not None):
+        kpis["stations"] = [
+            {
+                "id": graph.ids[u],
+                "capacity_pph": round(capacity[u], 2),
+                "effective_rate_pph": round(release_rate * visits[u], 2),
+                "utilization": round(release_rate * visits[u] / capacity[u], 4),
+            }
+            for u in stations
+        ]
+        if graph.rework is not None:
+            kpis["stations"].append({
+                "id": REWORK_ID,
+                "capacity_pph": round(rework_capacity, 2),
+                "effective_rate_pph": round(release_rate * rework_visits, 2),
+                "utilization": round(release_rate * rework_visits / rework_capacity, 4),
+            })
+    return kpis
+
+
+class IncrementalLine:
+    """KPI state of one twin that can be refreshed after param changes.
+
+    Visits and capacities are kept between calls. A capacity-only change
+    (cycle time, availability, machines) refreshes that station alone; a
+    scrap change re-propagates visits through the changed nodes' downstream
+    cone only, in topological order. With rework or cycles a scrap change
+    re-solves the routing matrix, refactoring only the loops it touches.
+    """
+
+    __slots__ = ("graph", "visits", "rework_visits", "capacity", "pos")
+
+    def __init__(self, twin: Dict[str, Any]):
+        self.graph = LineGraph.from_twin(twin)
+        self.rework_visits = 0.0
+        if self.graph.routed:
+            self.visits, self.rework_visits = routed_flows(self.graph)
+        else:
+            self.visits = propagate_visits(self.graph)
+        self.capacity = {u: station_capacity_pph(self.graph.nodes[u]["params"]) for u in self.graph.stations()}
+        self.pos = {u: i for i, u in enumerate(self.graph.order or ())}
+
+    def _downstream(self, roots: List[int]) -> List[int]:
+        seen = set()
+        stack = list(roots)
+        while stack:
+            u = stack.pop()
+            for v, _ in self.graph.succ[u]:
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+        return sorted(seen, key=lambda u: self.pos.get(u, u))
+
+    def _out(self, u: int) -> float:
+        kind = self.graph.kinds[u]
+        if kind == "source":
+            return 1.0
+        if kind == "station":
+            scrap = float(self.graph.nodes[u]["params"].get("scrap_rate_pct", 0.0)) / 100.0
+            return self.visits[u] * (1.0 - scrap)
+        return 0.0
+
+    def update(self, changed: Dict[int, List[str]]) -> int:
+        """Refresh after `changed[node] = [param, ...]`; returns nodes touched."""
+        scrap_roots = [u for u, names in changed.items() if "scrap_rate_pct" in names]
+        touched = set(changed)
+        if self.graph.routed:
+            if scrap_roots:
+                self.visits, self.rework_visits = routed_flows(self.graph)
+                touched.update(self._downstream(scrap_roots))
+        else:
+            for v in self._downstream(scrap_roots):
+                self.visits[v] = sum(self._out(u) * share for u, share in self.graph.pred[v])
+                touched.add(v)
+        for u, names in changed.items():
+            if u in self.capacity and any(n != "scrap_rate_pct" for n in names):
+                self.capacity[u] = station_capacity_pph(self.graph.nodes[u]["params"])
+        return len(touched)
+
+    def kpis(self, breakdown: bool = True) -> Dict[str, Any]:
+        return kpis_from_flows(self.graph, self.visits, self.capacity, breakdown, self.rework_visits)
+
+
+def vector_throughput(graph: LineGraph, overrides: Dict[Tuple[int, str], Any]) -> Tuple[Any, Any]:
+    """Line throughput with some station params replaced by NumPy arrays.
+
+    `overrides` maps `(node_index, param_name)` to arrays that broadcast
+    against each other; the result has the broadcast shape. Returns the
+    throughput (pph) and the node index of the bottleneck for every point
+    (`REWORK` for the rework cell). On a cyclic line scrap cannot be swept.
+    """
+    def param(u: int, name: str, default: float) -> Any:
+        value = overrides.get((u, name))
+        if value is None:
+            value = float(graph.nodes[u]["params"].get(name, default))
+        return value
+
+    rework_visits: Any = 0.0
+    if graph.order is None:
+        if any(name == "scrap_rate_pct" for _, name in overrides):
+            raise ValueError("scrap_rate_pct cannot be varied on a line with cyclic routing")
+        visits, rework_visits = routed_flows(graph)
+    else:
+        visits = [0.0] * len(graph.ids)
+        for u in graph.order:
+            kind = graph.kinds[u]
+            if kind == "source":
+                visits[u] = 1.0
+                out = 1.0
+            elif kind == "station":
+                scrap = param(u, "scrap_rate_pct", 0.0) / 100.0
+                if graph.rework is not None:
+                    # rilavorazione sulla stessa stazione: serie geometrica del ciclo u -> rework -> u
+                    visits[u] = visits[u] / (1.0 - scrap * graph.rework[1])
+                    rework_visits = rework_visits + scrap * visits[u]
+                out = visits[u] * (1.0 - scrap)
+            else:
+                continue
+            for v, share in graph.succ[u]:
+                visits[v] = visits[v] + out * share
+
+    release = None
+    bottleneck = None
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for u in graph.stations():
+            if np.isscalar(visits[u]) and visits[u] == 0:
+                continue
+            cycle = param(u, "cycle_time_s", 0.0)
+            cap = param(u, "machines", 1) * (3600.0 / cycle) * (param(u, "availability_pct", 0.0) / 100.0)
+            rate = np.asarray(cap / visits[u], dtype=np.float64)
+            if release is None:
+                release = rate
+                bottleneck = np.full(rate.shape, u, dtype=np.int32)
+            else:
+                release, rate = np.broadcast_arrays(release, rate)
+                bottleneck = np.broadcast_to(bottleneck, release.shape)
+                bottleneck = np.where(rate < release, u, bottleneck)
+                release = np.minimum(release, rate)
+    if release is None:
+        raise ValueError("no station is reachable from a source")
+    if graph.rework is not None:
+        with np.errstate(divide="ignore"):
+            rate = np.asarray(3600.0 / graph.rework[0] / np.asarray(rework_visits, dtype=np.float64))
+        release, rate = np.broadcast_arrays(release, rate)
+        bottleneck = np.where(rate < release, REWORK, np.broadcast_to(bottleneck, release.shape))
+        release = np.minimum(release, rate)
+
+    out_per_release = 0.0
+    for u, kind in enumerate(graph.kinds):
+        if kind == "sink":
+            out_per_release = out_per_release + visits[u]
+    return release * out_per_release, bottleneck
@@ -0,0 +1,473 @@
+"""Persistent registry of compiled twins with incremental patching.
+
+Twins live in a local SQLite file as a snapshot plus an append-only log of
+JSON-Patch operations. Patching a station param applies the ops in place,
+appends them to the log and refreshes the KPIs through `IncrementalLine`
+(only the changed nodes and their downstream cone). The patch response carries
+the line-level KPIs; the per-station breakdown is built on the next `get`.
+The full twin is re-snapshotted every `SNAPSHOT_EVERY` versions or after a
+structural change. KPIs are not stored: they are recomputed when a twin is
+loaded.
+
+In memory a twin is a `CompactTwin`; the dict twin and the KPI state
+(`IncrementalLine`) are built on demand and kept only for the
+`MAX_HOT_TWINS` most recently used twins, so tens of thousands of resident
+twins cost their compact size.
+
+Versions only grow, across deletes too: a deleted twin leaves its last
+version in `retired`, so caches keyed by `(twin_id, version)` never see
+the same key for two different twins.
+
+Patch paths follow RFC 6901 on the twin document; under `/nodes/` a node id
+may be used instead of the list index, e.g. `/nodes/S1/params/cycle_time_s`.
+Supported ops: `replace`, `add`, `remove`, `test`.
+"""
+
+import copy
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from compact_twin import CompactTwin
+from template_validation import TwinChecker
+from twin_graph import IncrementalLine
+
+SNAPSHOT_EVERY = 64
+# twin tenuti anche come dict + stato KPI; gli altri restano solo in forma compatta
+MAX_HOT_TWINS = 1024
+
+_OPS = ("replace", "add", "remove", "test")
+_PARAM_OPS = ("replace", "add", "test")
+_MISSING = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS twins (
+    twin_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    snapshot_version INTEGER NOT NULL,
+    twin TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    tags TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS patches (
+    twin_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    ops TEXT NOT NULL,
+    PRIMARY KEY (twin_id, version)
+);
+CREATE TABLE IF NOT EXISTS retired (
+    twin_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class PatchError(ValueError):
+    pass
+
+
+class VersionConflict(Exception):
+    pass
+
+
+def _pointer(path: str) -> List[str]:
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"invalid JSON pointer {path!r}")
+    return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+
+
+def _check_ops(ops: Any) -> None:
+    """Raise PatchError unless `ops` is a list of well-formed op objects."""
+    if not isinstance(ops, list):
+        raise PatchError("ops must be a list")
+    for op in ops:
+        if not isinstance(op, dict) or "op" not in op or "path" not in op:
+            raise PatchError("each op needs 'op' and 'path'")
+        if op["op"] not in _OPS:
+            raise PatchError(f"unsupported op {op['op']!r}")
+        _pointer(op["path"])
+        if op["op"] in ("replace", "add") and "value" not in op:
+            raise PatchError(f"op {op['op']!r} needs a value")
+
+
+def _check_shape(twin: Dict[str, Any]) -> None:
+    """Raise PatchError if a structural patch left sections or nodes/edges that are not objects."""
+    for name in ("line", "quality", "data"):
+        if not isinstance(twin.get(name, {}), dict):
+            raise PatchError(f"{name} must be an object")
+    for name in ("nodes", "edges"):
+        items = twin.get(name)
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise PatchError(f"{name} must be a list of objects")
+    for node in twin["nodes"]:
+        if not isinstance(node.get("params", {}), dict):
+            raise PatchError(f"params of node {node.get('id')!r} must be an object")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def twin_tags(twin: Dict[str, Any]) -> Dict[str, str]:
+    tags = twin.get("line", {}).get("tags") or {}
+    return {str(k): str(v) for k, v in tags.items()} if isinstance(tags, dict) else {}
+
+
+def kpi_summary(twin: Dict[str, Any], kpis: Dict[str, Any]) -> Dict[str, Any]:
+    """Line-level numbers fleet aggregation and capacity planning need for one twin."""
+    line = twin.get("line", {})
+    target = line.get("target_throughput_pph")
+    # le stazioni si attrezzano in parallelo: la linea riparte dopo il setup più lungo
+    setup = max((float(n["params"].get("setup_time_s", 0.0)) for n in twin.get("nodes", []) if n.get("params")),
+                default=0.0)
+    return {
+        "throughput_pph": kpis["throughput_pph"],
+        "target_throughput_pph": float(target) if target is not None else None,
+        "bottleneck": kpis.get("bottleneck"),
+        "shift_hours": float(line.get("shift_hours", 8)),
+        "setup_time_s": setup,
+    }
+
+
+class _Entry:
+    """One twin in memory: a `CompactTwin` at rest, the dict twin and KPI state only while hot."""
+
+    __slots__ = ("compact", "version", "snapshot_version", "_twin", "_line", "_kpis")
+
+    def __init__(self, twin: Dict[str, Any], version: int, snapshot_version: int):
+        self.compact = CompactTwin.from_twin(twin)
+        self.version = version
+        self.snapshot_version = snapshot_version
+        self._twin: Optional[Dict[str, Any]] = twin
+        self._line: Optional[IncrementalLine] = None
+        self._kpis: Optional[Dict[str, Any]] = None
+
+    @property
+    def twin(self) -> Dict[str, Any]:
+        if self._twin is None:
+            self._twin = self.compact.to_twin()
+        return self._twin
+
+    @property
+    def line(self) -> IncrementalLine:
+        if self._line is None:
+            self._line = IncrementalLine(self.twin)
+        return self._line
+
+    @property
+    def kpis(self) -> Dict[str, Any]:
+        if self._kpis is None:
+            self._kpis = self.line.kpis()
+        return self._kpis
+
+    def sync(self, changed: Dict[int, List[str]]) -> None:
+        """Copy params patched in place on the dict twin into the compact form."""
+        for u in changed:
+            self.compact.set_params(u, self.twin["nodes"][u].get("params"))
+
+    def cool(self) -> None:
+        self._twin = self._line = self._kpis = None
+
+
+class TwinRegistry:
+    def __init__(self, path: str, checker: Optional[TwinChecker] = None):
+        self.path = path
+        # range dei template sui twin patchati (None: nessun controllo, es. worker in sola lettura)
+        self.checker = checker
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(twins)")}
+        if "tags" not in columns:
+            # registri creati prima dei tag
+            with self._db:
+                self._db.execute("ALTER TABLE twins ADD COLUMN tags TEXT NOT NULL DEFAULT '{}'")
+                for twin_id, twin_json in self._db.execute("SELECT twin_id, twin FROM twins").fetchall():
+                    self._db.execute("UPDATE twins SET tags = ? WHERE twin_id = ?",
+                                     (_dumps(twin_tags(json.loads(twin_json))), twin_id))
+        # indice coprente: `index()` legge solo questo, mai le pagine con il JSON dei twin
+        self._db.execute("CREATE INDEX IF NOT EXISTS twins_by_tags ON twins (tags, twin_id, version)")
+        self._lock = threading.RLock()
+        self._entries: Dict[str, _Entry] = {}
+        self._hot: "OrderedDict[str, None]" = OrderedDict()
+
+    def close(self) -> None:
+        self._db.close()
+
+    # ---- loading ----
+
+    def _keep(self, twin_id: str, entry: _Entry) -> None:
+        self._entries[twin_id] = entry
+        self._hot[twin_id] = None
+        self._hot.move_to_end(twin_id)
+        while len(self._hot) > MAX_HOT_TWINS:
+            cold, _ = self._hot.popitem(last=False)
+            self._entries[cold].cool()
+
+    def _forget(self, twin_id: str) -> None:
+        self._entries.pop(twin_id, None)
+        self._hot.pop(twin_id, None)
+
+    def _entry(self, twin_id: str) -> Optional[_Entry]:
+        entry = self._entries.get(twin_id)
+        if entry is not None:
+            self._keep(twin_id, entry)
+            return entry
+        row = self._db.execute(
+            "SELECT version, snapshot_version, twin FROM twins WHERE twin_id = ?", (twin_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        version, snapshot_version, twin_json = row
+        twin = json.loads(twin_json)
+        for (ops_json,) in self._db.execute(
+            "SELECT ops FROM patches WHERE twin_id = ? AND version > ? ORDER BY version",
+            (twin_id, snapshot_version)
+        ):
+            twin = self._apply(twin, json.loads(ops_json))
+        entry = _Entry(twin, version, snapshot_version)
+        self._keep(twin_id, entry)
+        return entry
+
+    # ---- JSON patch ----
+
+    def _resolve(self, twin: Dict[str, Any], parts: List[str]) -> Tuple[Any, str]:
+        """Return (container, last key) for a pointer, mapping node ids to indexes."""
+        target: Any = twin
+        for i, part in enumerate(parts[:-1]):
+            if isinstance(target, list):
+                if i == 1 and parts[0] == "nodes" and not part.isdigit():
+                    part = str(next((k for k, n in enumerate(target) if n.get("id") == part), -1))
+                try:
+                    target = target[int(part)]
+                except (ValueError, IndexError):
+                    raise PatchError(f"path segment {part!r} not found") from None
+            elif isinstance(target, dict) and part in target:
+                target = target[part]
+            else:
+                raise PatchError(f"path segment {part!r} not found")
+        if not isinstance(target, (list, dict)):
+            raise PatchError(f"path segment {parts[-2]!r} is not a container")
+        return target, parts[-1]
+
+    def _apply(self, twin: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply arbitrary ops to a copy of the twin (structural changes, log replay)."""
+        twin = copy.deepcopy(twin)
+        for op in ops:
+            try:
+                kind, parts = op["op"], _pointer(op["path"])
+            except (KeyError, TypeError):
+                raise PatchError("each op needs 'op' and 'path'") from None
+            container, key = self._resolve(twin, parts)
+            idx = -1
+            if isinstance(container, list):
+                idx = len(container) if key == "-" else int(key) if key.isdigit() else -1
+                if not 0 <= idx <= len(container) or (kind != "add" and idx == len(container)):
+                    raise PatchError(f"index {key!r} out of range")
+            if kind == "test":
+                current = container[idx] if isinstance(container, list) else container.get(key, _MISSING)
+                if current != op.get("value"):
+                    raise PatchError(f"test failed at {op['path']}")
+            elif kind in ("replace", "add"):
+                if "value" not in op:
+                    raise PatchError(f"op {kind!r} needs a value")
+                if isinstance(container, list):
+                    if kind == "add":
+                        container.insert(idx, op["value"])
+                    else:
+                        container[idx] = op["value"]
+                elif kind == "replace" and key not in container:
+                    raise PatchError(f"path {op['path']} not found")
+                else:
+                    container[key] = op["value"]
+            elif kind == "remove":
+                if isinstance(container, list):
+                    container.pop(idx)
+                elif key in container:
+                    del container[key]
+                else:
+                    raise PatchError(f"path {op['path']} not found")
+            else:
+                raise PatchError(f"unsupported op {kind!r}")
+        return twin
+
+    def _apply_params(self, entry: _Entry, ops: List[Dict[str, Any]]) -> Optional[Dict[int, List[str]]]:
+        """Apply param-only ops in place, O(1) per op.
+
+        Returns changed node index -> param names, or None (nothing applied)
+        when some op is not a station-param op and needs the generic path.
+        """
+        graph = entry.line.graph
+        targets = []
+        for op in ops:
+            try:
+                kind, parts = op["op"], _pointer(op["path"])
+            except (KeyError, TypeError):
+                raise PatchError("each op needs 'op' and 'path'") from None
+            if kind not in _PARAM_OPS or len(parts) != 4 or parts[0] != "nodes" or parts[2] != "params":
+                return None
+            u = int(parts[1]) if parts[1].isdigit() else graph.index.get(parts[1], -1)
+            if not 0 <= u < len(graph.ids) or graph.kinds[u] != "station":
+                return None
+            targets.append((kind, u, parts[3], op))
+
+        undo = []
+        changed: Dict[int, List[str]] = {}
+        try:
+            for kind, u, key, op in targets:
+                params = graph.nodes[u]["params"]
+                if kind == "test":
+                    if params.get(key, _MISSING) != op.get("value"):
+                        raise PatchError(f"test failed at {op['path']}")
+                    continue
+                if "value" not in op:
+                    raise PatchError(f"op {kind!r} needs a value")
+                if kind == "replace" and key not in params:
+                    raise PatchError(f"path {op['path']} not found")
+                undo.append((params, key, params.get(key, _MISSING)))
+                params[key] = op["value"]
+                changed.setdefault(u, []).append(key)
+        except PatchError:
+            for params, key, old in reversed(undo):
+                if old is _MISSING:
+                    del params[key]
+                else:
+                    params[key] = old
+            raise
+        return changed
+
+    # ---- public API ----
+
+    def put(self, twin: Dict[str, Any]) -> Dict[str, Any]:
+        twin_id = twin["twin_id"]
+        with self._lock:
+            current = self._entry(twin_id)
+            if current is not None:
+                version = current.version + 1
+            else:
+                # dopo una delete la versione riparte da dove era: le cache per (twin_id, version) restano valide
+                row = self._db.execute("SELECT version FROM retired WHERE twin_id = ?", (twin_id,)).fetchone()
+                version = (row[0] if row else 0) + 1
+            entry = _Entry(copy.deepcopy(twin), version, version)
+            # i KPI prima della scrittura: un twin che non si valuta non entra nel registro
+            kpis = entry.kpis
+            with self._db:
+                self._db.execute("DELETE FROM patches WHERE twin_id = ?", (twin_id,))
+                self._db.execute("DELETE FROM retired WHERE twin_id = ?", (twin_id,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO twins (twin_id, version, snapshot_version, twin, updated_at, tags) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (twin_id, version, version, _dumps(entry.twin), time.time(), _dumps(twin_tags(entry.twin)))
+                )
+            self._keep(twin_id, entry)
+            return {"twin_id": twin_id, "version": version, "kpis": kpis}
+
+    def get(self, twin_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entry(twin_id)
+            if entry is None:
+                return None
+            return {"twin_id": twin_id, "version": entry.version, "kpis": entry.kpis, "twin": entry.twin}
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT twin_id, version, updated_at FROM twins ORDER BY twin_id").fetchall()
+        return [{"twin_id": t, "version": v, "updated_at": u} for t, v, u in rows]
+
+    def index(self) -> List[Tuple[str, int, Dict[str, str]]]:
+        """(twin_id, version, tags) for every twin, without loading any twin."""
+        with self._lock:
+            rows = self._db.execute("SELECT twin_id, version, tags FROM twins").fetchall()
+        # poche combinazioni distinte di tag: si decodifica ognuna una volta
+        parsed: Dict[str, Dict[str, str]] = {}
+        out = []
+        for twin_id, version, tags in rows:
+            value = parsed.get(tags)
+            if value is None:
+                value = parsed[tags] = json.loads(tags)
+            out.append((twin_id, version, value))
+        return out
+
+    def summaries(self, twin_ids: List[str]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        """twin_id -> (version, kpi_summary) for the given twins."""
+        out = {}
+        with self._lock:
+            for twin_id in twin_ids:
+                entry = self._entry(twin_id)
+                if entry is not None:
+                    kpis = entry.line.kpis(breakdown=False) if entry._kpis is None else entry._kpis
+                    out[twin_id] = (entry.version, kpi_summary(entry.twin, kpis))
+        return out
+
+    def delete(self, twin_id: str) -> bool:
+        with self._lock, self._db:
+            self._forget(twin_id)
+            row = self._db.execute("SELECT version FROM twins WHERE twin_id = ?", (twin_id,)).fetchone()
+            if row is None:
+                return False
+            # l'ultima versione resta come lapide: un nuovo put prosegue da lì
+            self._db.execute("INSERT OR REPLACE INTO retired VALUES (?, ?)", (twin_id, row[0]))
+            self._db.execute("DELETE FROM patches WHERE twin_id = ?", (twin_id,))
+            self._db.execute("DELETE FROM twins WHERE twin_id = ?", (twin_id,))
+            return True
+
+    def patch(self, twin_id: str, ops: List[Dict[str, Any]], expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entry(twin_id)
+            if entry is None:
+                return None
+            if expected_version is not None and expected_version != entry.version:
+                raise VersionConflict(f"twin is at version {entry.version}")
+            _check_ops(ops)
+            version = entry.version + 1
+            changed = self._apply_params(entry, ops)
+            try:
+                if changed is None:
+                    twin = self._apply(entry.twin, ops)
+                    if twin.get("twin_id") != twin_id:
+                        raise PatchError("twin_id cannot be patched")
+                    _check_shape(twin)
+                    if self.checker is not None:
+                        self.checker.check_twin(twin)
+                    new = _Entry(twin, version, version)
+                    touched = len(twin["nodes"])
+                else:
+                    if self.checker is not None:
+                        for u in changed:
+                            self.checker.check_station(entry.line.graph.nodes[u])
+                    touched = entry.line.update(changed)
+                    new = entry
+                    new._kpis = None
+                new.version = version
+                kpis = new.line.kpis(breakdown=False)
+            except (KeyError, TypeError, ValueError) as e:
+                # lo stato in memoria potrebbe essere già stato modificato:
+                # verrà ricaricato dal database al prossimo accesso
+                self._forget(twin_id)
+                raise PatchError(str(e)) from e
+            if changed is not None:
+                new.sync(changed)
+            twin = new.twin
+
+            snapshot = changed is None or version - new.snapshot_version >= SNAPSHOT_EVERY
+            with self._db:
+                if snapshot:
+                    new.snapshot_version = version
+                    self._db.execute("DELETE FROM patches WHERE twin_id = ?", (twin_id,))
+                    self._db.execute(
+                        "UPDATE twins SET version = ?, snapshot_version = ?, twin = ?, updated_at = ?, tags = ? "
+                        "WHERE twin_id = ?",
+                        (version, version, _dumps(twin), time.time(), _dumps(twin_tags(twin)), twin_id)
+                    )
+                else:
+                    self._db.execute("INSERT INTO patches VALUES (?, ?, ?)", (twin_id, version, _dumps(ops)))
+                    self._db.execute(
+                        "UPDATE twins SET version = ?, updated_at = ? WHERE twin_id = ?",
+                        (version, time.time(), twin_id)
+                    )
+            self._keep(twin_id, new)
+            return {"twin_id": twin_id, "version": version, "kpis": kpis, "recomputed_nodes": touched}
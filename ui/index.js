@@ -0,0 +1,30 @@
+async function compute() {
+  const status = document.getElementById("status");
+  const out = document.getElementById("out");
+  status.textContent = "Running...";
+  out.textContent = "—";
+
+  let payload;
+  try {
+    payload = JSON.parse(document.getElementById("payload").value);
+  } catch (e) {
+    status.textContent = "JSON non valido";
+    out.textContent = String(e);
+    return;
+  }
+
+  try {
+    const res = await fetch("/compute-kpi", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload)
+    });
+
+    const data = await res.json();
+    status.textContent = res.ok ? "OK" : ("Error " + res.status);
+    out.textContent = JSON.stringify(data, null, 2);
+  } catch (e) {
+    status.textContent = "Request failed";
+    out.textContent = String(e);
+  }
+}
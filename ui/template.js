@@ -0,0 +1,93 @@
+let editor = null;
+
+async function fetchJSON(url) {
+  const res = await fetch(url);
+  return await res.json();
+}
+
+async function initTemplates() {
+  const templates = await fetchJSON('/templates');
+  const sel = document.getElementById('template');
+  sel.innerHTML = '';
+  templates.forEach(t => {
+    const opt = document.createElement('option');
+    opt.value = t.template_id;
+    opt.textContent = t.template_id + ' — ' + t.name;
+    sel.appendChild(opt);
+  });
+  sel.value = sel.dataset.default;
+  await loadTemplate();
+}
+
+async function loadTemplate() {
+  const status = document.getElementById('status');
+  status.textContent = 'Loading template...';
+  const templateId = document.getElementById('template').value;
+  const schema = await fetchJSON(`/templates/${templateId}/schema`);
+
+  if (schema.error) {
+    status.textContent = 'Template not found';
+    return;
+  }
+
+  if (typeof JSONEditor === 'undefined') {
+    status.textContent = 'Form editor not installed (python cli.py vendor-ui)';
+    return;
+  }
+
+  if (editor) {
+    editor.destroy();
+    editor = null;
+  }
+
+  JSONEditor.defaults.options.theme = 'html';
+  JSONEditor.defaults.options.iconlib = 'fontawesome5';
+
+  editor = new JSONEditor(document.getElementById('editor_holder'), {
+    schema: schema,
+    disable_collapse: true,
+    disable_properties: true,
+    no_additional_properties: true,
+    required_by_default: true
+  });
+
+  status.textContent = 'Template loaded';
+  document.getElementById('out').textContent = '—';
+}
+
+async function compute() {
+  const status = document.getElementById('status');
+  const out = document.getElementById('out');
+  out.textContent = '—';
+
+  if (!editor) {
+    status.textContent = 'No editor';
+    return;
+  }
+
+  const errors = editor.validate();
+  if (errors.length) {
+    status.textContent = 'Fix validation errors';
+    out.textContent = JSON.stringify(errors, null, 2);
+    return;
+  }
+
+  const instance = editor.getValue();
+  status.textContent = 'Running...';
+
+  try {
+    const res = await fetch('/compute-kpi', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ instance })
+    });
+    const data = await res.json();
+    status.textContent = res.ok ? 'OK' : ('Error ' + res.status);
+    out.textContent = JSON.stringify(data, null, 2);
+  } catch (e) {
+    status.textContent = 'Request failed';
+    out.textContent = String(e);
+  }
+}
+
+initTemplates();
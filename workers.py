@@ -0,0 +1,25 @@
+"""Process pool shared by the CPU-bound engines.
+
+The pool is created lazily on first use and sized by `DTAAS_WORKERS`
+(default: number of CPUs), so importing the service never forks.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def worker_count() -> int:
+    return int(os.environ.get("DTAAS_WORKERS", os.cpu_count() or 1))
+
+
+def process_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=worker_count())
+        return _pool